@@ -0,0 +1,535 @@
+"""
+A MUD server module built on asyncio, for games with lots of players.
+
+Contains two classes. AsyncMudServer does the same job as MudServer, but runs
+in an asyncio event loop: the game awaits events as they happen instead of
+calling 'update' in a loop. SyncMudServer runs an AsyncMudServer in a
+background thread and gives it the same methods as MudServer, so a game written
+for MudServer can use it without any changes.
+
+Requires Python 3.7 or later.
+"""
+
+
+import time
+import queue
+import asyncio
+import threading
+import collections
+
+from mudserver import MudServer, NewPlayer, PlayerLeft, Command
+from timers import TimerWheel
+
+
+class AsyncMudServer(object):
+    """
+    A server for text-based Multi-User Dungeon (MUD) games which runs in an
+    asyncio event loop.
+
+    Once started with 'start', the server listens for players connecting using
+    Telnet. Each player is looked after by their own task, which reads what they
+    send and puts the result in a queue of events. The game takes events out of
+    the queue with 'get_event', waiting until one arrives, and replies with
+    'send_message'.
+
+    Events are tuples: a new player is (EVENT_NEW_PLAYER, id), a player leaving
+    is (EVENT_PLAYER_LEFT, id), and a command is (EVENT_COMMAND, id, command,
+    params).
+    """
+
+    # The kinds of event
+    EVENT_NEW_PLAYER = 1
+    EVENT_PLAYER_LEFT = 2
+    EVENT_COMMAND = 3
+
+    events = None          # queue of occurrences waiting to be handled by the game
+    _server = None         # the asyncio server listening for new clients
+    _host = ""             # the address of the network interface to listen on
+    _port = 0              # the port to listen on
+    _reuse_port = False    # whether other servers may listen on the same port
+    _backlog = 0           # how many connections may wait to be accepted
+    _clients = {}          # holds info on clients. Maps client id to MudServer.Client
+    _writers = {}          # the stream each client's output is written to. Maps client id to StreamWriter
+    _nextid = 0            # counter for assigning each client a new id
+    _output_limit = 0      # most unsent bytes we'll hold for a client
+    _command_rate = None   # commands per second each client may send
+    _command_burst = 0     # commands a client may send at once before being held back
+    _max_line_length = 0   # longest line we accept from a client
+    _idle_timeout = None   # seconds a client may go without sending anything
+    _keepalive = None      # (idle, interval, count) for checking connections are still there
+
+    commands_throttled = 0 # number of commands which were held back by the rate limit
+    lines_truncated = 0    # number of lines which were cut short for being too long
+
+    def __init__(self, port=23, backlog=4096, output_limit=65536, command_rate=10.0,
+                 command_burst=20, max_line_length=4096, host="0.0.0.0", reuse_port=False,
+                 idle_timeout=None, keepalive_idle=60, keepalive_interval=10, keepalive_count=6):
+        """
+        Constructs the AsyncMudServer object. It doesn't start listening for
+        players until 'start' is awaited. 'host', 'backlog', 'reuse_port',
+        'idle_timeout' and the 'keepalive' settings are the same as MudServer's.
+
+        Messages to players are written to their connection's buffer, and sent
+        by the event loop as fast as the player reads them. A player who falls
+        more than 'output_limit' bytes behind is disconnected.
+
+        Each player may send 'command_burst' commands in one go, and after that
+        'command_rate' commands per second. When a player goes over the limit we
+        simply stop reading from their connection until they're allowed another
+        command, so they can't get ahead of us however fast they type. A
+        'command_rate' of None turns the limit off. Lines longer than
+        'max_line_length' are cut short.
+        """
+        self._host = host
+        self._port = port
+        self._reuse_port = reuse_port
+        self._backlog = backlog
+        self._clients = {}
+        self._writers = {}
+        self._nextid = 0
+        self._output_limit = output_limit
+        self._command_rate = command_rate
+        self._command_burst = command_burst
+        self._max_line_length = max_line_length
+        self._idle_timeout = idle_timeout
+        self._keepalive = None
+        if keepalive_idle is not None:
+            self._keepalive = (keepalive_idle, keepalive_interval, keepalive_count)
+        self.commands_throttled = 0
+        self.lines_truncated = 0
+
+    async def start(self):
+        """
+        Starts listening for new players on the port given when the server was
+        constructed. Must be awaited from inside the event loop the server will
+        run in.
+        """
+        # the queue is made here rather than in the constructor, so that it
+        # belongs to the event loop the server actually runs in
+        self.events = asyncio.Queue()
+
+        # each player who connects gets their own task, running '_serve_client'
+        self._server = await asyncio.start_server(self._serve_client, self._host, self._port,
+                                                  backlog=self._backlog, reuse_address=True,
+                                                  reuse_port=self._reuse_port or None)
+
+    async def get_event(self):
+        """
+        Waits until something happens, and returns the event describing it. See
+        the class description for the forms events take.
+        """
+        return await self.events.get()
+
+    async def send_message(self, to, message):
+        """
+        Sends the text in the 'message' parameter to the player with the id
+        number given in the 'to' parameter. The text will be printed out in the
+        player's terminal. 'message' can also be bytes returned by
+        'encode_message'.
+
+        This never waits for a slow player: the message is added to their
+        connection's buffer and sent by the event loop in the background, and a
+        player whose buffer grows past the output limit is disconnected instead.
+        """
+        self.write_message(to, message)
+
+    async def send_to_many(self, ids, message):
+        """
+        Sends the same message to each of the players whose id numbers are in
+        'ids'. The text is turned into bytes once, however many players it goes
+        to.
+        """
+        self.write_to_many(ids, message)
+
+    # see MudServer.encode_message
+    encode_message = staticmethod(MudServer.encode_message)
+
+    def write_message(self, to, message):
+        """
+        The same as 'send_message', but can be called without awaiting it, e.g.
+        from code running in the event loop which isn't a coroutine.
+        """
+        writer = self._writers.get(to)
+        if writer is None or writer.is_closing():
+            return
+
+        writer.write(self.encode_message(message))
+
+        # if the client has fallen too far behind reading what we've sent,
+        # disconnect them rather than letting their buffer grow forever. Their
+        # task notices the connection closing and reports that they've left
+        if writer.transport.get_write_buffer_size() > self._output_limit:
+            writer.transport.abort()
+
+    def write_to_many(self, ids, message):
+        """
+        The same as 'send_to_many', but can be called without awaiting it.
+        """
+        data = self.encode_message(message)
+        for to in ids:
+            self.write_message(to, data)
+
+    async def close(self):
+        """
+        Closes down the server, disconnecting all clients and closing the
+        listen socket.
+        """
+        # stop listening for new clients
+        if self._server is not None:
+            self._server.close()
+
+        # close each client's connection, after giving any final messages a
+        # chance to get out
+        writers = list(self._writers.values())
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _serve_client(self, reader, writer):
+
+        # give the client the next id number, and construct a MudServer.Client
+        # to hold its Telnet state. The socket is looked after by the stream, so
+        # the client doesn't need it
+        clid = self._nextid
+        self._nextid += 1
+        cl = MudServer.Client(None, writer.get_extra_info("peername", ("", 0))[0],
+                              bytearray(), time.monotonic())
+        cl.tokens = self._command_burst
+        self._clients[clid] = cl
+
+        # have the operating system check that the client is still there
+        sock = writer.get_extra_info("socket")
+        if self._keepalive is not None and sock is not None:
+            MudServer._set_keepalive(sock, *self._keepalive)
+        self._writers[clid] = writer
+
+        # let the game know about the new player
+        self.events.put_nowait((self.EVENT_NEW_PLAYER, clid))
+
+        try:
+            while True:
+
+                # wait for the client to send us something. An empty read means
+                # the client closed the connection. If they're quiet for too
+                # long, tell them why and disconnect them
+                try:
+                    data = await asyncio.wait_for(reader.read(4096), self._idle_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(b"You have been disconnected for being idle.\n\r")
+                    break
+                if not data:
+                    break
+
+                # process the data, stripping out any special Telnet commands.
+                # We get back each complete line the client has sent
+                truncated = cl.truncated
+                lines = cl.read_lines(data, self._max_line_length)
+                self.lines_truncated += cl.truncated - truncated
+
+                for message in lines:
+
+                    # skip lines which are empty once any spaces, tabs etc are
+                    # removed from the start and end
+                    message = message.strip()
+                    if not message:
+                        continue
+
+                    # separate the message into the command (the first word)
+                    # and its parameters (the rest of the message)
+                    command, space, params = message.partition(" ")
+
+                    # wait until the client is allowed to send another command
+                    await self._take_token(cl)
+
+                    self.events.put_nowait((self.EVENT_COMMAND, clid, command.lower(), params))
+
+        # if there's a problem with the connection (e.g. the client has
+        # disconnected) an error will be raised, and we treat it as a disconnect
+        except (ConnectionError, OSError):
+            pass
+
+        finally:
+            # forget about the client, close their connection and let the game
+            # know they've left
+            del self._clients[clid]
+            del self._writers[clid]
+            writer.close()
+            self.events.put_nowait((self.EVENT_PLAYER_LEFT, clid))
+
+    async def _take_token(self, cl):
+
+        # with no rate limit, every command goes straight through
+        if self._command_rate is None:
+            return
+
+        # clients earn the right to send 'command_rate' commands every second,
+        # but can't save up more than 'command_burst' of them
+        now = time.monotonic()
+        cl.tokens = min(self._command_burst, cl.tokens + (now - cl.lasttoken) * self._command_rate)
+        cl.lasttoken = now
+
+        # if the client has run out, sleep until they've earned another one.
+        # We don't read anything else from them in the meantime, so the rest of
+        # what they send waits in the network buffers
+        if cl.tokens < 1:
+            self.commands_throttled += 1
+            await asyncio.sleep((1 - cl.tokens) / self._command_rate)
+            cl.tokens = 1
+            cl.lasttoken = time.monotonic()
+
+        cl.tokens -= 1
+
+
+class SyncMudServer(object):
+    """
+    Runs an AsyncMudServer in a background thread, and provides the same
+    methods as MudServer so that it can be used in its place.
+
+    The 'update' method should be called in a loop to keep the server running.
+    """
+
+    _server = None         # the AsyncMudServer doing the work
+    _loop = None           # the event loop the server runs in
+    _thread = None         # the background thread running the event loop
+    _inbox = None          # events passed from the event loop to the game
+    _forwarder = None      # the task passing events on to '_inbox'
+    _outbox = []           # messages waiting to be handed to the event loop
+    _events = None         # events since the last call to 'update', in the order they happened
+    _joined = []           # ids of the players in '_events' who have joined
+    _left = []             # ids of the players in '_events' who have left
+    _commands = []         # the Commands in '_events'
+    _timers = None         # the game's timers, which are run by 'update'
+    metrics = None         # the Metrics recording how long each update takes, or None
+
+    def __init__(self, port=23, metrics=None, **options):
+        """
+        Constructs the SyncMudServer object and starts listening for new players
+        on the given port. Any other options are passed on to AsyncMudServer.
+
+        If 'metrics' is given, a Metrics from metrics.py, the time each update
+        spends in the game's thread is recorded in it, as MudServer does. The
+        reading and sending happen in the background thread, so only the time
+        spent handing messages over and taking events is recorded for them,
+        and the bytes sent and received aren't counted.
+        """
+        self.metrics = metrics
+        self._inbox = queue.Queue()
+        self._outbox = []
+        self._events = collections.deque()
+        self._joined = []
+        self._left = []
+        self._commands = []
+        self._timers = TimerWheel()
+        self._loop = asyncio.new_event_loop()
+        self._server = AsyncMudServer(port, **options)
+
+        # start the event loop in its own thread, and wait for the server to
+        # start listening so that any problem, e.g. the port being in use, is
+        # raised here
+        self._thread = threading.Thread(target=self._run, name="SyncMudServer", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    def update(self, timeout=0):
+        """
+        Collects any new players, disconnected players and commands, and sends
+        the messages given to 'send_message' since the last call. See
+        MudServer.update.
+        """
+        # see MudServer.update
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.lap("dispatch")
+            metrics.end_tick()
+
+        # run any of the game's timers which are due, and don't wait past the
+        # point where the next one is
+        self._timers.run_due()
+        due = self._timers.next_due()
+        if due is not None:
+            timeout = due if timeout is None else min(timeout, due)
+        if metrics is not None:
+            metrics.lap("timers")
+
+        # hand the messages over to the event loop all in one go, rather than
+        # waking it up for each one
+        if self._outbox:
+            self._loop.call_soon_threadsafe(self._write_messages, self._outbox)
+            self._outbox = []
+        if metrics is not None:
+            metrics.lap("send")
+
+        # wait for the first event, then take whatever else has arrived,
+        # sorting each one by its kind as it's taken
+        self._events = collections.deque()
+        self._joined = []
+        self._left = []
+        self._commands = []
+        try:
+            event = (self._inbox.get(timeout=timeout) if timeout != 0
+                     else self._inbox.get_nowait())
+        except queue.Empty:
+            event = None
+        if metrics is not None:
+            metrics.lap("wait")
+        if event is not None:
+            self._add_event(event)
+            try:
+                while True:
+                    self._add_event(self._inbox.get_nowait())
+            except queue.Empty:
+                pass
+            if metrics is not None:
+                metrics.lap("read")
+
+    def get_new_players(self):
+        """
+        Returns a list of the ids of players who have entered the game since the
+        last call to 'update'.
+        """
+        return self._joined
+
+    def get_disconnected_players(self):
+        """
+        Returns a list of the ids of players who have left the game since the
+        last call to 'update'.
+        """
+        return self._left
+
+    def get_commands(self):
+        """
+        Returns a list of the commands sent from players since the last call to
+        'update', each a Command, which is a 3-tuple of player id, command and
+        parameters.
+        """
+        return self._commands
+
+    def drain_events(self):
+        """
+        Gives each thing that has happened since the last call to 'update' in the
+        order it happened. See MudServer.drain_events.
+        """
+        events = self._events
+        while events:
+            yield events.popleft()
+
+    def send_message(self, to, message):
+        """
+        Sends the text in the 'message' parameter to the player with the id number
+        given in the 'to' parameter. The message is actually sent during the next
+        call to 'update'. 'message' can also be bytes returned by
+        'encode_message'.
+        """
+        self._outbox.append((to, message))
+
+    def send_to_many(self, ids, message):
+        """
+        Sends the same message to each of the players whose id numbers are in
+        'ids'. The text is turned into bytes once, however many players it goes
+        to.
+        """
+        data = self.encode_message(message)
+        for to in ids:
+            self._outbox.append((to, data))
+
+    # see MudServer.encode_message
+    encode_message = staticmethod(MudServer.encode_message)
+
+    def queue_depths(self):
+        """
+        Returns a dictionary of how much is waiting in each of the server's
+        queues right now. The clients' own output buffers belong to the
+        background thread, so just the messages not yet handed over to it are
+        counted. See MudServer.queue_depths.
+        """
+        return {
+            "clients": len(self._server._clients),
+            "output_messages": len(self._outbox),
+            "events": len(self._events) + self._inbox.qsize(),
+            "timers": len(self._timers),
+        }
+
+    def call_later(self, delay, callback, *args):
+        """
+        Has 'update' call 'callback' with the given parameters once 'delay'
+        seconds have passed. See MudServer.call_later.
+        """
+        return self._timers.call_later(delay, callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """
+        Has 'update' call 'callback' with the given parameters every 'interval'
+        seconds. See MudServer.call_every.
+        """
+        return self._timers.call_every(interval, callback, *args)
+
+    def shutdown(self):
+        """
+        Closes down the server, disconnecting all clients, and stops the
+        background thread.
+        """
+        if self._outbox:
+            self._loop.call_soon_threadsafe(self._write_messages, self._outbox)
+            self._outbox = []
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _run(self):
+
+        # runs in the background thread until 'shutdown' stops the loop
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _add_event(self, event):
+
+        # turn an event from the server into a NewPlayer, PlayerLeft or Command
+        if event[0] == AsyncMudServer.EVENT_COMMAND:
+            event = Command(*event[1:])
+            self._commands.append(event)
+        elif event[0] == AsyncMudServer.EVENT_NEW_PLAYER:
+            self._joined.append(event[1])
+            event = NewPlayer(event[1])
+        else:
+            self._left.append(event[1])
+            event = PlayerLeft(event[1])
+        self._events.append(event)
+
+    async def _start(self):
+
+        # runs in the event loop. Starts the server listening, and then passing
+        # its events on to the game's thread
+        await self._server.start()
+        self._forwarder = asyncio.ensure_future(self._forward_events())
+
+    async def _close(self):
+
+        # runs in the event loop. Closes the server, and stops passing events
+        # on, waiting until that's done so that the task isn't left pending
+        # when the loop stops
+        await self._server.close()
+        self._forwarder.cancel()
+        try:
+            await self._forwarder
+        except asyncio.CancelledError:
+            pass
+
+    async def _forward_events(self):
+
+        # pass each event on to the game's thread as soon as it happens
+        while True:
+            self._inbox.put(await self._server.get_event())
+
+    def _write_messages(self, messages):
+
+        # runs in the event loop. Writes the messages handed over by 'update'
+        for to, message in messages:
+            self._server.write_message(to, message)
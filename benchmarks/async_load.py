@@ -0,0 +1,180 @@
+"""
+Opens thousands of Telnet sessions to a server and measures how long it takes
+to reply to commands while they're all connected.
+
+By default it starts a small game built on AsyncMudServer in a separate process,
+connects 10000 players to it, and has each of them send a 'look' command every
+few seconds. With '--server sync' the same game is run on MudServer instead, for
+comparison. '--port' skips starting a server and connects to one which is
+already running, e.g. 'python simplemud.py --asyncio 5000'. Note that each
+player who joins simplemud is announced to everyone already playing, so
+connecting thousands of players to it takes a long time.
+
+usage: python benchmarks/async_load.py [--clients N] [--duration S] [--interval S]
+                                       [--server async|sync] [--port PORT]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudserver import MudServer
+from asyncmudserver import AsyncMudServer
+from common import free_port, percentile, cpu_seconds
+
+
+ROOM = "You're in a cozy tavern warmed by an open fire.\n\rExits are: bar, outside"
+
+
+async def serve_async(port):
+    # the game, written as a coroutine which wakes up whenever something happens
+    mud = AsyncMudServer(port, command_rate=None)
+    await mud.start()
+    print("ready", flush=True)
+    named = set()
+    while True:
+        event = await mud.get_event()
+        if event[0] == mud.EVENT_NEW_PLAYER:
+            await mud.send_message(event[1], "What is your name?")
+        elif event[0] == mud.EVENT_PLAYER_LEFT:
+            named.discard(event[1])
+        elif event[1] not in named:
+            named.add(event[1])
+            await mud.send_message(event[1], "Welcome to the game, %s." % event[2])
+        elif event[2] == "look":
+            await mud.send_message(event[1], ROOM)
+
+
+def serve_sync(port):
+    # the same game on MudServer, written as a loop calling 'update'
+    mud = MudServer(port, command_rate=None)
+    print("ready", flush=True)
+    named = set()
+    while True:
+        mud.update(timeout=None)
+        for id in mud.get_new_players():
+            mud.send_message(id, "What is your name?")
+        for id in mud.get_disconnected_players():
+            named.discard(id)
+        for id, command, params in mud.get_commands():
+            if id not in named:
+                named.add(id)
+                mud.send_message(id, "Welcome to the game, %s." % command)
+            elif command == "look":
+                mud.send_message(id, ROOM)
+
+
+async def read_until(reader, text):
+    # read from the server until the given text turns up
+    data = b""
+    while text not in data:
+        chunk = await reader.read(4096)
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        data += chunk
+    return data
+
+
+async def player(number, port, connecting, logged_in, start, args, latencies):
+
+    # connect and log in, a few hundred players at a time so as not to
+    # overflow the server's listen backlog
+    async with connecting:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await read_until(reader, b"name?")
+        writer.write(b"bot%d\r\n" % number)
+        await read_until(reader, b"Welcome")
+    logged_in.append(number)
+
+    # wait for everyone else, then look around every so often until the time
+    # is up, timing how long each reply takes
+    await start.wait()
+    end = time.perf_counter() + args.duration
+    await asyncio.sleep(random.uniform(0, args.interval))
+    while time.perf_counter() < end:
+        sent = time.perf_counter()
+        writer.write(b"look\r\n")
+        await read_until(reader, b"Exits")
+        latencies.append(time.perf_counter() - sent)
+        await asyncio.sleep(args.interval)
+    return writer
+
+
+async def run_players(port, args):
+
+    connecting = asyncio.Semaphore(200)
+    start = asyncio.Event()
+    logged_in = []
+    latencies = []
+
+    began = time.perf_counter()
+    tasks = [asyncio.ensure_future(player(i, port, connecting, logged_in, start, args, latencies))
+             for i in range(args.clients)]
+    while len(logged_in) < args.clients:
+        await asyncio.sleep(0.1)
+        if any(t.done() for t in tasks):
+            # a player failed to connect; raise its error
+            for t in tasks:
+                if t.done():
+                    t.result()
+    print("%d players connected and logged in after %.1fs" % (args.clients, time.perf_counter() - began))
+
+    start.set()
+    writers = await asyncio.gather(*tasks)
+    for writer in writers:
+        writer.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to send commands for")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between each player's commands")
+    parser.add_argument("--server", choices=["async", "sync"], default="async")
+    parser.add_argument("--port", type=int, help="use a server which is already running on this port")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # run as the server process
+    if args.serve:
+        if args.server == "async":
+            asyncio.run(serve_async(args.serve))
+        else:
+            serve_sync(args.serve)
+        return
+
+    server = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port),
+                                   "--server", args.server], stdout=subprocess.PIPE)
+        server.stdout.readline()
+        cpu_before = cpu_seconds(server.pid)
+
+    try:
+        latencies = asyncio.run(run_players(port, args))
+    finally:
+        if server is not None:
+            cpu = cpu_seconds(server.pid) - cpu_before
+            server.kill()
+            server.wait()
+
+    latencies.sort()
+    print("%s server, %d players, %d commands in %.0fs" % (
+        args.server if server is not None else "external", args.clients, len(latencies), args.duration))
+    print("reply latency: p50 %.1fms  p99 %.1fms  max %.1fms" % (
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+    if server is not None:
+        print("server CPU time: %.2fs" % cpu)
+
+
+if __name__ == "__main__":
+    main()
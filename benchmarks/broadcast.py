@@ -0,0 +1,114 @@
+"""
+Measures how long the game takes to queue up its replies when lots of players
+are in the same room, each saying something or looking around once a tick.
+
+Players connect to a server in this process and all stand in the tavern. The
+game's own 'say' and 'look' are timed, up to the point where their messages are
+in the players' buffers ready to be sent, and compared with the old versions,
+which turned a 'say' into bytes again for each player in the room, and put
+together and encoded the room's description and exits for every 'look'.
+
+usage: python benchmarks/broadcast.py [--ticks N] [players ...]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import simplemud
+from mudserver import MudServer
+from common import drain, check_same_output
+
+
+def legacy_say(id, params):
+    # the old 'say', which sent the message to each player separately
+    pl = simplemud.active_players[id]
+    for pid in simplemud.room_occupants.get(pl.room, ()):
+        simplemud.mud.send_message(pid, "%s says: %s" % (pl.name, params))
+
+
+def legacy_look(id, params):
+    # the old 'look', which put every line together from scratch
+    mud = simplemud.mud
+    pl = simplemud.active_players[id]
+    rm = simplemud.rooms[simplemud.room_name(pl.room)]
+    mud.send_message(id, rm["description"])
+    playershere = []
+    for pid in simplemud.room_occupants.get(pl.room, ()):
+        if simplemud.active_players[pid].name is not None:
+            playershere.append(simplemud.active_players[pid].name)
+    mud.send_message(id, "Players here: %s" % ", ".join(playershere))
+    mud.send_message(id, "Exits are: %s" % ", ".join(rm["exits"]))
+
+
+def time_command(mud, sockets, handler, ids, ticks):
+    # every player uses the command once a tick
+    total = 0.0
+    for tick in range(ticks):
+        start = time.perf_counter()
+        for id in ids:
+            handler(id, "hello")
+        total += time.perf_counter() - start
+        while mud._pending_output:
+            mud.update(timeout=0)
+            drain(sockets)
+    return total / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", type=int, nargs="*", default=[50, 200])
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "world.json")) as f:
+        simplemud.rooms = json.load(f)
+    simplemud.players = {}
+    simplemud.save_player = lambda id: None
+    mud = simplemud.mud = MudServer(0, host="127.0.0.1", command_rate=None,
+                                    output_limit=1 << 24)
+    port = mud._listen_socket.getsockname()[1]
+
+    for count in args.counts:
+        # connect the players and put them all in the tavern
+        sockets = [socket.create_connection(("127.0.0.1", port)) for number in range(count)]
+        for s in sockets:
+            s.setblocking(False)
+        joined = []
+        while len(joined) < count:
+            mud.update(timeout=0.1)
+            joined.extend(mud.get_new_players())
+        for number, id in enumerate(joined):
+            simplemud.active_players[id] = simplemud.Player("player%d" % number, None, [])
+            simplemud.enter_room(id, "Tavern")
+
+        results = []
+        for name, old, new in (("say", legacy_say, simplemud.say_command),
+                               ("look", legacy_look, simplemud.look_command)):
+            check_same_output(mud, sockets, old, new, joined)
+            results.append((name, time_command(mud, sockets, old, joined, args.ticks),
+                            time_command(mud, sockets, new, joined, args.ticks)))
+
+        for name, old, new in results:
+            print("%4d players in a room, %-4s  old %8.2f ms/tick  new %8.2f ms/tick" % (
+                count, name, old * 1e3, new * 1e3))
+
+        for id in joined:
+            simplemud.leave_room(id)
+        simplemud.active_players.clear()
+        for s in sockets:
+            s.close()
+        left = 0
+        while left < count:
+            mud.update(timeout=0.1)
+            left += len(mud.get_disconnected_players())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Measures how long the game takes to send a 'shout', talk on a small channel,
+and find who a 'tell' is for, with lots of players in the game.
+
+Players connect to a server in this process and are spread over the rooms.
+Everyone is in the shout channel, and one in every '--channel-share' players is
+also in a 'trade' channel. The game's own 'shout', channel talk and
+'find_player' are timed, up to the point where their messages are in the
+players' buffers ready to be sent, and compared with doing the same the old
+way: going through every player in the game and sending to each of them
+separately, turning the message into bytes again for each one, and looking
+through every player for the one with the right name.
+
+usage: python benchmarks/channels.py [--messages N] [--channel-share N] [players ...]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import simplemud
+from mudserver import MudServer
+from common import drain, check_same_output
+
+
+def legacy_shout(id, params):
+    # sending to everyone in the game, one player at a time
+    message = "%s shouts: %s" % (simplemud.active_players[id].name, params)
+    for pid in simplemud.active_players:
+        simplemud.mud.send_message(pid, message)
+
+
+def legacy_channel(id, params):
+    # sending to a channel by going through everyone in the game and checking
+    # whether they're in it
+    message = "[trade] %s: %s" % (simplemud.active_players[id].name, params)
+    for pid in simplemud.active_players:
+        if simplemud.channels.is_member(pid, "trade"):
+            simplemud.mud.send_message(pid, message)
+
+
+def new_channel(id, params):
+    simplemud.send_to_channel("trade", "[trade] %s: %s" % (simplemud.active_players[id].name, params))
+
+
+def legacy_find_player(name):
+    # looking through every player for the one with the name
+    name = name.lower()
+    for pid, pl in simplemud.active_players.items():
+        if pl.name.lower() == name:
+            return pid
+    return None
+
+
+def time_sends(mud, sockets, handler, ids, messages):
+    # the given players each send a message, one after another, and the
+    # output is sent on after each of them
+    total = 0.0
+    for id in ids[:messages]:
+        start = time.perf_counter()
+        handler(id, "hello")
+        total += time.perf_counter() - start
+        while mud._pending_output:
+            mud.update(timeout=0)
+            drain(sockets)
+    return total / min(messages, len(ids))
+
+
+def time_lookups(find, names, repeat=5):
+    # look up every name once, keeping the fastest of a few goes
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        for name in names:
+            find(name)
+        took = (time.perf_counter() - start) / len(names)
+        best = took if best is None else min(best, took)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", type=int, nargs="*", default=[100, 1000, 5000])
+    parser.add_argument("--messages", type=int, default=20,
+                        help="how many messages to time for each way of sending")
+    parser.add_argument("--channel-share", type=int, default=50,
+                        help="one in this many players is in the 'trade' channel")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "world.json")) as f:
+        simplemud.rooms = json.load(f)
+    simplemud.players = {}
+    simplemud.save_player = lambda id: None
+    mud = simplemud.mud = MudServer(0, host="127.0.0.1", command_rate=None,
+                                    output_limit=1 << 24, compression=0)
+    port = mud._listen_socket.getsockname()[1]
+    room_names = sorted(simplemud.rooms)
+
+    for count in args.counts:
+        # connect the players, spread them over the rooms and put them in the
+        # channels. They're let in a few at a time, so that the server's
+        # queue of connections waiting to be accepted doesn't fill up
+        sockets = []
+        joined = []
+        for number in range(count):
+            s = socket.create_connection(("127.0.0.1", port))
+            s.setblocking(False)
+            sockets.append(s)
+            if number % 100 == 99:
+                mud.update(timeout=0)
+                joined.extend(mud.get_new_players())
+        while len(joined) < count:
+            mud.update(timeout=0.1)
+            joined.extend(mud.get_new_players())
+        for number, id in enumerate(joined):
+            simplemud.active_players[id] = simplemud.Player("player%d" % number, None, [])
+            simplemud.enter_room(id, room_names[number % len(room_names)])
+            simplemud.join_game(id)
+            if number % args.channel_share == 0:
+                simplemud.channels.join(id, "trade")
+        traders = sorted(simplemud.channels.members("trade"))
+
+        results = []
+        for name, old, new, ids in (("shout", legacy_shout, simplemud.shout_command, joined),
+                                    ("trade", legacy_channel, new_channel, traders)):
+            check_same_output(mud, sockets, old, new, ids[:args.messages])
+            results.append((name, time_sends(mud, sockets, old, ids, args.messages),
+                            time_sends(mud, sockets, new, ids, args.messages)))
+        names = ["PLAYER%d" % number for number in range(0, count, max(1, count // 200))]
+        assert ([legacy_find_player(name) for name in names + ["nobody"]] ==
+                [simplemud.find_player(name) for name in names + ["nobody"]]), "the lookups disagree"
+        results.append(("find", time_lookups(legacy_find_player, names),
+                        time_lookups(simplemud.find_player, names)))
+
+        for name, old, new in results:
+            print("%5d players (%4d in trade), %-5s  old %9.1f us  new %9.1f us" % (
+                count, len(traders), name, old * 1e6, new * 1e6))
+
+        for id in joined:
+            simplemud.leave_game(id)
+            simplemud.leave_room(id)
+        simplemud.active_players.clear()
+        for s in sockets:
+            s.close()
+        left = 0
+        while left < count:
+            mud.update(timeout=0.1)
+            left += len(mud.get_disconnected_players())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Helpers shared by the benchmarks: finding a free port, running the game in a
+scratch directory, making up a world, logging players in and reading what
+they're sent, and working out the numbers at the end.
+
+The benchmarks are run as scripts from this directory, so they can simply
+'from common import ...' whatever they need.
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import selectors
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port():
+    # bind to port 0 so the OS picks an unused port for us, then let it go
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def scratch_dir(root=ROOT):
+    # a temporary directory with a copy of the world in it, for the game to
+    # run from, so that nothing it saves ends up in the repository
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(root, "world.json"), workdir)
+    return workdir
+
+
+def wait_for_port(port, server=None, timeout=30.0):
+    # wait for the game to start listening, giving up if its process stops
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError("the game stopped before it started listening")
+            time.sleep(0.01)
+    raise RuntimeError("the game didn't start listening on port %d" % port)
+
+
+def start_server(port, workdir, *args):
+    # run simplemud.py from 'workdir' with any extra arguments, and wait until
+    # it's accepting connections
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "simplemud.py"), str(port)]
+                            + list(args), cwd=workdir, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, proc)
+    except RuntimeError:
+        proc.kill()
+        proc.wait()
+        raise
+    return proc
+
+
+def make_grid(size, name="%d,%d"):
+    # a square grid of rooms, each with exits to its neighbours. 'name' is
+    # how a room is named from its position
+    rooms = {}
+    for x in range(size):
+        for y in range(size):
+            exits = {}
+            if x > 0:
+                exits["west"] = name % (x - 1, y)
+            if x < size - 1:
+                exits["east"] = name % (x + 1, y)
+            if y > 0:
+                exits["north"] = name % (x, y - 1)
+            if y < size - 1:
+                exits["south"] = name % (x, y + 1)
+            rooms[name % (x, y)] = {"description": "Room %d,%d." % (x, y), "exits": exits}
+    return rooms
+
+
+def log_in(port, names):
+    # connect everyone and log them in, returning their sockets, which don't
+    # block, once they've all been welcomed
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for name in names:
+        while True:
+            try:
+                s = socket.create_connection(("127.0.0.1", port))
+                break
+            except socket.error:
+                time.sleep(0.01)
+        s.sendall(name.encode() + b"\r\n")
+        s.setblocking(False)
+        sockets.append(s)
+        selector.register(s, selectors.EVENT_READ, [b""])
+    waiting = len(sockets)
+    while waiting:
+        for key, mask in selector.select():
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise ConnectionError("the server closed a connection")
+            if key.data[0] is not None:
+                key.data[0] += data
+                if b"Welcome" in key.data[0]:
+                    key.data[0] = None
+                    waiting -= 1
+    selector.close()
+    return sockets
+
+
+def drain(sockets):
+    # read whatever the players have been sent, so their buffers don't fill
+    for s in sockets:
+        try:
+            while s.recv(1 << 20):
+                pass
+        except (BlockingIOError, ConnectionError):
+            pass
+
+
+def received(mud, sockets):
+    # everything each player is sent by a MudServer in this process, once
+    # it's sent it all
+    got = [b""] * len(sockets)
+    while True:
+        for number, s in enumerate(sockets):
+            try:
+                data = s.recv(1 << 20)
+                while data:
+                    got[number] += data
+                    data = s.recv(1 << 20)
+            except BlockingIOError:
+                pass
+        if not mud._pending_output:
+            return got
+        mud.update(timeout=0)
+
+
+def check_same_output(mud, sockets, old, new, ids):
+    # every player is sent the same thing when each of the players in 'ids'
+    # uses the old version of a command as when they use the new one, so the
+    # second half of what each player was sent is the same as the first
+    received(mud, sockets)
+    for handler in (old, new):
+        for id in ids:
+            handler(id, "hello")
+    sent = received(mud, sockets)
+    assert any(sent), "nothing was sent"
+    for data in sent:
+        assert data[:len(data) // 2] == data[len(data) // 2:], "the old and new versions disagree"
+
+
+def percentile(values, pc):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pc / 100.0))]
+
+
+def cpu_seconds(pid):
+    # user + system time used by a process so far, from /proc on Linux, or
+    # nothing if it can't be read
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / float(os.sysconf("SC_CLK_TCK"))
+    except (OSError, IndexError, ValueError):
+        return 0.0
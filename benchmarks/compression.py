@@ -0,0 +1,175 @@
+"""
+Measures how many bytes compressing players' output (MCCP) saves, and how much
+CPU time it costs, by replaying a recording of real game sessions through the
+same compression the server uses.
+
+The recording is made by starting simplemud.py without compression and having
+a number of players wander around it, looking at rooms and talking, while
+everything each of them is sent is recorded, in the chunks it arrived in. The
+server sends everything waiting for a player in one go each update, so each
+chunk is one of the batches the server compresses and flushes. A recording can
+be saved with --record and used again with --transcript, so that different
+versions of the server can be compared on the same sessions.
+
+Each session is then compressed batch by batch, with its own compressor, at
+each compression level, and the bytes it came to, the CPU time it took and the
+memory each compressor takes are reported. zlib's default settings, with a
+larger window, are shown for comparison.
+
+usage: python benchmarks/compression.py [--players N] [--commands N]
+           [--record FILE | --transcript FILE] [--levels L ...]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import socket
+import argparse
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+from mudserver import MudServer
+from common import free_port, scratch_dir, start_server
+
+# the things the players say, so that there's some chat in the recording
+SAYINGS = ["hello", "anyone seen the sword?", "this way", "nice fire in here",
+           "I'm off to the kitchen", "brb", "what does 'track' do?", "ha ha"]
+
+
+def receive(player, session, timeout):
+    # read whatever's arrived for a player, noting each chunk
+    player.settimeout(timeout)
+    received = b""
+    try:
+        while True:
+            data = player.recv(65536)
+            if not data:
+                break
+            session.append(data)
+            received += data
+            player.settimeout(0.01)
+    except socket.timeout:
+        pass
+    return received
+
+
+def record(count, commands, seed):
+    # start a server without compression, so we see the plain text
+    workdir = scratch_dir()
+    port = free_port()
+    proc = start_server(port, workdir, "--host", "127.0.0.1", "--compression", "0")
+    rnd = random.Random(seed)
+    try:
+        players = [socket.create_connection(("127.0.0.1", port)) for number in range(count)]
+        sessions = [[] for player in players]
+        exits = [[] for player in players]
+        for number, player in enumerate(players):
+            player.sendall(b"player%d\r\n" % number)
+
+        # each round, every player does something: looks around, says
+        # something, or goes through one of the exits they last saw
+        for turn in range(commands):
+            for number, player in enumerate(players):
+                choice = rnd.random()
+                if choice < 0.5 and exits[number]:
+                    command = "go " + rnd.choice(exits[number])
+                elif choice < 0.8:
+                    command = "say " + rnd.choice(SAYINGS)
+                else:
+                    command = "look"
+                player.sendall(command.encode() + b"\r\n")
+            for number, player in enumerate(players):
+                text = receive(player, sessions[number], 0.5).decode("latin1")
+                found = re.findall(r"Exits are: (.*)\n", text)
+                if found:
+                    exits[number] = found[-1].strip().split(", ")
+        for player in players:
+            player.close()
+    finally:
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(workdir)
+    return sessions
+
+
+def compress(sessions, level, window_bits, memory_level):
+    # compress each session a batch at a time with its own compressor, as the
+    # server does, returning the bytes it came to and the CPU time it took
+    size = 0
+    start = time.process_time()
+    for session in sessions:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, window_bits, memory_level)
+        for batch in session:
+            size += len(compressor.compress(batch)) + len(compressor.flush(zlib.Z_SYNC_FLUSH))
+    return size, time.process_time() - start
+
+
+def compressor_memory(level, window_bits, memory_level, count=100):
+    # how much memory each compressor takes once it's been used
+    tracemalloc.start()
+    compressors = []
+    for number in range(count):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, window_bits, memory_level)
+        compressor.compress(b"hello")
+        compressor.flush(zlib.Z_SYNC_FLUSH)
+        compressors.append(compressor)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=50,
+                        help="how many commands each player sends")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--record", metavar="FILE", help="save the recording to this file")
+    parser.add_argument("--transcript", metavar="FILE",
+                        help="use the recording in this file instead of making a new one")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="how many times to compress everything, keeping the fastest")
+    args = parser.parse_args()
+
+    if args.transcript:
+        with open(args.transcript) as f:
+            sessions = [[batch.encode("latin1") for batch in session]
+                        for session in json.load(f)["sessions"]]
+    else:
+        sessions = record(args.players, args.commands, args.seed)
+        if args.record:
+            with open(args.record, "w") as f:
+                json.dump({"sessions": [[batch.decode("latin1") for batch in session]
+                                        for session in sessions]}, f)
+
+    plain = sum(len(batch) for session in sessions for batch in session)
+    batches = sum(len(session) for session in sessions)
+    print("%d sessions, %d batches, %d bytes uncompressed, %.0f bytes per session" % (
+        len(sessions), batches, plain, plain / len(sessions)))
+    print("%-28s %5s  %13s  %6s  %14s  %12s  %10s" % (
+        "settings", "level", "bytes/session", "ratio", "CPU us/session", "us per batch", "memory"))
+
+    settings = [("server", MudServer._COMPRESS_WINDOW_BITS, MudServer._COMPRESS_MEMORY_LEVEL),
+                ("zlib defaults", 15, 8)]
+    for name, window_bits, memory_level in settings:
+        for level in args.levels:
+            runs = [compress(sessions, level, window_bits, memory_level) for run in range(args.repeat)]
+            size = runs[0][0]
+            cpu = min(seconds for size, seconds in runs)
+            memory = compressor_memory(level, window_bits, memory_level)
+            print("%-28s %5d  %13.0f  %6.3f  %14.0f  %12.1f  %8.0fKB" % (
+                "%s (window %d)" % (name, 2 ** window_bits), level, size / len(sessions),
+                size / plain, cpu / len(sessions) * 1e6, cpu / batches * 1e6, memory / 1024))
+
+
+if __name__ == "__main__":
+    main()
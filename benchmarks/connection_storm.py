@@ -0,0 +1,100 @@
+"""
+Connects thousands of players to the game all at once, as happens when everyone
+reconnects after a restart, and reports how long each of them waits to be
+asked their name.
+
+The game is started on a free port in a temporary directory. Connections which
+are turned away, or aren't asked their name within the time limit, are counted
+as failed. Try '--backlog 1' to see what happens when the server can't queue
+up new connections.
+
+usage: python benchmarks/connection_storm.py [--connections N] [--backlog N] [--timeout S]
+"""
+
+import time
+import errno
+import shutil
+import socket
+import argparse
+import selectors
+
+from common import free_port, percentile, scratch_dir, start_server
+
+
+def storm(port, count, timeout):
+
+    selector = selectors.DefaultSelector()
+    started = {}
+    welcomed = []
+    failed = 0
+
+    # start every connection without waiting for any of them to finish
+    for number in range(count):
+        s = socket.socket()
+        s.setblocking(False)
+        started[s] = time.perf_counter()
+        result = s.connect_ex(("127.0.0.1", port))
+        if result not in (0, errno.EINPROGRESS):
+            failed += 1
+            del started[s]
+            s.close()
+            continue
+        selector.register(s, selectors.EVENT_READ, b"")
+
+    # wait for each one to be asked their name
+    end = time.perf_counter() + timeout
+    while started and time.perf_counter() < end:
+        for key, mask in selector.select(0.1):
+            s = key.fileobj
+            try:
+                data = key.data + s.recv(4096)
+            except OSError:
+                data = None
+            if not data:
+                # turned away
+                failed += 1
+            elif b"name?" in data:
+                welcomed.append(time.perf_counter() - started[s])
+            else:
+                selector.modify(s, selectors.EVENT_READ, data)
+                continue
+            selector.unregister(s)
+            del started[s]
+            s.close()
+
+    # whoever's left ran out of time
+    failed += len(started)
+    for s in started:
+        s.close()
+    return sorted(welcomed), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--backlog", type=int, default=4096)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    directory = scratch_dir()
+    port = free_port()
+    server = start_server(port, directory, "--host", "127.0.0.1", "--backlog", str(args.backlog))
+    try:
+        start = time.perf_counter()
+        welcomed, failed = storm(port, args.connections, args.timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.kill()
+        server.wait()
+        shutil.rmtree(directory)
+
+    print("%d connections with a backlog of %d: %d asked their name, %d failed, in %.2fs" % (
+        args.connections, args.backlog, len(welcomed), failed, elapsed))
+    if welcomed:
+        print("time to welcome: p50 %.1fms  p90 %.1fms  p99 %.1fms  max %.1fms" % (
+            percentile(welcomed, 50) * 1000, percentile(welcomed, 90) * 1000,
+            percentile(welcomed, 99) * 1000, welcomed[-1] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measures how many commands per second can be matched up with their handlers
+and have their parameters split up, for a mixture of commands like the ones
+players actually send.
+
+The old approach ran every command's parameters through 'shlex' and then went
+down a chain of if/elif string comparisons. The new one looks the command up
+in a CommandTable and only splits up the parameters in the way each command
+asks for. The handlers themselves do nothing, so only the dispatching is
+measured.
+
+usage: python benchmarks/dispatch.py [commands]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from commands import CommandTable, ARGS_RAW, ARGS_SPLIT, ARGS_QUOTED, shlex_this
+
+
+def make_stream(count):
+    # (command, parameters) pairs, mostly chat and moving around
+    rnd = random.Random(1)
+    choices = [
+        (40, ("say", "hello everybody, how is it going?")),
+        (25, ("look", "")),
+        (20, ("go", "drink cabinet")),
+        (5, ("give", "a rusty sword")),
+        (3, ("help", "")),
+        (2, ("room", 'Cellar "A damp, dark cellar." Tavern')),
+        (3, ("dance", "wildly")),
+        (2, ("l", "")),
+    ]
+    weighted = [item for weight, item in choices for i in range(weight)]
+    return [rnd.choice(weighted) for i in range(count)]
+
+
+def legacy_dispatch(stream):
+    for command, params in stream:
+        params = shlex_this(params)
+        if command == "help":
+            pass
+        elif command == "say":
+            ' '.join(params)
+        elif command == "look":
+            pass
+        elif command == "go":
+            ' '.join(params)
+        elif command == "room":
+            pass
+        elif command == "stop":
+            pass
+        elif command == "give":
+            ' '.join(params)
+        else:
+            pass
+
+
+def make_table():
+    def handler(id, params):
+        pass
+    table = CommandTable()
+    table.add("help", handler, aliases=["?"])
+    table.add("say", handler, ARGS_RAW)
+    table.add("look", handler, aliases=["l"])
+    table.add("go", handler, ARGS_SPLIT)
+    table.add("room", handler, ARGS_QUOTED)
+    table.add("stop", handler)
+    table.add("give", handler, ARGS_RAW)
+    return table
+
+
+def table_dispatch(table, stream):
+    for command, params in stream:
+        table.dispatch(0, command, params)
+
+
+def measure(name, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print("%-24s %10.0f commands/s" % (name, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    stream = make_stream(count)
+    table = make_table()
+    measure("shlex + if/elif chain", lambda: legacy_dispatch(stream), count)
+    measure("command table", lambda: table_dispatch(table, stream), count)
+
+
+if __name__ == "__main__":
+    main()
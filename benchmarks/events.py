@@ -0,0 +1,93 @@
+"""
+Measures how long MudServer takes to hand a flood of commands over to the game:
+reading them from the players' connections, turning them into events, and
+giving them to the game, which does nothing with them.
+
+Players connected to a server in this process each send their share of a
+tick's worth of 'look' commands at once, and the time from then until the game
+has been given all of them is measured. Each tick's commands are handed over
+both through 'get_new_players', 'get_disconnected_players' and 'get_commands',
+as shards.py does, and through 'drain_events', as simplemud.py does. Use
+'--metrics' to have the server measure itself while it does, to see what that
+costs.
+
+usage: python benchmarks/events.py [--players N] [--metrics] [commands per tick ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import socket
+from mudserver import MudServer
+from metrics import Metrics
+
+
+def by_kind(mud):
+    handled = 0
+    for id in mud.get_new_players():
+        handled += 1
+    for id in mud.get_disconnected_players():
+        handled += 1
+    for id, command, params in mud.get_commands():
+        handled += 1
+    return handled
+
+
+def in_order(mud):
+    handled = 0
+    for event in mud.drain_events():
+        handled += 1
+    return handled
+
+
+def time_ticks(mud, players, handle, count, ticks):
+    # have the players send 'count' commands between them, then time how long
+    # it takes the game to be given them all
+    each = b"look\r\n" * (count // len(players))
+    total = 0.0
+    for tick in range(ticks):
+        for s in players:
+            s.sendall(each)
+        handled = 0
+        start = time.perf_counter()
+        while handled < count // len(players) * len(players):
+            mud.update(timeout=1.0)
+            handled += handle(mud)
+        total += time.perf_counter() - start
+    return total / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", type=int, nargs="*", default=[100, 1000, 10000])
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--metrics", action="store_true", help="have the server measure itself")
+    args = parser.parse_args()
+
+    mud = MudServer(0, host="127.0.0.1", command_rate=None,
+                    metrics=Metrics() if args.metrics else None)
+    port = mud._listen_socket.getsockname()[1]
+    players = [socket.create_connection(("127.0.0.1", port)) for number in range(args.players)]
+    while len(mud.get_new_players()) < args.players:
+        mud.update(timeout=0.1)
+
+    handlers = [("get_commands", by_kind)]
+    if hasattr(mud, "drain_events"):
+        handlers.append(("drain_events", in_order))
+    for count in args.counts:
+        for name, handle in handlers:
+            per_tick = time_ticks(mud, players, handle, count, args.ticks)
+            print("%6d commands/tick, %-13s %9.1f us/tick  %6.0f ns/command" % (
+                count, name, per_tick * 1e6, per_tick * 1e9 / count))
+
+    for s in players:
+        s.close()
+
+
+if __name__ == "__main__":
+    main()
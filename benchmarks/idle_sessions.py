@@ -0,0 +1,146 @@
+"""
+Measures what thousands of idle players cost the server while they're just
+sitting there: how many bytes it sends them, how many TCP packets go back and
+forth, and how many system calls it makes to send, receive and wait, per
+minute.
+
+A server is started in a separate process and 5000 players connect to it and
+then do nothing. Packets are counted for the whole machine, from
+/proc/net/snmp, so this only works on Linux, and anything else using the
+network at the same time adds to them. System calls are counted by the server
+process itself, by wrapping the socket and selector methods the server uses
+to send, receive and wait. Use '--keepalive' to have the kernel check on the
+connections after that many seconds, to see what the checks cost.
+
+usage: python benchmarks/idle_sessions.py [--clients N] [--duration S] [--keepalive S]
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import selectors
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudserver import MudServer
+from common import free_port
+
+
+def serve(port, keepalive):
+    # a game which does nothing but keep its players connected
+    options = {}
+    if keepalive is not None:
+        options["keepalive_idle"] = keepalive
+        options["keepalive_interval"] = keepalive
+    calls = count_system_calls()
+    mud = MudServer(port, host="127.0.0.1", **options)
+
+    # print how many calls have been made so far whenever we're asked
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(sum(calls.values()), flush=True))
+    print("ready", flush=True)
+    while True:
+        mud.update(timeout=None)
+        mud.get_new_players()
+        mud.get_disconnected_players()
+        mud.get_commands()
+
+
+def count_system_calls():
+    # wrap each method which makes a system call the server might make while
+    # its players are idle, counting how many times it's called
+    calls = {}
+
+    def counted(cls, name):
+        method = getattr(cls, name)
+        calls[name] = 0
+
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return method(*args, **kwargs)
+        setattr(cls, name, wrapper)
+
+    for name in ("send", "recv"):
+        counted(socket.socket, name)
+    counted(selectors.DefaultSelector, "select")
+    return calls
+
+
+def tcp_segments():
+    # how many TCP packets the machine has sent, from the kernel's counters
+    with open("/proc/net/snmp") as f:
+        lines = [line.split() for line in f if line.startswith("Tcp:")]
+    return int(lines[1][lines[0].index("OutSegs")])
+
+
+def syscalls(server):
+    # ask the server how many system calls it's made so far
+    server.send_signal(signal.SIGUSR1)
+    return int(server.stdout.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to measure for")
+    parser.add_argument("--keepalive", type=float, help="seconds before the kernel checks on a connection")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # run as the server process
+    if args.serve:
+        serve(args.serve, args.keepalive)
+        return
+
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", str(port)]
+    if args.keepalive is not None:
+        command += ["--keepalive", str(args.keepalive)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    server.stdout.readline()
+
+    selector = selectors.DefaultSelector()
+    players = []
+    try:
+        # connect everyone, and read the welcome they get so it isn't counted
+        for number in range(args.clients):
+            s = socket.create_connection(("127.0.0.1", port))
+            s.setblocking(False)
+            players.append(s)
+            selector.register(s, selectors.EVENT_READ)
+        time.sleep(2.0)
+        for key, mask in selector.select(0):
+            key.fileobj.recv(65536)
+
+        # then sit there, counting everything the server sends
+        received = 0
+        segments = tcp_segments()
+        calls = syscalls(server)
+        end = time.perf_counter() + args.duration
+        while time.perf_counter() < end:
+            for key, mask in selector.select(max(0.0, end - time.perf_counter())):
+                data = key.fileobj.recv(65536)
+                if not data:
+                    raise ConnectionError("the server closed a connection")
+                received += len(data)
+        segments = tcp_segments() - segments
+        calls = syscalls(server) - calls
+    finally:
+        server.kill()
+        server.wait()
+        for s in players:
+            s.close()
+
+    minutes = args.duration / 60
+    print("%d idle players, keepalive %s:" % (
+        args.clients, "%gs" % args.keepalive if args.keepalive is not None else "default"))
+    print("  %10.0f bytes/min sent by the server" % (received / minutes))
+    print("  %10.0f TCP packets/min" % (segments / minutes))
+    print("  %10.0f send, recv and select calls/min by the server" % (calls / minutes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measures how long a single call to MudServer.update takes when the server has
+lots of connected clients which aren't sending anything.
+
+For comparison it also times the old approach of calling 'select' once per
+client socket on every tick. Note that 'select' can't watch file descriptors
+numbered above FD_SETSIZE (usually 1024), so the old approach stops working
+altogether somewhere past a thousand connections.
+
+usage: python benchmarks/idle_tick.py [count ...]
+"""
+
+import os
+import sys
+import time
+import socket
+import select
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudserver import MudServer
+from common import free_port
+
+
+def open_clients(port, count, ready, done):
+    # runs in a separate process so that the client ends of the connections
+    # don't use up the server's file descriptors
+    clients = []
+    for i in range(count):
+        clients.append(socket.create_connection(("127.0.0.1", port)))
+    ready.set()
+    # keep the connections open, without sending anything, until we're told
+    # the measurements are finished
+    done.wait()
+    for cl in clients:
+        cl.close()
+
+
+def legacy_check_for_messages(mud):
+    # the per-tick work done by the old '_check_for_messages': one 'select'
+    # call for every connected client
+    for id, cl in list(mud._clients.items()):
+        rlist, wlist, xlist = select.select([cl.socket], [], [], 0)
+
+
+def time_ticks(func, ticks):
+    start = time.perf_counter()
+    for i in range(ticks):
+        func()
+    return (time.perf_counter() - start) / ticks
+
+
+def run(count, ticks=200):
+    port = free_port()
+    mud = MudServer(port)
+
+    ready = multiprocessing.Event()
+    done = multiprocessing.Event()
+    proc = multiprocessing.Process(target=open_clients, args=(port, count, ready, done))
+    proc.start()
+
+    # keep updating until every client has been accepted
+    joined = 0
+    while joined < count:
+        mud.update()
+        joined += len(mud.get_new_players())
+    ready.wait()
+
+    per_tick = time_ticks(mud.update, ticks)
+    # just the part of the update which looks for incoming data
+    io_tick = time_ticks(mud._check_for_ready_sockets, ticks)
+    try:
+        legacy = "%10.1f us" % (time_ticks(lambda: legacy_check_for_messages(mud), ticks) * 1e6)
+    except ValueError:
+        legacy = "       n/a"
+
+    done.set()
+    proc.join()
+    mud.shutdown()
+
+    print("%6d idle clients: update() %10.1f us/tick, selector %8.1f us/tick, "
+          "per-client select %s/tick" % (count, per_tick * 1e6, io_tick * 1e6, legacy))
+
+
+if __name__ == "__main__":
+    counts = [int(a) for a in sys.argv[1:]] or [10, 1000, 10000]
+    for count in counts:
+        run(count)
@@ -0,0 +1,111 @@
+"""
+Measures the round-trip time of a 'look' command against a running copy of
+simplemud.py, i.e. how long a player waits between pressing enter and seeing
+the last line of the reply. Optionally some other players can be kept busy
+talking in the background while the measurement runs. Commands are spaced out
+so that nobody goes over the server's limit on commands per second.
+
+Afterwards the server is left alone for a few seconds with the players still
+connected, and the CPU time it uses while idle is reported.
+
+usage: python benchmarks/latency.py [--looks N] [--chatty N] [--interval SECONDS] [--idle SECONDS]
+"""
+
+import os
+import time
+import shutil
+import socket
+import argparse
+import threading
+
+from common import free_port, scratch_dir, start_server, percentile, cpu_seconds
+
+
+class Player(object):
+    """A telnet connection which has logged in to the game"""
+
+    def __init__(self, port, name):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.data = b""
+        self.read_until(b"What is your name?")
+        self.sock.sendall(name.encode("latin1") + b"\n")
+        self.read_until(b"Welcome to the game")
+
+    def read_until(self, text):
+        while text not in self.data:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise IOError("server closed the connection")
+            self.data += chunk
+        # throw away everything up to and including the text we waited for
+        self.data = self.data[self.data.index(text) + len(text):]
+
+    def command(self, line, reply_ends_with):
+        start = time.perf_counter()
+        self.sock.sendall(line.encode("latin1") + b"\n")
+        self.read_until(reply_ends_with)
+        return time.perf_counter() - start
+
+
+def chatter(player, stop, interval):
+    # keep saying things until told to stop, reading the replies as they come
+    while not stop.is_set():
+        player.command("say hello there", b"says: hello there")
+        time.sleep(interval)
+
+
+def timed_looks(player, count, interval):
+    times = []
+    for i in range(count):
+        times.append(player.command("look", b"Exits are:"))
+        time.sleep(interval)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--looks", type=int, default=200, help="number of 'look' commands to time")
+    parser.add_argument("--chatty", type=int, default=0, help="players talking in the background")
+    parser.add_argument("--interval", type=float, default=0.1, help="pause between each player's commands")
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds to measure idle CPU for")
+    args = parser.parse_args()
+
+    port = free_port()
+    workdir = scratch_dir()
+    proc = start_server(port, workdir)
+    try:
+        player = Player(port, "timer")
+
+        stop = threading.Event()
+        threads = []
+        for i in range(args.chatty):
+            t = threading.Thread(target=chatter, args=(Player(port, "chatty%d" % i), stop, args.interval))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        times = timed_looks(player, args.looks, args.interval)
+
+        stop.set()
+        for t in threads:
+            t.join()
+
+        print("look round trip over %d commands with %d chatty players:" % (len(times), args.chatty))
+        print("  mean %.2f ms, p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+            sum(times) / len(times) * 1e3, percentile(times, 50) * 1e3,
+            percentile(times, 99) * 1e3, max(times) * 1e3))
+
+        if os.path.exists("/proc/%d/stat" % proc.pid):
+            before = cpu_seconds(proc.pid)
+            time.sleep(args.idle)
+            used = cpu_seconds(proc.pid) - before
+            print("idle server CPU: %.3f s over %.1f s (%.2f%%)" % (used, args.idle, used / args.idle * 100))
+    finally:
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
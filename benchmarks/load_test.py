@@ -0,0 +1,486 @@
+"""
+Load-tests simplemud.py with lots of simulated Telnet players, and reports how
+many commands a second it handled, how long players waited for their replies,
+and how much CPU time and memory the server used, as JSON.
+
+The game is started on a free local port from a scratch directory with a copy
+of the world, without the limit on how fast each player may send commands.
+The players are run from one or more separate processes. Each of them logs in
+by name, then sends one command at a time from a mix of 'look', 'say', 'go'
+and 'give', waiting for the reply before pausing for a random time (averaging
+'--think' seconds) and sending the next. 'go' always picks one of the exits of
+the room the player is in. 'give' has no reply, so it's followed by an unknown
+command, and timed until that's answered. Some of the commands, given by
+'--iac', are preceded by Telnet negotiation of the kind real clients send,
+sometimes split across two packets, so that the server's Telnet handling is
+exercised too. The players' choices come from '--seed', so two runs send the
+same commands in the same order.
+
+Nothing is measured for the first '--warmup' seconds. After that, for
+'--duration' seconds, the time between sending each command and reading the
+last line of its reply is recorded, along with the CPU time used by the server
+and any worker processes it starts, and how much memory they have (from /proc,
+so on Linux only).
+
+To compare two commits, run the test against each and compare the results,
+e.g. with a copy of the older commit checked out by 'git worktree':
+
+    git worktree add /tmp/old HEAD~1
+    python benchmarks/load_test.py --root /tmp/old --json old.json
+    python benchmarks/load_test.py --compare old.json
+
+'--compare' exits with status 1 if the throughput, the median or 99th
+percentile reply time, or the CPU time per command is worse than the old run's
+by more than '--tolerance' percent. Memory is shown but not checked.
+
+usage: python benchmarks/load_test.py [--bots N] [--duration S] [--think S]
+                                      [--mix look=4,say=3,go=2,give=1] [--iac FRACTION]
+                                      [--server-args ARGS] [--json FILE] [--compare FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import shlex
+import random
+import shutil
+import socket
+import argparse
+import functools
+import selectors
+import subprocess
+
+from common import ROOT, free_port, scratch_dir, wait_for_port, cpu_seconds
+
+
+# the Telnet negotiation players might send before a command. Real clients send
+# these when they connect, and some again later, e.g. when the window is resized
+IAC_NOISE = (
+    b"\xff\xfb\x1f",                              # IAC WILL NAWS
+    b"\xff\xfa\x1f\x00\x50\x00\x18\xff\xf0",      # IAC SB NAWS 80x24 IAC SE
+    b"\xff\xfd\x03",                              # IAC DO SUPPRESS-GO-AHEAD
+    b"\xff\xfc\x22",                              # IAC WONT LINEMODE
+    b"\xff\xf1",                                  # IAC NOP
+    b"\xff\xfa\x18\x00xterm-256color\xff\xf0",    # IAC SB TTYPE IS xterm IAC SE
+)
+
+# the unknown command sent after a 'give', and the reply which shows it's done
+PROBE = b"ping"
+PROBE_REPLY = b"Unknown command 'ping'"
+
+
+def serve(port, root, server_args):
+    # run the game as simplemud.py would, but without the limit on how fast
+    # each player may send commands
+    sys.path.insert(0, root)
+    import simplemud
+
+    simplemud.MudServer = functools.partial(simplemud.MudServer, command_rate=None)
+    if hasattr(simplemud, "SyncMudServer"):
+        simplemud.SyncMudServer = functools.partial(simplemud.SyncMudServer, command_rate=None)
+    sys.argv = ["simplemud.py", str(port)] + server_args
+    simplemud.main()
+
+
+def parse_mix(text):
+    # turn e.g. "look=4,say=3" into a list of commands and a list of weights
+    kinds, weights = [], []
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        if kind not in ("look", "say", "go", "give"):
+            raise argparse.ArgumentTypeError("unknown command '%s' in the mix" % kind)
+        kinds.append(kind)
+        weights.append(float(weight))
+    return kinds, weights
+
+
+class Bot(object):
+    """A simulated player, with one command at a time waiting for its reply"""
+
+    def __init__(self, number, port, seed):
+        self.number = number
+        self.name = b"bot%d" % number
+        self.random = random.Random(seed * 1000003 + number)
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.data = b""        # the start of a line which hasn't all arrived yet
+        self.room = "Tavern"   # the room the bot is in
+        self.kind = None       # the kind of command waiting for its reply, or None
+        self.expect = None     # something in the last line of the reply
+        self.sent = 0          # when the command was sent
+        self.said = 0          # how many times the bot has used 'say'
+
+    def send(self, line, noise):
+        # send a command, with some Telnet negotiation in front of it. Half the
+        # time the negotiation is split across two packets
+        if noise is None:
+            self.sock.sendall(line + b"\r\n")
+        elif self.random.random() < 0.5:
+            self.sock.sendall(noise + line + b"\r\n")
+        else:
+            half = len(noise) // 2
+            self.sock.sendall(noise[:half])
+            self.sock.sendall(noise[half:] + line + b"\r\n")
+
+    def lines(self):
+        # read whatever has arrived, returning the lines which are complete
+        try:
+            chunk = self.sock.recv(65536)
+        except BlockingIOError:
+            return []
+        if not chunk:
+            raise ConnectionError("%s was disconnected" % self.name.decode())
+        data = self.data + chunk
+        complete = data.rfind(b"\n") + 1
+        self.data = data[complete:]
+        return data[:complete].split(b"\n")
+
+
+def run_bots(port, first, count, args):
+    """
+    Runs bots number 'first' to 'first + count - 1', as one of the processes
+    the test starts. Prints "ready" once they've all logged in, waits to be
+    told to go, then prints the reply times and counts as JSON.
+    """
+    with open(os.path.join(args.root, "world.json")) as f:
+        rooms = json.load(f)
+    kinds, weights = parse_mix(args.mix)
+
+    selector = selectors.DefaultSelector()
+    bots = []
+    for number in range(first, first + count):
+        bot = Bot(number, port, args.seed)
+        bots.append(bot)
+        selector.register(bot.sock, selectors.EVENT_READ, bot)
+
+    # log everyone in, with the kind of negotiation a client sends when it
+    # connects in front of some of their names
+    for bot in bots:
+        bot.send(bot.name, IAC_NOISE[0] + IAC_NOISE[2] if bot.random.random() < args.iac else None)
+        bot.expect = b"Welcome to the game"
+    waiting = len(bots)
+    while waiting:
+        for key, mask in selector.select():
+            bot = key.data
+            for line in bot.lines():
+                if bot.expect is not None and bot.expect in line:
+                    bot.expect = None
+                    waiting -= 1
+
+    # wait to be told to go, reading whatever the bots are sent meanwhile so
+    # that the server doesn't give up on them
+    print("ready", flush=True)
+    selector.register(sys.stdin, selectors.EVENT_READ, None)
+    go = False
+    while not go:
+        for key, mask in selector.select():
+            if key.data is None:
+                sys.stdin.readline()
+                go = True
+            else:
+                key.data.lines()
+    selector.unregister(sys.stdin)
+
+    def send_command(bot, now):
+        kind = bot.random.choices(kinds, weights)[0]
+        exits = rooms.get(bot.room, {}).get("exits")
+        if kind == "go" and not exits:
+            kind = "look"
+        if kind == "look":
+            line, bot.expect = b"look", b"Exits are:"
+        elif kind == "say":
+            bot.said += 1
+            line = b"say hello %d" % bot.said
+            bot.expect = b"%s says: hello %d" % (bot.name, bot.said)
+        elif kind == "go":
+            line = b"go " + bot.random.choice(sorted(exits)).encode("latin1")
+            bot.expect = b"You arrive at '"
+        else:
+            line = b"give thing %d\r\n%s" % (bot.random.randrange(1000), PROBE)
+            bot.expect = PROBE_REPLY
+        noise = bot.random.choice(IAC_NOISE) if bot.random.random() < args.iac else None
+        bot.kind = kind
+        bot.sent = now
+        bot.send(line, noise)
+
+    # start everyone off at random times during the first pause, so that they
+    # don't all send their commands together
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    end = measure_from + args.duration
+    latencies = dict((kind, []) for kind in kinds)
+    timeouts = 0
+    due = [(start + bot.random.uniform(0, args.think), bot.number - first) for bot in bots]
+    heapq.heapify(due)
+
+    now = next_check = start
+    while now < end:
+        # send the commands which are due
+        while due and due[0][0] <= now:
+            send_command(bots[heapq.heappop(due)[1]], now)
+
+        timeout = end - now
+        if due:
+            timeout = min(timeout, max(0.0, due[0][0] - now))
+        for key, mask in selector.select(min(timeout, args.reply_timeout)):
+            bot = key.data
+            for line in bot.lines():
+                if bot.expect is None or bot.expect not in line:
+                    continue
+                now = time.perf_counter()
+                if bot.sent >= measure_from:
+                    latencies[bot.kind].append(now - bot.sent)
+                if bot.kind == "go":
+                    bot.room = line[line.index(bot.expect) + len(bot.expect):].rstrip(b"\r'").decode("latin1")
+                bot.expect = None
+                think = bot.random.expovariate(1.0 / args.think) if args.think else 0.0
+                heapq.heappush(due, (now + think, bot.number - first))
+        now = time.perf_counter()
+
+        # every so often, give up waiting on replies which have taken far too
+        # long
+        if now >= next_check:
+            next_check = now + 1.0
+            for bot in bots:
+                if bot.expect is not None and now - bot.sent > args.reply_timeout:
+                    timeouts += 1
+                    bot.expect = None
+                    heapq.heappush(due, (now, bot.number - first))
+
+    for bot in bots:
+        bot.sock.close()
+    print(json.dumps({"latencies": latencies, "timeouts": timeouts}), flush=True)
+
+
+def process_tree(pid):
+    # the process and all of its children, and their children, from /proc
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, ()))
+    return tree
+
+
+def rss_kb(pids):
+    # how much memory the processes have in RAM right now
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/%d/status" % pid) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def summarise(times):
+    # the mean, median, 99th percentile and longest of some times, in ms
+    if not times:
+        return {"count": 0}
+    times = sorted(times)
+
+    def percentile(pc):
+        return round(times[min(len(times) - 1, int(len(times) * pc / 100.0))] * 1e3, 3)
+
+    return {"count": len(times), "mean_ms": round(sum(times) / len(times) * 1e3, 3),
+            "p50_ms": percentile(50), "p90_ms": percentile(90), "p99_ms": percentile(99),
+            "max_ms": round(times[-1] * 1e3, 3)}
+
+
+def git_commit(root):
+    # the commit the game being tested is from, if it's in a git checkout
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_test(args):
+    """
+    Starts the server and the bots, and returns the results as a dictionary.
+    """
+    port = free_port()
+    server_args = shlex.split(args.server_args)
+    workdir = scratch_dir(args.root)
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--root", args.root,
+                               "--serve", str(port), "--server-args=" + args.server_args],
+                              cwd=workdir, stdout=subprocess.DEVNULL)
+    bots = []
+    try:
+        wait_for_port(port, server)
+
+        # share the bots out between the processes running them, and wait for
+        # them all to log in
+        share = -(-args.bots // args.bot_processes)
+        for first in range(0, args.bots, share):
+            command = [sys.executable, os.path.abspath(__file__), "--run-bots", str(port),
+                       str(first), str(min(share, args.bots - first))] + sys.argv[1:]
+            bots.append(subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         universal_newlines=True))
+        for process in bots:
+            if process.stdout.readline().strip() != "ready":
+                raise RuntimeError("the bots couldn't log in")
+        rss_idle = rss_kb(process_tree(server.pid))
+
+        # let them go, and measure the server once the warm up is over
+        for process in bots:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        time.sleep(args.warmup)
+        pids = process_tree(server.pid)
+        cpu = sum(cpu_seconds(pid) for pid in pids)
+        start = time.perf_counter()
+        rss_peak = 0
+        while time.perf_counter() < start + args.duration:
+            rss_peak = max(rss_peak, rss_kb(pids))
+            time.sleep(min(0.25, max(0.0, start + args.duration - time.perf_counter())))
+        cpu = sum(cpu_seconds(pid) for pid in pids) - cpu
+        elapsed = time.perf_counter() - start
+        rss_end = rss_kb(pids)
+
+        results = [json.loads(process.stdout.readline()) for process in bots]
+    finally:
+        for process in bots:
+            process.kill()
+            process.wait()
+        server.kill()
+        server.wait()
+        shutil.rmtree(workdir)
+
+    latencies = {}
+    for result in results:
+        for kind, times in result["latencies"].items():
+            latencies.setdefault(kind, []).extend(times)
+    everything = [t for times in latencies.values() for t in times]
+    return {
+        "commit": git_commit(args.root),
+        "settings": {"bots": args.bots, "bot_processes": args.bot_processes,
+                     "duration_s": args.duration, "warmup_s": args.warmup,
+                     "think_s": args.think, "mix": args.mix, "iac": args.iac,
+                     "seed": args.seed, "server_args": args.server_args},
+        "commands": len(everything),
+        "throughput_per_s": round(len(everything) / elapsed, 1),
+        "timeouts": sum(result["timeouts"] for result in results),
+        "latency": dict([("all", summarise(everything))] +
+                        [(kind, summarise(times)) for kind, times in sorted(latencies.items())]),
+        "server": {"processes": len(pids),
+                   "cpu_s": round(cpu, 3),
+                   "cpu_percent": round(cpu / elapsed * 100, 1),
+                   "cpu_us_per_command": round(cpu / len(everything) * 1e6, 1) if everything else None,
+                   "rss_kb_logged_in": rss_idle,
+                   "rss_kb_peak": rss_peak,
+                   "rss_kb_end": rss_end},
+    }
+
+
+def compare(old, new, tolerance):
+    """
+    Prints how 'new' results differ from 'old' ones, and returns the names of
+    the figures which are worse by more than 'tolerance' percent.
+    """
+    # each figure, and whether a bigger number is better
+    figures = (("throughput_per_s", ("throughput_per_s",), True),
+               ("p50_ms", ("latency", "all", "p50_ms"), False),
+               ("p99_ms", ("latency", "all", "p99_ms"), False),
+               ("cpu_us_per_command", ("server", "cpu_us_per_command"), False),
+               ("rss_kb_peak", ("server", "rss_kb_peak"), False))
+    worse = []
+    print("%-20s %12s %12s %8s" % ("", old.get("commit") or "old", new.get("commit") or "new", "change"))
+    for name, path, bigger_is_better in figures:
+        before, after = old, new
+        for key in path:
+            before, after = before.get(key, {}), after.get(key, {})
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or not before:
+            continue
+        change = (after - before) / float(before) * 100
+        flag = ""
+        if (-change if bigger_is_better else change) > tolerance:
+            flag = "  worse"
+            if name != "rss_kb_peak":
+                worse.append(name)
+        print("%-20s %12s %12s %+7.1f%%%s" % (name, before, after, change, flag))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bots", type=int, default=200, help="how many players to simulate")
+    parser.add_argument("--bot-processes", type=int, default=1, metavar="N",
+                        help="how many processes to run the bots from")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds to run before measuring")
+    parser.add_argument("--think", type=float, default=0.5,
+                        help="average seconds each bot waits between commands (0 for none)")
+    parser.add_argument("--mix", default="look=4,say=3,go=2,give=1",
+                        help="how often each command is used, relative to the others")
+    parser.add_argument("--iac", type=float, default=0.1, metavar="FRACTION",
+                        help="fraction of commands with Telnet negotiation in front of them")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the bots' choices")
+    parser.add_argument("--reply-timeout", type=float, default=10.0, metavar="S",
+                        help="seconds to wait for a reply before giving up on it")
+    parser.add_argument("--server-args", default="",
+                        help="options for simplemud.py, e.g. '--asyncio' or '--workers 2'")
+    parser.add_argument("--root", default=ROOT, help="the copy of the game to test")
+    parser.add_argument("--json", metavar="FILE", help="write the results to this file ('-' for stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with an earlier run's")
+    parser.add_argument("--tolerance", type=float, default=10.0, metavar="PERCENT",
+                        help="how much worse than the earlier run counts as a regression")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--run-bots", type=int, nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.root = os.path.abspath(args.root)
+    try:
+        parse_mix(args.mix)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        parser.error("--mix: %s" % e)
+
+    # run as the server process, or one of the processes running the bots
+    if args.serve:
+        serve(args.serve, args.root, shlex.split(args.server_args))
+        return
+    if args.run_bots:
+        run_bots(args.run_bots[0], args.run_bots[1], args.run_bots[2], args)
+        return
+
+    results = run_test(args)
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=1)
+        latency, server = results["latency"]["all"], results["server"]
+        print("%d bots, %s: %.0f commands/s, p50 %.2f ms, p99 %.2f ms, %d timeouts" % (
+            args.bots, args.server_args or "single process", results["throughput_per_s"],
+            latency.get("p50_ms", 0), latency.get("p99_ms", 0), results["timeouts"]))
+        print("server: %.1f%% CPU, %s us CPU per command, %d kB RSS peak" % (
+            server["cpu_percent"], server["cpu_us_per_command"], server["rss_kb_peak"]))
+
+    if args.compare:
+        with open(args.compare) as f:
+            worse = compare(json.load(f), results, args.tolerance)
+        if worse:
+            print("regression: %s" % ", ".join(worse))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Measures how much lots of players logging in at once, e.g. when everyone
+reconnects after the server has been down, holds up the players who are
+already in the game.
+
+The game is started as load_test.py starts it, and '--players' players log in
+and then keep sending 'look', one at a time, timing each reply. After
+'--baseline' seconds, '--storm' more players connect as fast as they can and
+log in, sending their name straight away. The replies the players already in
+the game got while that was going on are compared with the ones before it, and
+the time it took for everyone to log in and how many bytes the players already
+in the game were sent while it happened are reported.
+
+To compare with an older commit, check it out with 'git worktree' and give it
+with '--root', as for load_test.py.
+
+usage: python benchmarks/login_storm.py [--players N] [--storm N] [--root DIR]
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import selectors
+import subprocess
+
+from common import ROOT, free_port, scratch_dir, wait_for_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def connect(port, name, selector, data):
+    # connect and send a name, registering the socket with the selector
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(name + b"\r\n")
+    s.setblocking(False)
+    selector.register(s, selectors.EVENT_READ, data)
+    return s
+
+
+def summarise(times):
+    # the median, 99th percentile and worst of a list of times, in ms
+    times = sorted(times)
+    if not times:
+        return "no replies"
+    return "p50 %.2f ms, p99 %.2f ms, max %.2f ms (%d replies)" % (
+        times[len(times) // 2] * 1e3, times[min(len(times) - 1, len(times) * 99 // 100)] * 1e3,
+        times[-1] * 1e3, len(times))
+
+
+class Player(object):
+    """A player already in the game, sending 'look' over and over"""
+
+    def __init__(self, port, number, selector):
+        self.data = b""         # what's arrived and not been looked at yet
+        self.playing = False    # whether the player has been welcomed yet
+        self.sent = None        # when the last 'look' was sent, or None before the first
+        self.received = 0       # how many bytes the player has been sent
+        self.sock = connect(port, b"player%d" % number, selector, self)
+
+    def readable(self, times):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("a player was disconnected")
+        self.received += len(data)
+        self.data += data
+        if not self.playing:
+            if b"Welcome" not in self.data:
+                return
+            self.playing = True
+            self.look()
+        elif b"Exits are:" in self.data:
+            times.append(time.perf_counter() - self.sent)
+            self.look()
+
+    def look(self):
+        self.data = b""
+        self.sent = time.perf_counter()
+        self.sock.sendall(b"look\r\n")
+
+
+class Newcomer(object):
+    """A player logging in during the storm"""
+
+    def __init__(self):
+        self.data = b""         # what's arrived since connecting
+        self.welcomed = False   # whether they've been welcomed into the game
+
+    def readable(self, sock):
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError("a player logging in was disconnected")
+        if not self.welcomed:
+            self.data += data
+            if b"Welcome" in self.data:
+                self.welcomed = True
+                self.data = b""
+                return True
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=50,
+                        help="how many players are in the game before the storm")
+    parser.add_argument("--storm", type=int, default=2000, help="how many players log in at once")
+    parser.add_argument("--baseline", type=float, default=2.0,
+                        help="seconds to measure for before the storm")
+    parser.add_argument("--timeout", type=float, default=120.0,
+                        help="seconds to wait for everyone to log in")
+    parser.add_argument("--root", default=ROOT, help="the copy of the game to test")
+    parser.add_argument("--server-args", default="",
+                        help="arguments for simplemud.py, e.g. '--server-args=--workers 2'")
+    args = parser.parse_args()
+
+    port = free_port()
+    workdir = scratch_dir(args.root)
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "load_test.py"), "--root", args.root,
+                               "--serve", str(port), "--server-args=" + args.server_args],
+                              cwd=workdir, stdout=subprocess.DEVNULL)
+    selector = selectors.DefaultSelector()
+    newcomers = []
+    try:
+        wait_for_port(port, server)
+
+        # log the players in, then time their looks for a while
+        players = [Player(port, number, selector) for number in range(args.players)]
+        before = []
+        start = time.perf_counter()
+        while time.perf_counter() < start + args.baseline:
+            for key, mask in selector.select(0.1):
+                key.data.readable(before)
+
+        # then everyone else connects at once, while we keep timing the
+        # players in the game
+        during = []
+        welcomed = [0]
+
+        def pump(timeout):
+            for key, mask in selector.select(timeout):
+                if isinstance(key.data, Player):
+                    key.data.readable(during)
+                elif key.data.readable(key.fileobj):
+                    welcomed[0] += 1
+
+        received = sum(player.received for player in players)
+        start = time.perf_counter()
+        for number in range(args.storm):
+            newcomers.append(connect(port, b"newcomer%d" % number, selector, Newcomer()))
+            if number % 50 == 49:
+                pump(0)
+        while welcomed[0] < args.storm and time.perf_counter() < start + args.timeout:
+            pump(0.1)
+        took = time.perf_counter() - start
+        received = sum(player.received for player in players) - received
+
+        print("%d players in the game, %d logging in" % (args.players, args.storm))
+        print("  before the storm: %s" % summarise(before))
+        print("  during the storm: %s" % summarise(during))
+        print("  %d of %d logged in after %.2f s, %.0f a second" % (
+            welcomed[0], args.storm, took, welcomed[0] / took))
+        print("  each player in the game was sent %.0f bytes during the storm" % (
+            received / args.players))
+    finally:
+        for s in newcomers:
+            s.close()
+        server.kill()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how long players are kept waiting when simplemud.py is restarted,
+e.g. to pick up changes to its code, with its 'restart' command compared with
+stopping it and starting it again.
+
+A server is started with lots of players logged in. With 'restart', an admin
+restarts it and then sends a 'look', and the time until the reply arrives is
+measured; nobody is disconnected. The old way, the server is killed and
+started again, and every player reconnects and logs in again as soon as they
+can, and the time until they're all back in the game is measured.
+
+usage: python benchmarks/restart.py [--players N]
+"""
+
+import time
+import shutil
+import argparse
+
+from common import free_port, scratch_dir, start_server, log_in, drain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=500)
+    args = parser.parse_args()
+
+    names = ["player%d" % number for number in range(args.players)]
+    workdir = scratch_dir()
+    port = free_port()
+    proc = start_server(port, workdir, "--host", "127.0.0.1", "--admin", "admin")
+    try:
+        admin = log_in(port, ["admin"])[0]
+        players = log_in(port, names)
+        time.sleep(0.5)
+        drain(players + [admin])
+        admin.setblocking(True)
+
+        # restart the server with everyone still connected
+        start = time.perf_counter()
+        admin.sendall(b"restart\r\nlook\r\n")
+        data = b""
+        while b"Exits are:" not in data:
+            data += admin.recv(65536)
+        paused = time.perf_counter() - start
+        print("%d players, 'restart': %.0f ms until the server replied, nobody disconnected" % (
+            args.players, paused * 1e3))
+        drain(players)
+
+        # then the old way
+        start = time.perf_counter()
+        proc.kill()
+        proc.wait()
+        proc = start_server(port, workdir, "--host", "127.0.0.1", "--admin", "admin")
+        for s in players + [admin]:
+            s.close()
+        players = log_in(port, names)
+        back = time.perf_counter() - start
+        print("%d players, stop and start: %.0f ms until everyone was back in the game" % (
+            args.players, back * 1e3))
+        for s in players:
+            s.close()
+    finally:
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Simulates thousands of players spread across a large world, each doing one
+'say', 'look' or 'go' per tick, and reports how long a tick takes using the
+game's room occupancy index compared with the old approach of going through
+every player in the game to find the ones in the same room.
+
+No network connections are made: the game's commands are called directly,
+with a stand-in for the server which just counts the messages sent.
+
+usage: python benchmarks/room_load.py [players ...]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import simplemud
+from mudserver import MudServer
+from worldgraph import WorldGraph
+from common import make_grid
+
+
+class CountingServer(object):
+    """Takes the place of MudServer, counting messages instead of sending them"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, to, message):
+        self.sent += 1
+
+    def send_to_many(self, ids, message):
+        for to in ids:
+            self.sent += 1
+
+    encode_message = staticmethod(MudServer.encode_message)
+
+
+def make_world(size):
+    # a square grid of rooms, each with exits to its neighbours, plus the
+    # tavern where new players start
+    rooms = make_grid(size)
+    rooms["Tavern"] = {"description": "A tavern.", "exits": {"grid": "0,0"}}
+    return rooms
+
+
+def legacy_command(id, command, params):
+    # the old versions of 'say', 'look' and 'go', which went through every
+    # player in the game to find the ones in the same room
+    mud = simplemud.mud
+    active_players = simplemud.active_players
+    rooms = simplemud.rooms
+    if command == "say":
+        for pid, pl in active_players.items():
+            if active_players[pid].room == active_players[id].room:
+                mud.send_message(pid, "%s says: %s" % (active_players[id].name, params))
+    elif command == "look":
+        rm = rooms[simplemud.room_name(active_players[id].room)]
+        mud.send_message(id, rm["description"])
+        playershere = []
+        for pid, pl in active_players.items():
+            if active_players[pid].room == active_players[id].room:
+                if active_players[pid].name is not None:
+                    playershere.append(active_players[pid].name)
+        mud.send_message(id, "Players here: %s" % ", ".join(playershere))
+        mud.send_message(id, "Exits are: %s" % ", ".join(rm["exits"]))
+    elif command == "go":
+        ex = params
+        rm = rooms[simplemud.room_name(active_players[id].room)]
+        if ex in rm["exits"]:
+            for pid, pl in active_players.items():
+                if active_players[pid].room == active_players[id].room and pid != id:
+                    mud.send_message(pid, "%s left via exit '%s'" % (active_players[id].name, ex))
+            active_players[id].room = simplemud.room_id(rm["exits"][ex])
+            for pid, pl in active_players.items():
+                if active_players[pid].room == active_players[id].room and pid != id:
+                    mud.send_message(pid, "%s arrived via exit '%s'" % (active_players[id].name, ex))
+            mud.send_message(id, "You arrive at '%s'" % rm["exits"][ex])
+
+
+def setup(count, world_size, rnd):
+    # log in 'count' players and scatter them around the world
+    simplemud.rooms = make_world(world_size)
+    simplemud.world = WorldGraph()
+    simplemud.update_world(simplemud.rooms)
+    simplemud.players = {}
+    simplemud.active_players.clear()
+    simplemud.player_ids.clear()
+    simplemud.sessions.clear()
+    for pending in (simplemud.connecting, simplemud.entered, simplemud.departed,
+                    simplemud.leaving):
+        del pending[:]
+    simplemud.channels = simplemud.Channels()
+    simplemud.room_occupants.clear()
+    simplemud.mud = CountingServer()
+    # saving players who move costs the same either way, so it's left out to
+    # show the difference
+    simplemud.save_player = lambda id: None
+    grid = [name for name in simplemud.rooms if name != "Tavern"]
+    for id in range(count):
+        simplemud.new_player(id)
+        simplemud.player_command(id, "player%d" % id, "")
+        simplemud.leave_room(id)
+        simplemud.enter_room(id, rnd.choice(grid))
+    # only count the messages sent once the game is under way
+    simplemud.mud.sent = 0
+
+
+def make_ticks(count, ticks, rnd):
+    # each tick, every player does one thing. Exits are picked when the tick
+    # runs, since it depends which room the player is in by then
+    actions = []
+    for t in range(ticks):
+        actions.append([(id, rnd.choice(["say", "look", "go"])) for id in range(count)])
+    return actions
+
+
+def run_ticks(handler, actions, rnd):
+    times = []
+    for tick in actions:
+        start = time.perf_counter()
+        for id, command in tick:
+            if command == "go":
+                exits = list(simplemud.rooms[simplemud.room_name(simplemud.active_players[id].room)]["exits"])
+                handler(id, "go", rnd.choice(exits))
+            elif command == "say":
+                handler(id, "say", "hello")
+            else:
+                handler(id, "look", "")
+        times.append(time.perf_counter() - start)
+    return sum(times) / len(times)
+
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [1000, 2000, 5000]
+    for count in counts:
+        # roughly ten players per room
+        world_size = max(1, int((count / 10) ** 0.5))
+        ticks = 3
+        results = []
+        for name, handler in (("scan all players", legacy_command),
+                              ("occupancy index", simplemud.player_command)):
+            rnd = random.Random(1)
+            setup(count, world_size, rnd)
+            actions = make_ticks(count, ticks, rnd)
+            results.append((name, run_ticks(handler, actions, rnd), simplemud.mud.sent,
+                            [pl.room for pl in simplemud.active_players.values()]))
+        # both ways sent the same number of messages, and left everyone in the
+        # same rooms, or the timings don't mean much
+        assert results[0][2:] == results[1][2:], "the old and new commands didn't agree"
+        for name, per_tick, sent, where in results:
+            print("%6d players, %5d rooms, %-16s %9.1f ms/tick (%d messages)"
+                  % (count, world_size * world_size, name, per_tick * 1e3, sent))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how long saving players takes with a large number of player records,
+comparing the old approach of rewriting the whole of 'players.json' with the
+JournalStore, which only writes the players who changed, in the background.
+
+usage: python benchmarks/save_players.py [records]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from persistence import JournalStore
+
+
+def make_players(count):
+    return dict(("player%d" % i, {"room": "Tavern", "inventory": ["sword", "shield", "bread"]})
+                for i in range(count))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    players = make_players(count)
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "players.json")
+
+        # the old way: every save rewrote every player, on the game's thread
+        start = time.perf_counter()
+        with open(path, "w") as outfile:
+            json.dump(players, outfile, sort_keys=True, indent=4, ensure_ascii=False)
+        full = time.perf_counter() - start
+        print("%d records, full rewrite:              %10.1f ms on the game thread" % (count, full * 1e3))
+
+        start = time.perf_counter()
+        store = JournalStore(path, flush_interval=3600)
+        print("%d records, opening the store:         %10.1f ms" % (count, (time.perf_counter() - start) * 1e3))
+
+        # one player changing, as happens after a 'go' or 'give'
+        changes = 1000
+        start = time.perf_counter()
+        for i in range(changes):
+            store.put("player%d" % i, {"room": "bar", "inventory": ["sword", "shield"]})
+        put = (time.perf_counter() - start) / changes
+        print("%d records, saving one changed player: %10.3f ms on the game thread" % (count, put * 1e3))
+
+        # getting the changes onto the disk, which happens in the background
+        start = time.perf_counter()
+        store.flush()
+        print("%d records, writing %d changes:      %10.1f ms in the background"
+              % (count, changes, (time.perf_counter() - start) * 1e3))
+
+        # rewriting the main file, which happens in the background once the
+        # journal gets big, and when the store is closed
+        start = time.perf_counter()
+        store.close()
+        print("%d records, compacting:                %10.1f ms in the background"
+              % (count, (time.perf_counter() - start) * 1e3))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Measures how much memory the server and the game use for each player who's
+connected and logged in, using Python's tracemalloc module.
+
+The game from simplemud.py is run on MudServer in this process, with the world
+from world.json and nowhere to save players. The players connect from a
+separate process, give their names and then just read whatever they're sent.
+Once they've all logged in and everything they've been sent has gone, the
+memory allocated since before the first of them connected is divided by the
+number of players, and broken down by the file, or with '--lines' the line,
+which allocated it. This
+doesn't include memory used by the operating system for each connection,
+e.g. for its socket buffers.
+
+usage: python benchmarks/session_memory.py [--players N] [--lines]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import selectors
+import subprocess
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+class NoStore(dict):
+    """Takes the place of the player store, without keeping anything"""
+
+    def put(self, name, record):
+        pass
+
+    def flush(self):
+        pass
+
+
+def run_players(port, count):
+    # connect everyone and give their names, then read until the server goes
+    selector = selectors.DefaultSelector()
+    for number in range(count):
+        s = socket.create_connection(("127.0.0.1", port))
+        s.sendall(b"player%d\r\n" % number)
+        s.setblocking(False)
+        selector.register(s, selectors.EVENT_READ)
+    while selector.get_map():
+        for key, mask in selector.select():
+            try:
+                data = key.fileobj.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+
+def logged_in():
+    # how many players are in a room, which they are once they've logged in
+    import simplemud
+    return sum(len(occupants) for occupants in simplemud.room_occupants.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--lines", action="store_true", help="break the memory down by line")
+    parser.add_argument("--connect", type=int, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # run as the process the players connect from
+    if args.connect:
+        run_players(*args.connect)
+        return
+
+    import simplemud
+    from mudserver import MudServer
+
+    # set the game up as simplemud.main would, without limiting how fast the
+    # players can log in
+    with open(os.path.join(ROOT, "world.json")) as f:
+        simplemud.rooms = json.load(f)
+    simplemud.players = NoStore()
+    mud = simplemud.mud = MudServer(0, host="127.0.0.1", command_rate=None)
+    port = mud._listen_socket.getsockname()[1]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    players = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--connect",
+                                str(port), str(args.players)])
+    try:
+        # run the game until everyone's logged in, and then for a little while
+        # longer so everything they've been sent has gone
+        settled = None
+        while settled is None or time.perf_counter() < settled:
+            mud.update(timeout=0.05)
+            for id in mud.get_new_players():
+                simplemud.new_player(id)
+            for id in mud.get_disconnected_players():
+                simplemud.player_left(id)
+            for id, command, params in mud.get_commands():
+                simplemud.player_command(id, command, params)
+            if settled is None and logged_in() == args.players:
+                settled = time.perf_counter() + 1.0
+
+        after = tracemalloc.take_snapshot()
+    finally:
+        players.kill()
+        players.wait()
+
+    # only count memory allocated by the server and the game, not by
+    # tracemalloc itself
+    differences = [stat for stat in after.compare_to(before, "lineno" if args.lines else "filename")
+                   if "tracemalloc" not in stat.traceback[0].filename]
+    total = sum(stat.size_diff for stat in differences)
+    print("%d players: %.0f bytes per player" % (args.players, total / args.players))
+    for stat in sorted(differences, key=lambda stat: -stat.size_diff):
+        if abs(stat.size_diff) >= args.players:
+            frame = stat.traceback[0]
+            where = os.path.basename(frame.filename)
+            if args.lines:
+                where += ":%d" % frame.lineno
+            print("  %8.0f  %s" % (stat.size_diff / args.players, where))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Measures how many commands a second the game can handle when it's split across
+different numbers of worker processes with '--workers'.
+
+The game is started with a generated world: a grid of rooms, where each row of
+rooms is a zone. Lots of players connect, and each of them sends a 'look' or a
+'go' in some random direction as soon as it gets the reply to its last one,
+so that the game is kept as busy as it can be. A worker count of 0 runs the
+game in a single process as usual.
+
+The players are run from this process, so the figures only mean something on a
+machine with more cores than there are workers, with one to spare.
+
+usage: python benchmarks/shards.py [--players N] [--duration S] [workers ...]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import functools
+import selectors
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import free_port, make_grid, log_in
+
+
+# the last line of the reply to each command the players send
+REPLY_ENDS = (b"Exits are:", b"You arrive at", b"Unknown exit")
+
+
+def make_world(size):
+    # a square grid of rooms, each with exits to its neighbours. Each row is a
+    # zone, so going east or west stays in the same worker, and going north or
+    # south usually means being handed over to another one
+    rooms = make_grid(size)
+    for name, room in rooms.items():
+        room["zone"] = "row %s" % name.split(",")[1]
+    # new players start in the tavern, so put it in the middle of the grid
+    rooms["Tavern"] = rooms.pop("%d,%d" % (size // 2, size // 2))
+    for room in rooms.values():
+        for ex, target in room["exits"].items():
+            if target == "%d,%d" % (size // 2, size // 2):
+                room["exits"][ex] = "Tavern"
+    return rooms
+
+
+def serve(port, workers):
+    # run the game as simplemud.py would, but without the limit on how fast
+    # each player may send commands
+    import simplemud
+    from mudserver import MudServer
+
+    simplemud.MudServer = functools.partial(MudServer, command_rate=None)
+    sys.argv = ["simplemud.py", str(port), "--workers", str(workers)]
+    simplemud.main()
+
+
+def run_players(port, count, duration):
+
+    # log everyone in, and wait for the welcome messages to arrive
+    players = log_in(port, ["bot%d" % number for number in range(count)])
+    selector = selectors.DefaultSelector()
+    for number, s in enumerate(players):
+        selector.register(s, selectors.EVENT_READ, number)
+    buffers = [b""] * count
+
+    def send_command(number):
+        if random.random() < 0.5:
+            players[number].sendall(b"look\r\n")
+        else:
+            players[number].sendall(b"go %s\r\n" % random.choice([b"north", b"south", b"east", b"west"]))
+
+    # keep every player busy, counting the replies
+    done = 0
+    for number in range(count):
+        buffers[number] = b""
+        send_command(number)
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        for key, mask in selector.select(0.1):
+            number = key.data
+            data = buffers[number] + key.fileobj.recv(65536)
+            # only count complete lines, keeping the rest for next time
+            complete = data.rfind(b"\n") + 1
+            replies = sum(data.count(ending, 0, complete) for ending in REPLY_ENDS)
+            buffers[number] = data[complete:]
+            if replies:
+                done += replies
+                send_command(number)
+    elapsed = time.perf_counter() - start
+
+    for s in players:
+        s.close()
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("workers", type=int, nargs="*", default=[0, 1, 2, 4])
+    parser.add_argument("--players", type=int, default=400)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--size", type=int, default=16, help="width of the grid of rooms")
+    parser.add_argument("--serve", type=int, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # run as the game process
+    if args.serve:
+        serve(*args.serve)
+        return
+
+    print("%d players, %d rooms, %d CPU cores" % (args.players, args.size * args.size, os.cpu_count()))
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "world.json"), "w") as f:
+                json.dump(make_world(args.size), f)
+            port = free_port()
+            server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port),
+                                       str(workers)], cwd=directory, stdout=subprocess.DEVNULL)
+            try:
+                time.sleep(1.0)
+                rate = run_players(port, args.players, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            print("%d workers: %8.0f commands/s" % (workers, rate))
+
+
+if __name__ == "__main__":
+    main()
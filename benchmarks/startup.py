@@ -0,0 +1,96 @@
+"""
+Compares how long the game takes to get going, and how much memory its world
+and players take up, when they're loaded from the JSON files and when they're
+kept in an SQLite database. Each is measured in a fresh process, and includes
+noting where every room's exits lead, as the game does when it starts. Keeping
+track of memory slows everything down, so the time is measured in a process of
+its own, without it.
+
+usage: python benchmarks/startup.py [rooms] [players]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from sqlitestore import import_json
+
+# run in a fresh process for each backend. Starting up means getting to the
+# point where the first player can be shown the room they're in
+MEASURE = """
+import sys, time, tracemalloc
+sys.path.insert(0, %(root)r)
+if %(trace)r:
+    tracemalloc.start()
+start = time.perf_counter()
+if %(sqlite)r:
+    from sqlitestore import SqliteStore
+    rooms = SqliteStore("mud.db", "rooms")
+    players = SqliteStore("mud.db", "players")
+else:
+    from persistence import JournalStore
+    rooms = JournalStore("world.json")
+    players = JournalStore("players.json")
+from worldgraph import WorldGraph
+world = WorldGraph()
+world.update(dict((name, room["exits"]) for name, room in rooms.items()))
+rooms["Tavern"]["description"]
+players.get("player0")
+elapsed = time.perf_counter() - start
+print(elapsed, tracemalloc.get_traced_memory()[0])
+"""
+
+
+def make_world(count):
+    rooms = {"Tavern": {"description": "A cozy tavern.", "exits": {"east": "room0"}}}
+    for i in range(count):
+        exits = {"west": "room%d" % (i - 1) if i > 0 else "Tavern"}
+        if i < count - 1:
+            exits["east"] = "room%d" % (i + 1)
+        rooms["room%d" % i] = {"description": "Room number %d, much like all the others." % i,
+                               "exits": exits}
+    return rooms
+
+
+def measure(workdir, sqlite, trace):
+    output = subprocess.check_output([sys.executable, "-c", MEASURE % {"root": ROOT, "sqlite": sqlite,
+                                                                       "trace": trace}],
+                                     cwd=workdir)
+    elapsed, memory = output.split()
+    return float(elapsed), int(memory)
+
+
+def main():
+    room_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    player_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    workdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(workdir, "world.json"), "w") as f:
+            json.dump(make_world(room_count), f, sort_keys=True, indent=4)
+        with open(os.path.join(workdir, "players.json"), "w") as f:
+            json.dump(dict(("player%d" % i, {"room": "Tavern", "inventory": []})
+                           for i in range(player_count)), f)
+
+        start = time.perf_counter()
+        import_json(os.path.join(workdir, "mud.db"), os.path.join(workdir, "world.json"),
+                    os.path.join(workdir, "players.json"))
+        print("importing %d rooms and %d players into SQLite: %.2f s (once)"
+              % (room_count, player_count, time.perf_counter() - start))
+
+        for name, sqlite in (("JSON files", False), ("SQLite", True)):
+            elapsed = measure(workdir, sqlite, False)[0]
+            memory = measure(workdir, sqlite, True)[1]
+            print("%-10s startup %8.1f ms, %8.1f MB in use" % (name, elapsed * 1e3, memory / 1e6))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Feeds a few megabytes of player input, mixed with Telnet commands, through
+MudServer's Telnet parser and through the character-at-a-time parser it
+replaced, and reports how fast each one gets through it.
+
+Before anything is timed, the parser is checked against a few tricky inputs:
+a 255 byte sent as part of the text, Telnet commands split across reads, and
+text sent back out again, which mustn't turn into Telnet commands on the way.
+Both parsers are also checked to get the same lines out of the input they're
+timed on, without the new one answering any of its option negotiation.
+
+usage: python benchmarks/telnet_parser.py [megabytes]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mudserver import MudServer
+
+IAC = 255
+
+
+class LegacyClient(object):
+    buffer = ""
+
+
+def legacy_process_sent_data(client, data):
+    # the old parser, which looked at the input one character at a time and
+    # built up the buffer with string concatenation. It only gave back the last
+    # line in the data; here every line is kept, so the two can be compared
+    messages = []
+    state = 1
+    for c in data:
+        if state == 1:
+            if ord(c) == 255:
+                state = 2
+            elif c == "\n":
+                messages.append(client.buffer)
+                client.buffer = ""
+            elif c == "\x08":
+                client.buffer = client.buffer[:-1]
+            else:
+                client.buffer += c
+        elif state == 2:
+            if ord(c) == 250:
+                state = 3
+            elif ord(c) in (251, 252, 253, 254):
+                state = 2
+            else:
+                state = 1
+        elif state == 3:
+            if ord(c) == 240:
+                state = 1
+    return messages
+
+
+def make_input(size):
+    # a mixture of typed commands, option negotiation, terminal type
+    # subnegotiation, the odd backspace and some long pasted lines
+    rnd = random.Random(1)
+    words = [b"look", b"say", b"hello", b"there", b"go", b"tavern", b"drink cabinet", b"give", b"sword"]
+    parts = []
+    total = 0
+    while total < size:
+        roll = rnd.random()
+        if roll < 0.1:
+            part = bytes([IAC, rnd.choice([251, 252, 253, 254]), rnd.randrange(40)])
+        elif roll < 0.15:
+            part = bytes([IAC, 250, 24, 0]) + b"xterm-256color" + bytes([IAC, 240])
+        elif roll < 0.2:
+            part = b"typo\x08\x08\x08\x08"
+        elif roll < 0.25:
+            part = b"say " + b" ".join(rnd.choice(words) for i in range(300)) + b"\r\n"
+        else:
+            part = b" ".join(rnd.choice(words) for i in range(rnd.randint(1, 6))) + b"\r\n"
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)
+
+
+def parse_all(pieces, mccp=None, max_line_length=1024):
+    # the lines a new client gets out of the pieces, one read at a time, and
+    # where it got to with compression
+    client = MudServer.Client(None, "", bytearray(), 0)
+    if mccp is not None:
+        client.mccp = mccp
+    lines = []
+    for piece in pieces:
+        lines += client.read_lines(piece, max_line_length)
+    return lines, client.mccp
+
+
+def check_parser():
+    # two 255s in a row are a single 255 in the text
+    sent = b"say x" + bytes([IAC, IAC, 250, 86, IAC, IAC, 240]) + b"\r\n"
+    text = "say x\xff\xfaV\xff\xf0\r"
+    assert parse_all([sent])[0] == [text]
+
+    # and when that text is sent on to other players, it comes out as text
+    # again rather than as a Telnet command, e.g. one turning on compression
+    encoded = MudServer.encode_message(text)
+    assert encoded.replace(bytes([IAC, IAC]), b"").count(bytes([IAC])) == 0
+    assert parse_all([encoded])[0] == [text]
+
+    # a mixture of commands, split in two at every possible place, and sent a
+    # byte at a time, gives the same lines, and still agrees to compression
+    stream = (b"look\r\n" + bytes([IAC, 253, 86]) + b"say a" + bytes([IAC, IAC]) + b"b\r\n"
+              + bytes([IAC, 250, 24, 0]) + b"xterm" + bytes([IAC, 240]) + b"go out\x08\x08\x08bar\r\n"
+              + bytes([IAC, 251, 31]) + b"quit\r\n")
+    expected = (["look\r", "say a\xffb\r", "go bar\r", "quit\r"], MudServer._MCCP_AGREED)
+    assert parse_all([stream], MudServer._MCCP_OFFERED) == expected
+    for split in range(1, len(stream)):
+        assert parse_all([stream[:split], stream[split:]], MudServer._MCCP_OFFERED) == expected, split
+    assert parse_all([stream[i:i + 1] for i in range(len(stream))], MudServer._MCCP_OFFERED) == expected
+
+
+def check_same_lines(data):
+    # the old and new parsers get the same lines out of the data, and the new
+    # one doesn't answer any of the negotiation, since none of it is about
+    # compression. The old parser forgot where it was in a Telnet command
+    # between reads, so the data is given to both in one go. It didn't limit
+    # the length of a line either, so neither does the new one here
+    old = legacy_process_sent_data(LegacyClient(), data.decode("latin1"))
+    new, mccp = parse_all([data], max_line_length=len(data))
+    assert old == new, "the parsers disagree"
+    assert mccp == MudServer._MCCP_OFF
+
+
+def chunks(data, size=4096):
+    # the data as it would arrive from 'recv'
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def time_parser(name, parse, pieces, total):
+    start = time.perf_counter()
+    for piece in pieces:
+        parse(piece)
+    elapsed = time.perf_counter() - start
+    print("%-8s %8.3f s  %8.1f MB/s" % (name, elapsed, total / elapsed / 1e6))
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    check_parser()
+    data = make_input(int(megabytes * 1e6))
+    check_same_lines(data)
+    pieces = chunks(data)
+    print("%d bytes in %d reads" % (len(data), len(pieces)))
+
+    legacy_client = LegacyClient()
+    legacy_pieces = [piece.decode("latin1") for piece in pieces]
+    time_parser("old", lambda piece: legacy_process_sent_data(legacy_client, piece), legacy_pieces, len(data))
+
+    mud = MudServer(0)
+    client = MudServer.Client(None, "", bytearray(), 0)
+    time_parser("new", lambda piece: mud._process_sent_data(client, piece), pieces, len(data))
+
+    # a single huge line with no newline in it, arriving over many reads
+    paste = chunks(b"x" * 256 * 1024)
+    legacy_client = LegacyClient()
+    legacy_paste = [piece.decode("latin1") for piece in paste]
+    print("256 KB line without a newline:")
+    time_parser("old", lambda piece: legacy_process_sent_data(legacy_client, piece), legacy_paste, 256 * 1024)
+    client = MudServer.Client(None, "", bytearray(), 0)
+    time_parser("new", lambda piece: mud._process_sent_data(client, piece), paste, 256 * 1024)
+    mud.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures what a building session costs: a number of 'room' commands made in a
+big world. The old approach wrote out the whole of 'world.json' after every
+command, whereas the world is now kept in a JournalStore, which only adds the
+changed rooms to a log.
+
+usage: python benchmarks/world_edits.py [rooms] [edits]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from persistence import JournalStore
+
+
+def make_world(count):
+    return dict(("room%d" % i, {"description": "Room number %d." % i, "exits": {"tavern": "Tavern"}})
+                for i in range(count))
+
+
+def main():
+    room_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    edits = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "world.json")
+        rooms = make_world(room_count)
+        with open(path, "w") as f:
+            json.dump(rooms, f, sort_keys=True, indent=4)
+
+        # the old way: change the room, then write out the whole world
+        start = time.perf_counter()
+        for i in range(edits):
+            rooms["new%d" % i] = {"description": "A new room.", "exits": {"room0": "room0"}}
+            rooms["room0"]["exits"]["new%d" % i] = "new%d" % i
+            with open(path, "w") as outfile:
+                json.dump(rooms, outfile, sort_keys=True, indent=4, ensure_ascii=False)
+        old = (time.perf_counter() - start) / edits
+
+        # the new way: save the two changed rooms to the store
+        store = JournalStore(path)
+        start = time.perf_counter()
+        for i in range(edits):
+            linked = store["room0"]
+            linked["exits"]["new%d" % i] = "new%d" % i
+            store.put("new%d" % i, {"description": "A new room.", "exits": {"room0": "room0"}})
+            store.put("room0", linked)
+        new = (time.perf_counter() - start) / edits
+        store.close()
+
+        print("%d rooms, rewriting world.json:  %10.3f ms per 'room' command" % (room_count, old * 1e3))
+        print("%d rooms, logging changed rooms: %10.3f ms per 'room' command" % (room_count, new * 1e3))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
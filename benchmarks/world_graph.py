@@ -0,0 +1,129 @@
+"""
+Measures how long it takes to find routes and rooms in a big world with
+WorldGraph, compared with doing the same by going through the game's room
+dictionaries.
+
+The world is a square grid of rooms, each with exits to its neighbours. The
+graph is built from it, timed, and the memory it takes is measured with
+Python's tracemalloc module. Then routes are found between random pairs of
+rooms, first by searching the room dictionaries by name and then with the
+graph, and rooms are found by the start of their name, first by going through
+every room's name and then with the graph's index. Each route is only asked for
+once, so the graph's cache of routes doesn't help.
+
+usage: python benchmarks/world_graph.py [--queries N] [rooms ...]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import collections
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from worldgraph import WorldGraph
+from common import make_grid
+
+
+def legacy_route(rooms, start, goal):
+    # search outwards through the room dictionaries by name, stopping as soon
+    # as the goal is reached
+    came_from = {start: None}
+    queue = collections.deque([start])
+    while queue:
+        name = queue.popleft()
+        for ex, to in rooms[name]["exits"].items():
+            if to in came_from:
+                continue
+            came_from[to] = (name, ex)
+            if to == goal:
+                route = []
+                while came_from[to] is not None:
+                    to, ex = came_from[to]
+                    route.append(ex)
+                return route[::-1]
+            queue.append(to)
+    return None
+
+
+def legacy_find_rooms(rooms, text, limit=10):
+    # go through every room's name
+    text = text.lower()
+    return [name for name in rooms if name.lower().startswith(text)][:limit]
+
+
+def check_same(rooms, world, pairs, prefixes):
+    # the graph finds routes as short as the old search, and the same rooms,
+    # before either is timed. The graph gives just the room called 'text',
+    # ignoring case, when there is one, and otherwise the rooms in order of
+    # name
+    for start, goal in pairs:
+        old = legacy_route(rooms, start, goal)
+        new = world._search(world.room_id(start), world.room_id(goal))
+        assert (old is None) == (new is None) and len(old or ()) == len(new or ()), (start, goal)
+    for text, in prefixes:
+        old = legacy_find_rooms(rooms, text, limit=len(rooms))
+        new = world.find_rooms(text, limit=len(rooms))
+        same = [name for name in old if name.lower() == text.lower()]
+        assert new == (same or sorted(old, key=str.lower)), text
+
+
+def time_each(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(*item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("counts", type=int, nargs="*", default=[10000, 100000, 250000])
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    for count in args.counts:
+        size = int(count ** 0.5)
+        rooms = make_grid(size, "room %d,%d")
+        names = list(rooms)
+        rnd = random.Random(1)
+
+        # build the graph once to time it, and again to see how much memory it
+        # takes, since tracemalloc slows everything down
+        start = time.perf_counter()
+        world = WorldGraph()
+        world.update(dict((name, room["exits"]) for name, room in rooms.items()))
+        built = time.perf_counter() - start
+        del world
+        tracemalloc.start()
+        world = WorldGraph()
+        world.update(dict((name, room["exits"]) for name, room in rooms.items()))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # routes between random rooms, and between rooms a few steps apart
+        far = [(rnd.choice(names), rnd.choice(names)) for query in range(args.queries)]
+        near = []
+        for query in range(args.queries):
+            x, y = rnd.randrange(size - 3), rnd.randrange(size - 3)
+            near.append(("room %d,%d" % (x, y), "room %d,%d" % (x + 3, y + 2)))
+        prefixes = [("room %d,%d" % (rnd.randrange(size), rnd.randrange(size // 10 or 1)),)
+                    for query in range(args.queries)]
+
+        check_same(rooms, world, far + near, prefixes + [("room 1",), ("ROOM 2,1",)])
+
+        print("%d rooms: graph built in %.2f s, %.0f bytes per room" % (
+            len(rooms), built, memory / len(rooms)))
+        for name, pairs in (("far route", far), ("near route", near)):
+            old = time_each(lambda a, b: legacy_route(rooms, a, b), pairs)
+            new = time_each(lambda a, b: world._search(world.room_id(a), world.room_id(b)), pairs)
+            print("  %-12s  dictionaries %9.3f ms  graph %9.3f ms" % (name, old * 1e3, new * 1e3))
+        old = time_each(lambda text: legacy_find_rooms(rooms, text), prefixes)
+        new = time_each(lambda text: world.find_rooms(text), prefixes)
+        print("  %-12s  dictionaries %9.3f ms  graph %9.3f ms" % ("find room", old * 1e3, new * 1e3))
+
+
+if __name__ == "__main__":
+    main()
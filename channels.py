@@ -0,0 +1,91 @@
+"""
+Channels for MUD games: named groups of players who can all be talked to at
+once, wherever they are in the world.
+
+Contains one class, Channels, which keeps the players in each channel as a set
+of their ids, so that sending something to a channel only goes through the
+players in it, however many players there are in the game.
+"""
+
+
+class Channels(object):
+    """
+    The channels in a game, and the players in each of them.
+
+    Channel names are case-insensitive, and a channel exists for as long as
+    anyone is in it. The Channels only keeps track of who's in what; the game
+    sends messages to a channel's members itself, e.g. with the server's
+    'send_to_many', so that each message is turned into bytes once.
+    """
+
+    _members = {}   # maps channel name to the set of ids of the players in it
+    _joined = {}    # maps player id to the set of names of the channels they're in
+
+    def __init__(self):
+        """
+        Constructs a Channels with no channels in it.
+        """
+        self._members = {}
+        self._joined = {}
+
+    def join(self, id, name):
+        """
+        Adds the player with the id 'id' to the channel called 'name', starting
+        the channel if nobody's in it yet. Returns False if they were already in
+        it.
+        """
+        name = name.lower()
+        members = self._members.setdefault(name, set())
+        if id in members:
+            return False
+        members.add(id)
+        self._joined.setdefault(id, set()).add(name)
+        return True
+
+    def leave(self, id, name):
+        """
+        Takes the player with the id 'id' out of the channel called 'name',
+        forgetting about the channel if nobody's left in it. Returns False if
+        they weren't in it.
+        """
+        name = name.lower()
+        members = self._members.get(name)
+        if members is None or id not in members:
+            return False
+        members.discard(id)
+        if not members:
+            del self._members[name]
+        joined = self._joined[id]
+        joined.discard(name)
+        if not joined:
+            del self._joined[id]
+        return True
+
+    def leave_all(self, id):
+        """
+        Takes the player with the id 'id' out of every channel they're in, e.g.
+        when they leave the game.
+        """
+        for name in list(self._joined.get(id, ())):
+            self.leave(id, name)
+
+    def members(self, name):
+        """
+        Returns the set of ids of the players in the channel called 'name',
+        which is empty if there's nobody in it. The set mustn't be changed.
+        """
+        return self._members.get(name.lower(), frozenset())
+
+    def joined(self, id):
+        """
+        Returns the set of names of the channels the player with the id 'id' is
+        in, which is empty if they aren't in any. The set mustn't be changed.
+        """
+        return self._joined.get(id, frozenset())
+
+    def is_member(self, id, name):
+        """
+        Returns whether the player with the id 'id' is in the channel called
+        'name'.
+        """
+        return id in self._members.get(name.lower(), ())
@@ -0,0 +1,157 @@
+"""
+Command lookup for MUD games.
+
+Contains one class, CommandTable, which maps the commands players type to the
+functions which handle them, and works out how each command's parameters
+should be split up.
+"""
+
+
+import time
+import shlex
+
+
+# Different ways a command's parameters can be handed to its handler
+ARGS_RAW = 1     # the text after the command, exactly as it was typed
+ARGS_SPLIT = 2   # a list of the words after the command
+ARGS_QUOTED = 3  # a list of the words after the command, where "quoted text" counts as one word
+
+
+def shlex_this(command):
+    lex = shlex.shlex(command)
+    lex.quotes = '"'
+    lex.whitespace_split = True
+    lex.commenters = ''
+    return list(lex)
+
+
+def parse_args(style, params):
+    """
+    Splits up the text typed after a command, 'params', in the way given by
+    'style', which is one of ARGS_RAW, ARGS_SPLIT or ARGS_QUOTED. Raises
+    ValueError if it can't be split up, e.g. because a quote isn't closed.
+    """
+    if style == ARGS_SPLIT:
+        return params.split()
+    if style == ARGS_QUOTED:
+        return shlex_this(params)
+    return params
+
+
+class CommandTable(object):
+    """
+    A table of the commands in a game.
+
+    Each command is registered with the function which handles it and the way
+    its parameters should be split up. A command can then be found by its name,
+    by any of its aliases, or by any abbreviation of its name which doesn't
+    also abbreviate another command, e.g. 'lo' for 'look'.
+    """
+
+    class Command(object):
+        """Holds information about a registered command"""
+
+        name = ""       # the full name of the command
+        handler = None  # the function called when a player uses the command
+        args = ARGS_RAW # how the command's parameters are split up
+        usage = ""      # how the command is used, e.g. 'go <exit>', or "" for just its name
+
+        def __init__(self, name, handler, args, usage=""):
+            self.name = name
+            self.handler = handler
+            self.args = args
+            self.usage = usage
+
+    _commands = {}  # maps each command's name and aliases to its Command object
+    _lookup = {}    # maps everything a player may type for a command to its Command object
+    metrics = None  # the Metrics each command's handling time is recorded in, or None
+    reply = None    # called with a player's id and a message to send them, or None
+
+    def __init__(self, metrics=None, reply=None):
+        """
+        Constructs an empty CommandTable. If 'metrics' is given, a Metrics from
+        metrics.py, the time each command takes to handle is recorded in it.
+        If 'reply' is given, it's called with a player's id and a message to
+        tell them how to use a command whose parameters couldn't be split up.
+        """
+        self._commands = {}
+        self._lookup = {}
+        self.metrics = metrics
+        self.reply = reply
+
+    def add(self, name, handler, args=ARGS_RAW, aliases=(), usage=""):
+        """
+        Registers 'handler' as the function which handles the command 'name',
+        also known as any of 'aliases'. The handler is called with the id of the
+        player who used the command and its parameters, split up as given by
+        'args'. 'usage' says how the command is used, e.g. 'go <exit>'.
+        """
+        command = CommandTable.Command(name, handler, args, usage)
+        self._commands[name] = command
+        for alias in aliases:
+            self._commands[alias] = command
+        self._build_lookup()
+
+    def command(self, name, args=ARGS_RAW, aliases=(), usage=""):
+        """
+        A decorator which registers the function it decorates as the handler for
+        the command 'name'. See 'add'.
+        """
+        def register(handler):
+            self.add(name, handler, args, aliases, usage)
+            return handler
+        return register
+
+    def find(self, word):
+        """
+        Returns the Command object for the command the player meant by 'word',
+        or None if there isn't one.
+        """
+        return self._lookup.get(word)
+
+    def dispatch(self, id, word, params):
+        """
+        Finds the command the player with the id 'id' meant by 'word' and calls
+        its handler with the given parameters. Returns False if there was no
+        such command. If the parameters can't be split up, e.g. because a quote
+        isn't closed, the handler isn't called, and the player is told how the
+        command is used instead.
+        """
+        command = self._lookup.get(word)
+        if command is None:
+            return False
+        try:
+            params = parse_args(command.args, params)
+        except ValueError:
+            if self.reply is not None:
+                self.reply(id, "Usage: %s" % (command.usage or command.name))
+            return True
+        if self.metrics is None:
+            command.handler(id, params)
+            return True
+        start = time.perf_counter()
+        try:
+            command.handler(id, params)
+        finally:
+            self.metrics.command(command.name, time.perf_counter() - start)
+        return True
+
+    def _build_lookup(self):
+
+        # work out which commands each possible abbreviation could stand for.
+        # This happens whenever a command is added, so that finding a command
+        # while the game is running only takes a single dictionary lookup
+        candidates = {}
+        for name, command in self._commands.items():
+            for end in range(1, len(name)):
+                candidates.setdefault(name[:end], set()).add(command)
+
+        # keep the abbreviations which could only mean one command
+        lookup = {}
+        for prefix, matches in candidates.items():
+            if len(matches) == 1:
+                lookup[prefix] = matches.pop()
+
+        # full names and aliases always win over abbreviations of something else
+        lookup.update(self._commands)
+        self._lookup = lookup
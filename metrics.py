@@ -0,0 +1,218 @@
+"""
+Measuring what a MUD server and its game spend their time on.
+
+Contains two classes. Metrics is given to MudServer (and the game's
+CommandTable) to keep count of how long each part of each update takes, how
+long each command takes to handle, and how many bytes go in and out. Histogram
+keeps a record of lots of timings in a small, fixed amount of space.
+
+Nothing is measured unless a Metrics is given, and even then measuring only
+costs a call to time.perf_counter and a few additions at a time.
+"""
+
+
+import os
+import json
+import time
+
+
+class Histogram(object):
+    """
+    Counts how many timings fall into each of a set of buckets, each twice as
+    wide as the last: under 1 microsecond, under 2, under 4, and so on. This
+    is enough to give the median or the 99th percentile to within a factor of
+    two, however many timings there are.
+    """
+
+    # there's a bucket for everything up to 2**30 microseconds, about 18
+    # minutes. Anything longer goes in the last one
+    _BUCKETS = 32
+
+    __slots__ = (
+        "count",      # how many timings there have been
+        "total",      # all of them added up, in seconds
+        "longest",    # the longest of them, in seconds
+        "buckets",    # how many timings fell into each bucket
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.buckets = [0] * self._BUCKETS
+
+    def add(self, seconds):
+        """
+        Records a timing of 'seconds' seconds.
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.longest:
+            self.longest = seconds
+        # the number of bits in the number of whole microseconds is the bucket
+        # it goes in, i.e. 0 for 0us, 1 for 1us, 2 for 2-3us, 3 for 4-7us...
+        self.buckets[min(int(seconds * 1e6).bit_length(), self._BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        """
+        Returns the time in seconds which 'p' percent of the timings were
+        shorter than, rounded up to the top of its bucket.
+        """
+        wanted = self.count * p / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted and count:
+                return min((1 << bucket) / 1e6, self.longest)
+        return self.longest
+
+    def summary(self):
+        """
+        Returns a dictionary of the number of timings, and their mean, median,
+        99th percentile and longest, in microseconds.
+        """
+        return {
+            "count": self.count,
+            "mean_us": round(self.total / self.count * 1e6, 1) if self.count else 0.0,
+            "p50_us": round(self.percentile(50) * 1e6, 1),
+            "p99_us": round(self.percentile(99) * 1e6, 1),
+            "max_us": round(self.longest * 1e6, 1),
+        }
+
+
+class Metrics(object):
+    """
+    Keeps count of what the server and game are doing.
+
+    Each update of the server is split into phases: running timers, sending
+    output, waiting for something to happen, accepting new connections,
+    reading from clients, and the game dispatching the events the update gave
+    it. The time spent in each phase during an update is added up, and at the
+    end of the update recorded in that phase's Histogram, along with the total
+    time spent busy, i.e. not waiting. Each command handled by a CommandTable
+    is timed and recorded in the command's own Histogram.
+    """
+
+    # the phases of an update, in the order they're reported
+    PHASES = ("timers", "send", "throttle", "wait", "accept", "read", "watched", "dispatch")
+
+    started = 0         # when the Metrics was created
+    ticks = 0           # how many updates have finished
+    bytes_in = 0        # how many bytes have been received from clients
+    bytes_out = 0       # how many bytes have been sent to clients
+    compressed_in = 0   # how many bytes of output have been compressed, before compressing
+    compressed_out = 0  # how many bytes they were compressed to
+    busy = None         # Histogram of the time each update spent not waiting
+    phases = {}         # maps phase name to a Histogram of its time in each update
+    commands = {}       # maps command name to a Histogram of how long it took to handle
+    _tick = {}          # maps phase name to the time spent in it so far this update
+    _mark = None        # when the last phase ended
+
+    def __init__(self):
+        """
+        Constructs a Metrics with nothing recorded yet.
+        """
+        self.started = time.monotonic()
+        self.ticks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed_in = 0
+        self.compressed_out = 0
+        self.busy = Histogram()
+        self.phases = {}
+        self.commands = {}
+        self._tick = {}
+        self._mark = None
+
+    def lap(self, phase):
+        """
+        Adds the time since the last call to the time spent in 'phase' during
+        this update.
+        """
+        now = time.perf_counter()
+        if self._mark is not None:
+            self._tick[phase] = self._tick.get(phase, 0.0) + (now - self._mark)
+        self._mark = now
+
+    def end_tick(self):
+        """
+        Records the time spent in each phase during the update that's just
+        finished, and starts the next.
+        """
+        busy = 0.0
+        for phase, seconds in self._tick.items():
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.add(seconds)
+            if phase != "wait":
+                busy += seconds
+        if self._tick:
+            self.busy.add(busy)
+            self.ticks += 1
+            self._tick = {}
+
+    def command(self, name, seconds):
+        """
+        Records that the command 'name' took 'seconds' seconds to handle.
+        """
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram()
+        histogram.add(seconds)
+
+    def snapshot(self, queues=None):
+        """
+        Returns everything recorded so far as a dictionary, which can be turned
+        into JSON. 'queues' is a dictionary of how much is waiting in each of
+        the server's queues, e.g. from MudServer.queue_depths.
+        """
+        phases = [phase for phase in self.PHASES if phase in self.phases]
+        phases += sorted(phase for phase in self.phases if phase not in self.PHASES)
+        return {
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "ticks": self.ticks,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "compressed_in": self.compressed_in,
+            "compressed_out": self.compressed_out,
+            "busy": self.busy.summary(),
+            "phases": dict((phase, self.phases[phase].summary()) for phase in phases),
+            "commands": dict((name, self.commands[name].summary()) for name in sorted(self.commands)),
+            "queues": queues or {},
+        }
+
+    def report(self, queues=None):
+        """
+        Returns a list of lines describing everything recorded so far, for a
+        person to read. See 'snapshot'.
+        """
+        stats = self.snapshot(queues)
+        lines = ["Up %.0fs, %d updates, %d bytes in, %d bytes out" % (
+            stats["uptime_s"], stats["ticks"], stats["bytes_in"], stats["bytes_out"])]
+        if stats["compressed_in"]:
+            lines.append("Compressed %d bytes of output to %d" % (
+                stats["compressed_in"], stats["compressed_out"]))
+        lines.append("Per update (us):          mean      p50      p99      max")
+        rows = [("busy", stats["busy"])] + list(stats["phases"].items())
+        for name, summary in rows:
+            lines.append("  %-18s %9.1f %8.0f %8.0f %8.0f" % (
+                name, summary["mean_us"], summary["p50_us"], summary["p99_us"], summary["max_us"]))
+        lines.append("Commands (us):   count    mean      p50      p99      max")
+        for name, summary in stats["commands"].items():
+            lines.append("  %-10s %9d %8.1f %8.0f %8.0f %8.0f" % (
+                name, summary["count"], summary["mean_us"], summary["p50_us"],
+                summary["p99_us"], summary["max_us"]))
+        if stats["queues"]:
+            lines.append("Queues: " + ", ".join("%s %d" % item for item in stats["queues"].items()))
+        return lines
+
+    def write(self, path, queues=None):
+        """
+        Writes everything recorded so far to the file 'path' as JSON. The file
+        is replaced in one go, so anything reading it never sees half of it.
+        """
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.snapshot(queues), f, indent=1)
+        os.replace(temp, path)
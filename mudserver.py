@@ -2,25 +2,30 @@
 Basic MUD server module for creating text-based Multi-User Dungeon (MUD) games.
 
 Contains one class, MudServer, which can be instantiated to start a server running
-then used to send and receive messages from players.
+then used to send and receive messages from players, and the three kinds of
+event it gives the game: NewPlayer, PlayerLeft and Command.
 
 author: Mark Frimston - mfrimston@gmail.com
 """
 
 
+import os
+import re
+import zlib
 import socket
-import select
+import selectors
 import time
-import sys
-import shlex
+import collections
 
+from timers import TimerWheel
 
-def shlex_this(command):
-    lex = shlex.shlex(command)
-    lex.quotes = '"'
-    lex.whitespace_split = True
-    lex.commenters = ''
-    return list(lex)
+
+# The things which can happen, as given by MudServer's 'drain_events'. Each is a
+# tuple, so a Command can also be unpacked into the player's id, the command
+# and its parameters, which is how 'get_commands' gives them
+NewPlayer = collections.namedtuple("NewPlayer", ["id"])
+PlayerLeft = collections.namedtuple("PlayerLeft", ["id"])
+Command = collections.namedtuple("Command", ["id", "command", "params"])
 
 
 class MudServer(object):
@@ -39,30 +44,231 @@ class MudServer(object):
     class Client(object):
         """Holds information about a connected player"""
 
-        socket = None   # the socket object used to communicate with this client
-        address = ""    # the ip address of this client
-        buffer = ""     # holds data send from the client until a full message is received
-        lastcheck = 0   # the last time we checked if the client was still connected
-
-        def __init__(self, socket, address, buffer, lastcheck):
+        # only these attributes can be set on a client. Listing them here means
+        # each client holds its values in a fixed set of slots rather than in a
+        # dictionary of its own, which takes a lot less memory when there are
+        # tens of thousands of clients
+        __slots__ = (
+            "socket",     # the socket object used to communicate with this client
+            "address",    # the ip address of this client
+            "buffer",     # holds data send from the client until a full message is received
+            "readstate",  # where we are in the Telnet protocol, carried over between reads
+            "lastactive", # the last time the client sent us anything
+            "idletimer",  # the timer which disconnects the client if they're idle too long
+            "outbuf",     # holds data waiting to be sent to the client
+            "writing",    # whether we're waiting for the socket to accept more data
+            "overlong",   # whether the line being received has been cut short
+            "tokens",     # how many commands the client may send right now
+            "lasttoken",  # the last time the client's allowance was topped up
+            "commands",   # commands received but held back by the rate limit, or None if there are none
+            "truncated",  # how many lines from this client have been cut short
+            "verb",       # the Telnet 'will', 'wont', 'do' or 'dont' whose option we're waiting for
+            "mccp",       # where we are in agreeing to compress the client's output
+            "compressor", # compresses the client's output once they've agreed, otherwise None
+            "plain",      # output waiting to be compressed, or None if there's no compressor
+        )
+
+        def __init__(self, socket, address, buffer, lastactive):
             self.socket = socket
             self.address = address
             self.buffer = buffer
-            self.lastcheck = lastcheck
-
-    # Used to store different types of occurrences
-    _EVENT_NEW_PLAYER = 1
-    _EVENT_PLAYER_LEFT = 2
-    _EVENT_COMMAND = 3
+            self.readstate = MudServer._READ_STATE_NORMAL
+            self.lastactive = lastactive
+            self.idletimer = None
+            self.outbuf = bytearray()
+            self.writing = False
+            self.overlong = False
+            self.tokens = 0.0
+            self.lasttoken = lastactive
+            self.commands = None
+            self.truncated = 0
+            self.verb = 0
+            self.mccp = MudServer._MCCP_OFF
+            self.compressor = None
+            self.plain = None
+
+        def read_lines(self, data, max_line_length):
+            """
+            Reads the bytes in 'data', just received from the client, and returns
+            a list of the complete lines in it, with any Telnet commands taken
+            out. Lines longer than 'max_line_length' are cut short.
+            """
+
+            # the Telnet protocol allows special command codes to be inserted into
+            # messages. For our very simple server we don't need to response to any
+            # of these codes, but we must at least detect and skip over them so that
+            # we don't interpret them as text data.
+            # More info on the Telnet protocol can be found here:
+            # http://pcmicro.com/netfoss/telnet.html
+
+            # rather than looking at every character, we jump straight to the next
+            # byte that means something and copy the plain text before it into the
+            # buffer in one go. A Telnet command can be split across two reads, so
+            # the state we're in is kept on the client between calls
+
+            lines = []
+            buffer = self.buffer
+            state = self.readstate
+            view = memoryview(data)
+            pos = 0
+            end = len(data)
+
+            while pos < end:
+
+                # handle the data differently depending on the state we're in:
+
+                # normal state
+                if state == MudServer._READ_STATE_NORMAL:
+
+                    # find the next byte which isn't plain text. If there isn't one,
+                    # the rest of the data is all text - add it to the buffer where
+                    # we're building up the received message
+                    match = MudServer._SPECIAL_BYTE.search(data, pos)
+                    if match is None:
+                        buffer += view[pos:]
+                        break
+                    found = match.start()
+                    buffer += view[pos:found]
+                    c = data[found]
+                    pos = found + 1
+
+                    # if we received the special 'interpret as command' code, switch
+                    # to 'command' state so that we handle the next byte as a
+                    # command code and not as regular text data
+                    if c == MudServer._TN_INTERPRET_AS_COMMAND:
+                        state = MudServer._READ_STATE_COMMAND
+
+                    # if we get a newline character, this is the end of the message.
+                    # Take the contents of the buffer as a line and clear the buffer
+                    elif c == 0x0a:
+                        self._truncate_line(buffer, max_line_length)
+                        if self.overlong:
+                            self.truncated += 1
+                            self.overlong = False
+                        lines.append(buffer.decode("latin1"))
+                        del buffer[:]
+
+                    # some telnet clients send the characters as soon as the user types
+                    # them. So if we get a backspace character, this is where the user has
+                    # deleted a character and we should delete the last character from
+                    # the buffer.
+                    else:
+                        del buffer[-1:]
+
+                # command state
+                elif state == MudServer._READ_STATE_COMMAND:
+
+                    c = data[pos]
+                    pos += 1
+
+                    # the special 'start of subnegotiation' command code indicates that
+                    # the following bytes are a list of options until we're told
+                    # otherwise. We switch into 'subnegotiation' state to handle this
+                    if c == MudServer._TN_SUBNEGOTIATION_START:
+                        state = MudServer._READ_STATE_SUBNEG
+
+                    # if the command code is one of the 'will', 'wont', 'do' or 'dont'
+                    # commands, the following byte will be an option code. We
+                    # remember which it was, in case the option is one we know
+                    elif c in (MudServer._TN_WILL, MudServer._TN_WONT, MudServer._TN_DO, MudServer._TN_DONT):
+                        self.verb = c
+                        state = MudServer._READ_STATE_OPTION
+
+                    # two 'interpret as command' codes in a row stand for a single
+                    # byte with that value in the text
+                    elif c == MudServer._TN_INTERPRET_AS_COMMAND:
+                        buffer.append(c)
+                        state = MudServer._READ_STATE_NORMAL
+
+                    # for all other command codes, there is no accompanying data so
+                    # we can return to 'normal' state.
+                    else:
+                        state = MudServer._READ_STATE_NORMAL
+
+                # option state - the only option we take any notice of is
+                # compression, and the rest are skipped over
+                elif state == MudServer._READ_STATE_OPTION:
+
+                    if data[pos] == MudServer._TN_COMPRESS2:
+                        self._answer_compression(self.verb)
+                    pos += 1
+                    state = MudServer._READ_STATE_NORMAL
+
+                # subnegotiation state
+                elif state == MudServer._READ_STATE_SUBNEG:
+
+                    # the options end with an 'interpret as command' code followed by
+                    # 'end of subnegotiation', so skip straight to the next one. If
+                    # there isn't one, the options carry on into the next read
+                    found = data.find(b"\xff", pos)
+                    if found < 0:
+                        break
+                    pos = found + 1
+                    state = MudServer._READ_STATE_SUBNEG_COMMAND
+
+                # command code during subnegotiation
+                elif state == MudServer._READ_STATE_SUBNEG_COMMAND:
+
+                    # if we reach an 'end of subnegotiation' command, this ends the
+                    # list of options and we can return to 'normal' state. Otherwise
+                    # it's part of the options and we must remain in this state
+                    if data[pos] == MudServer._TN_SUBNEGOTIATION_END:
+                        state = MudServer._READ_STATE_NORMAL
+                    else:
+                        state = MudServer._READ_STATE_SUBNEG
+                    pos += 1
+
+            # don't let a line that hasn't finished yet use up too much memory
+            self._truncate_line(buffer, max_line_length)
+
+            # remember where we got to for next time
+            self.readstate = state
+
+            # return the complete lines, which may be an empty list
+            return lines
+
+        def _answer_compression(self, verb):
+
+            # the client has answered our offer to compress their output. 'do'
+            # means yes, and compression starts once we've finished reading what
+            # they sent. 'dont' means no, and if we're already compressing, we
+            # stop. Anything else, or an answer to an offer we never made, is
+            # ignored
+            if verb == MudServer._TN_DO:
+                if self.mccp == MudServer._MCCP_OFFERED:
+                    self.mccp = MudServer._MCCP_AGREED
+            elif verb == MudServer._TN_DONT:
+                if self.mccp == MudServer._MCCP_ON:
+                    self.mccp = MudServer._MCCP_ENDING
+                elif self.mccp != MudServer._MCCP_ENDING:
+                    self.mccp = MudServer._MCCP_OFF
+
+        def _truncate_line(self, buffer, max_line_length):
+
+            # cut the line being received down to the maximum length, and remember
+            # that we did so the rest of it is thrown away too
+            if len(buffer) > max_line_length:
+                del buffer[max_line_length:]
+                self.overlong = True
+
+    # What to do with a client whose unsent output grows past the limit
+    OVERFLOW_DISCONNECT = 1  # disconnect them
+    OVERFLOW_DROP = 2        # throw away new messages until they catch up
+
+    # seconds to stop looking for new clients for when we can't accept them,
+    # e.g. because we've run out of file descriptors
+    _ACCEPT_PAUSE = 0.2
 
     # Different states we can be in while reading data from client
-    # See _process_sent_data function
+    # See Client.read_lines function
     _READ_STATE_NORMAL = 1
     _READ_STATE_COMMAND = 2
     _READ_STATE_SUBNEG = 3
+    _READ_STATE_OPTION = 4
+    _READ_STATE_SUBNEG_COMMAND = 5
 
     # Command codes used by Telnet protocol
-    # See _process_sent_data function
+    # See Client.read_lines function
     _TN_INTERPRET_AS_COMMAND = 255
     _TN_ARE_YOU_THERE = 246
     _TN_WILL = 251
@@ -72,21 +278,158 @@ class MudServer(object):
     _TN_SUBNEGOTIATION_START = 250
     _TN_SUBNEGOTIATION_END = 240
 
+    # The Telnet option for the MUD Client Compression Protocol, version 2, and
+    # what we send to offer it and to tell the client that everything after it
+    # is compressed. More info on MCCP can be found here:
+    # https://tintin.mudhalla.net/protocols/mccp/
+    _TN_COMPRESS2 = 86
+    _MCCP_WILL = bytes((_TN_INTERPRET_AS_COMMAND, _TN_WILL, _TN_COMPRESS2))
+    _MCCP_START = bytes((_TN_INTERPRET_AS_COMMAND, _TN_SUBNEGOTIATION_START, _TN_COMPRESS2,
+                         _TN_INTERPRET_AS_COMMAND, _TN_SUBNEGOTIATION_END))
+
+    # Where we are in agreeing to compress a client's output. The last two are
+    # the client's answers, which are acted on once we've read what they sent
+    _MCCP_OFF = 0      # not offered, or the client said no
+    _MCCP_OFFERED = 1  # offered, but the client hasn't answered
+    _MCCP_ON = 2       # the client's output is being compressed
+    _MCCP_AGREED = 3   # the client said yes
+    _MCCP_ENDING = 4   # the client asked us to stop compressing
+
+    # Each client's compressor remembers what it's sent recently, so that text
+    # which comes up again, e.g. a room description, takes only a few bytes.
+    # zlib's defaults remember 32KB and take over 250KB per client, so we use
+    # a smaller window of 4KB (2 ** 12), which takes about 40KB per client and
+    # is still plenty for the length of a MUD's messages
+    _COMPRESS_WINDOW_BITS = 12
+    _COMPRESS_MEMORY_LEVEL = 5
+
+    # matches the next byte in the normal state which isn't plain text: the
+    # 'interpret as command' code, a newline or a backspace
+    _SPECIAL_BYTE = re.compile(b"[\xff\n\x08]")
+
     _listen_socket = None  # socket used to listen for new clients
+    _selector = None       # watches all of our sockets for readiness
+    _accept_paused = False # whether the listening socket is left out of '_selector' for a moment
     _clients = {}          # holds info on clients. Maps client id to _Client object
     _nextid = 0            # counter for assigning each client a new id
-    _events = []           # list of occurrences waiting to be handled by the code
-    _new_events = []       # list of newly-added occurrences
-
-    def __init__(self):
+    _timers = None         # runs idle checks and the game's own timers
+    _idle_timeout = None   # seconds a client may go without sending anything
+    _keepalive = None      # (idle, interval, count) for checking connections are still there
+    _pending_output = None # ids of clients with output waiting to be sent
+    _output_limit = 0      # most unsent bytes we'll hold for a client
+    _overflow = 0          # what to do when a client goes over the output limit
+    _command_rate = None   # commands per second each client may send
+    _command_burst = 0     # commands a client may send at once before being held back
+    _command_queue = 0     # most commands held back for a client before we drop them
+    _max_line_length = 0   # longest line we accept from a client
+    _compression = None    # zlib compression level for clients who agree to it, or None not to offer it
+    _throttled = None      # ids of clients with commands held back
+    _events = None         # occurrences waiting to be handled by the game, in the order they happened
+    _joined = None         # ids of the players in '_events' who have joined
+    _left = None           # ids of the players in '_events' who have left
+    _commands = None       # the Commands in '_events'
+    _new_events = None     # newly-added occurrences, and the same again sorted by kind
+    _new_joined = None
+    _new_left = None
+    _new_commands = None
+
+    commands_throttled = 0 # number of commands which were held back by the rate limit
+    commands_dropped = 0   # number of commands thrown away because too many were held back
+    lines_truncated = 0    # number of lines which were cut short for being too long
+    metrics = None         # the Metrics recording how long each update takes, or None
+
+    def __init__(self, port=23, output_limit=65536, overflow=OVERFLOW_DISCONNECT,
+                 command_rate=10.0, command_burst=20, command_queue=50, max_line_length=4096,
+                 host="0.0.0.0", backlog=4096, reuse_port=False, idle_timeout=None,
+                 keepalive_idle=60, keepalive_interval=10, keepalive_count=6, metrics=None,
+                 resume=None, compression=6):
         """
-        Constructs the MudServer object and starts listening for new players.
+        Constructs the MudServer object and starts listening for new players on
+        the given port, on the network interface with the address 'host'. Up to
+        'backlog' players can be waiting to connect at once, e.g. when everyone
+        reconnects after the server restarts. If 'reuse_port' is True, other
+        servers can listen on the same port at the same time, and the operating
+        system shares new players out between them (Linux and BSD only).
+
+        Messages to players are held in a buffer and sent out together during the
+        next call to 'update'. If a player isn't reading fast enough to keep
+        their buffer below 'output_limit' bytes, then depending on 'overflow'
+        they are either disconnected (OVERFLOW_DISCONNECT) or miss out on
+        messages until they catch up (OVERFLOW_DROP).
+
+        Each player may send 'command_burst' commands in one go, and after that
+        'command_rate' commands per second. Any more are held back until they're
+        allowed, and once 'command_queue' are waiting, further ones are thrown
+        away. A 'command_rate' of None turns the limit off. Lines longer than
+        'max_line_length' are cut short.
+
+        Players who don't send anything for 'idle_timeout' seconds are
+        disconnected. The default of None lets them stay as long as they like.
+
+        Players whose connection has silently died, e.g. because their computer
+        was switched off, are found by the operating system's TCP keepalive: once
+        a connection has been quiet for 'keepalive_idle' seconds, it's checked
+        every 'keepalive_interval' seconds, and dropped after 'keepalive_count'
+        checks go unanswered. A 'keepalive_idle' of None turns the checks off.
+
+        New players are offered compressed output (MCCP version 2). For those
+        whose client agrees, everything sent to them is compressed with zlib at
+        level 'compression', from 1 (fastest) to 9 (smallest), which usually
+        takes less than a quarter of the bytes. Other players get plain text
+        as before. A 'compression' of None doesn't offer it.
+
+        If 'metrics' is given, a Metrics from metrics.py, the time spent in each
+        part of each update is recorded in it, along with the number of bytes
+        sent and received. The time between one update and the next is
+        recorded as the game dispatching the events it was given.
+
+        If 'resume' is given, it's what 'hand_over' returned in the copy of the
+        program which started this one. Rather than listening on the given
+        port, the server carries on with that copy's listen socket and clients,
+        which keep their ids, and the events it hadn't given the game yet are
+        given out by the first 'update'.
         """
 
         self._clients = {}
         self._nextid = 0
-        self._events = []
-        self._new_events = []
+        self._timers = TimerWheel()
+        self._idle_timeout = idle_timeout
+        self._keepalive = None
+        if keepalive_idle is not None:
+            self._keepalive = (keepalive_idle, keepalive_interval, keepalive_count)
+        self._pending_output = set()
+        self._output_limit = output_limit
+        self._overflow = overflow
+        self._command_rate = command_rate
+        self._command_burst = command_burst
+        self._command_queue = command_queue
+        self._max_line_length = max_line_length
+        self._compression = compression
+        self._throttled = set()
+        self.commands_throttled = 0
+        self.commands_dropped = 0
+        self.lines_truncated = 0
+        self.metrics = metrics
+        self._events = collections.deque()
+        self._joined = collections.deque()
+        self._left = collections.deque()
+        self._commands = collections.deque()
+        self._new_events = collections.deque()
+        self._new_joined = collections.deque()
+        self._new_left = collections.deque()
+        self._new_commands = collections.deque()
+
+        # the selector uses the best mechanism the OS has (epoll on Linux, kqueue
+        # on BSD and Mac) to tell us which sockets are ready. Each socket is
+        # registered with it once, and after that we only ever hear about the
+        # sockets that actually have something for us
+        self._selector = selectors.DefaultSelector()
+
+        # if we're taking over from an earlier copy of the program, carry on
+        # with its sockets instead of starting afresh
+        if resume is not None:
+            self._resume(resume)
+            return
 
         # create a new tcp socket which will be used to listen for new clients
         self._listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -95,298 +438,829 @@ class MudServer(object):
         # without having to wait
         self._listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+        # let several servers listen on the same port if we've been asked to
+        if reuse_port:
+            self._listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
         # bind the socket to an ip address and port. Port 23 is the standard telnet port
-        # which telnet clients will use. Address 0.0.0.0 means that we will bind to all
-        # of the available network interfaces
-        self._listen_socket.bind(("0.0.0.0", 23))
+        # which telnet clients will use, but only root can listen on ports below 1024.
+        # Address 0.0.0.0 means that we will bind to all of the available network
+        # interfaces
+        self._listen_socket.bind((host, port))
 
         # set to non-blocking mode. This means that when we call 'accept', it will
         # return immediately without waiting for a connection
         self._listen_socket.setblocking(False)
 
-        # start listening for connections on the socket
-        self._listen_socket.listen(1)
+        # start listening for connections on the socket. The operating system
+        # holds on to up to 'backlog' new connections until we accept them, and
+        # turns away any more
+        self._listen_socket.listen(backlog)
+
+        # register the listen socket with the selector. It becomes 'readable'
+        # whenever a client is waiting to be accepted. We attach None as the
+        # data so that we can tell it apart from client sockets, which carry
+        # their client id
+        self._selector.register(self._listen_socket, selectors.EVENT_READ, None)
 
-    def update(self):
+    def update(self, timeout=0):
         """
         Checks for new players, disconnected players, and new messages sent from players.
         This method must be called before up-to-date info can be obtained from the
-        'get_new_players', 'get_disconnected_players' and 'get_commands' methods.
-        It should be called in a loop to keep the game running.
+        'get_new_players', 'get_disconnected_players' and 'get_commands' methods,
+        or from 'drain_events'. It should be called in a loop to keep the game
+        running.
+
+        'timeout' is how many seconds to wait for something to happen if nothing
+        has happened yet. The default of 0 returns straight away. Passing None
+        waits for as long as possible - until a player does something, or until
+        a timer is due, such as the server's own check on whether clients are
+        still connected or one set by the game with 'call_later'.
         """
 
-        # check for new stuff
-        self._check_for_new_connections()
-        self._check_for_disconnected()
-        self._check_for_messages()
-
-        # move the new events into the main events list so that they can be obtained
-        # with 'get_new_players', 'get_disconnected_players' and 'get_commands'. The
-        # previous events are discarded
-        self._events = list(self._new_events)
-        self._new_events = []
+        # if we're measuring, everything since the last update was the game
+        # dealing with what it was given, and that was the end of that update
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.lap("dispatch")
+            metrics.end_tick()
+
+        # run any timers which are due. Only the ones which are actually due are
+        # looked at, so this doesn't take any longer with more clients connected
+        self._timers.run_due()
+        if metrics is not None:
+            metrics.lap("timers")
+
+        # send everything that's been queued up since the last update. This is
+        # done before waiting so that players see replies to their commands
+        # straight away
+        self._flush_output()
+        if metrics is not None:
+            metrics.lap("send")
+
+        # don't wait past the point where the next timer is due
+        due = self._timers.next_due()
+        if due is not None:
+            timeout = due if timeout is None else min(timeout, due)
+
+        # hand over commands that were held back by the rate limit and are now
+        # allowed through. If some are still held back, don't wait longer than it
+        # takes for the next one to be allowed
+        if self._throttled:
+            self._release_throttled()
+            if self._throttled:
+                due = 1.0 / self._command_rate
+                timeout = due if timeout is None else min(timeout, due)
+            if metrics is not None:
+                metrics.lap("throttle")
+
+        # if something has already happened, e.g. a held back command has been
+        # let through, there's no point waiting for anything else
+        if self._new_events:
+            timeout = 0
+
+        # check for new stuff, waiting if there's nothing there yet
+        self._check_for_ready_sockets(timeout)
+
+        # the new events become the ones given out by 'get_new_players',
+        # 'get_disconnected_players', 'get_commands' and 'drain_events', and the
+        # previous ones are discarded. Each event was sorted by its kind when it
+        # happened, so there's nothing to go through or copy here: the sets of
+        # events simply swap places
+        self._events, self._new_events = self._new_events, self._events
+        self._joined, self._new_joined = self._new_joined, self._joined
+        self._left, self._new_left = self._new_left, self._left
+        self._commands, self._new_commands = self._new_commands, self._commands
+        self._new_events.clear()
+        self._new_joined.clear()
+        self._new_left.clear()
+        self._new_commands.clear()
 
     def get_new_players(self):
         """
-        Returns a list containing info on any new players that have entered the game
-        since the last call to 'update'. Each item in the list is a player id number.
+        Returns the id numbers of any new players that have entered the game since
+        the last call to 'update', as a sequence which can be gone through with
+        'for'.
         """
-        retval = []
-        # go through all the events in the main list
-        for ev in self._events:
-            # if the event is a new player occurrence, add the info to the list
-            if ev[0] == self._EVENT_NEW_PLAYER:
-                retval.append(ev[1])
-        # return the info list
-        return retval
+        return self._joined
 
     def get_disconnected_players(self):
         """
-        Returns a list containing info on any players that have left the game since
-        the last call to 'update'. Each item in the list is a player id number.
+        Returns the id numbers of any players that have left the game since the
+        last call to 'update', as a sequence which can be gone through with 'for'.
         """
-        retval = []
-        # go through all the events in the main list
-        for ev in self._events:
-            # if the event is a player disconnect occurrence, add the info to the list
-            if ev[0] == self._EVENT_PLAYER_LEFT:
-                retval.append(ev[1])
-        # return the info list
-        return retval
+        return self._left
 
     def get_commands(self):
         """
-        Returns a list containing any commands sent from players since the last call
-        to 'update'. Each item in the list is a 3-tuple containing the id number of
-        the sending player, a string containing the command (i.e. the first word of
-        what they typed), and another string containing the text after the command
+        Returns any commands sent from players since the last call to 'update', as
+        a sequence which can be gone through with 'for'. Each item is a Command,
+        which is a 3-tuple containing the id number of the sending player, a string
+        containing the command (i.e. the first word of what they typed), and
+        another string containing the text after the command
+        """
+        return self._commands
+
+    def drain_events(self):
+        """
+        Gives each thing that has happened since the last call to 'update' in the
+        order it happened: a NewPlayer or PlayerLeft with the player's 'id', or
+        a Command with the player's 'id', the 'command' and its 'params'. Use
+        this instead of 'get_new_players', 'get_disconnected_players' and
+        'get_commands', not as well as them, e.g.
+
+            for event in mud.drain_events():
+                if type(event) is Command:
+                    ...
+
+        Each event is given out once, even if this is called again before the
+        next 'update'.
         """
-        retval = []
-        # go through all the events in the main list
-        for ev in self._events:
-            # if the event is a command occurrence, add the info to the list
-            if ev[0] == self._EVENT_COMMAND:
-                retval.append((ev[1], ev[2], shlex_this(ev[3])))
-        # return the info list
-        return retval
+        events = self._events
+        while events:
+            yield events.popleft()
 
     def send_message(self, to, message):
         """
         Sends the text in the 'message' parameter to the player with the id number
         given in the 'to' parameter. The text will be printed out in the player's
-        terminal.
+        terminal. The message is actually sent during the next call to 'update'.
+        'message' can also be bytes returned by 'encode_message'.
         """
+        self._attempt_send(to, self.encode_message(message))
+
+    def send_to_many(self, ids, message):
+        """
+        Sends the same message to each of the players whose id numbers are in
+        'ids', e.g. everyone in a room. The text is turned into bytes once,
+        however many players it goes to.
+        """
+        data = self.encode_message(message)
+        for to in ids:
+            self._attempt_send(to, data)
+
+    @staticmethod
+    def encode_message(message):
+        """
+        Returns the bytes that 'send_message' sends for the text 'message'. A
+        message which is sent over and over, such as a room description, can be
+        encoded once and the bytes given to 'send_message' or 'send_to_many' in
+        place of the text. Bytes are returned unchanged.
+        """
+        if isinstance(message, bytes):
+            return message
         # we make sure to put a newline on the end so the client receives the
-        # message on its own line
-        self._attempt_send(to, message+"\n\r")
+        # message on its own line, and convert the text into the bytes that will
+        # go over the wire. A byte with the value 255 would be taken by the
+        # client as the start of a Telnet command, so it's sent twice, which
+        # stands for a single 255 in the text. Otherwise a player could send
+        # commands to other players' clients by putting them in what they say
+        return (message + "\n\r").encode("latin1").replace(b"\xff", b"\xff\xff")
+
+    def queue_depths(self):
+        """
+        Returns a dictionary of how much is waiting in each of the server's
+        queues right now: the number of clients, the clients with output
+        waiting to be sent and how many bytes of it there are, the clients with
+        commands held back by the rate limit and how many commands, the events
+        waiting for the game, and the number of timers. This goes through every
+        client, so it's meant for the odd look rather than every update.
+        """
+        return {
+            "clients": len(self._clients),
+            "output_clients": sum(1 for cl in self._clients.values() if cl.outbuf),
+            "output_bytes": sum(len(cl.outbuf) + len(cl.plain or b"") for cl in self._clients.values()),
+            "throttled_clients": len(self._throttled),
+            "throttled_commands": sum(len(cl.commands) for cl in self._clients.values() if cl.commands),
+            "events": len(self._events),
+            "timers": len(self._timers),
+        }
+
+    def call_later(self, delay, callback, *args):
+        """
+        Has 'update' call the function 'callback' with the given parameters
+        once 'delay' seconds have passed, e.g. to respawn a monster. Returns a
+        Timer, whose 'cancel' method stops the call from happening.
+        """
+        return self._timers.call_later(delay, callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """
+        Has 'update' call the function 'callback' with the given parameters
+        every 'interval' seconds, e.g. to change the weather. Returns a Timer,
+        whose 'cancel' method stops the calls.
+        """
+        return self._timers.call_every(interval, callback, *args)
+
+    def watch(self, fileobj, callback):
+        """
+        Has 'update' call the function 'callback', with no parameters, whenever
+        'fileobj' has data to be read. This lets a game wait for its players and
+        for something else, such as another process, at the same time.
+        """
+        self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def unwatch(self, fileobj):
+        """
+        Stops watching a file object given to 'watch'.
+        """
+        self._selector.unregister(fileobj)
+
+    def hand_over(self):
+        """
+        Gets ready for a new copy of the program, started with one of the
+        'os.exec' functions, to take over without disconnecting anyone, e.g.
+        after the game's code has been changed. As much buffered output as
+        possible is sent, and the listen socket and the clients' sockets are
+        kept open across the 'exec'. Returns a dictionary describing them,
+        the clients' unsent input and output, and the events not yet given to
+        the game, which can be pickled and passed on to the new copy's
+        MudServer as 'resume'.
+
+        Nothing is closed here, so if the new copy can't be started, this
+        server can carry on as it was, although players' output is no longer
+        compressed.
+        """
+        # a compressor can't be carried over, so finish off each compressed
+        # stream. The new copy starts a new one for each of those clients
+        compressing = set()
+        for clid, cl in self._clients.items():
+            if cl.compressor is not None:
+                self._stop_compressing(cl)
+                cl.mccp = MudServer._MCCP_OFF
+                compressing.add(clid)
+                self._pending_output.add(clid)
+
+        # send what we can now, so there's less to carry over
+        self._flush_output()
+
+        # sockets are normally closed by 'exec'. Marking them as inheritable
+        # keeps them open in the new program, with the same file descriptor
+        # numbers. The selector isn't, so the new program starts its own
+        os.set_inheritable(self._listen_socket.fileno(), True)
+        clients = {}
+        for clid, cl in self._clients.items():
+            os.set_inheritable(cl.socket.fileno(), True)
+            clients[clid] = {
+                "fd": cl.socket.fileno(),
+                "address": cl.address,
+                "buffer": bytes(cl.buffer),
+                "readstate": cl.readstate,
+                "lastactive": cl.lastactive,
+                "outbuf": bytes(cl.outbuf),
+                "overlong": cl.overlong,
+                "tokens": cl.tokens,
+                "lasttoken": cl.lasttoken,
+                "commands": list(cl.commands) if cl.commands else None,
+                "truncated": cl.truncated,
+                "verb": cl.verb,
+                "mccp": MudServer._MCCP_ON if clid in compressing else cl.mccp,
+            }
+        return {
+            "listen": self._listen_socket.fileno(),
+            "nextid": self._nextid,
+            "clients": clients,
+            "events": list(self._events) + list(self._new_events),
+        }
+
+    def _resume(self, state):
+
+        # pick up the listen socket left open by the copy of the program we're
+        # taking over from
+        self._listen_socket = socket.socket(fileno=state["listen"])
+        self._listen_socket.set_inheritable(False)
+        self._listen_socket.setblocking(False)
+        self._selector.register(self._listen_socket, selectors.EVENT_READ, None)
+        self._nextid = state["nextid"]
+
+        # and each of its clients, just as they were. Their sockets already
+        # have the options set on them when they connected
+        for clid, saved in state["clients"].items():
+            cl = MudServer.Client(socket.socket(fileno=saved["fd"]), saved["address"],
+                                  bytearray(saved["buffer"]), saved["lastactive"])
+            cl.socket.set_inheritable(False)
+            cl.socket.setblocking(False)
+            cl.readstate = saved["readstate"]
+            cl.outbuf = bytearray(saved["outbuf"])
+            cl.overlong = saved["overlong"]
+            cl.tokens = saved["tokens"]
+            cl.lasttoken = saved["lasttoken"]
+            cl.truncated = saved["truncated"]
+            cl.verb = saved["verb"]
+            cl.mccp = saved["mccp"]
+            self._clients[clid] = cl
+            self._selector.register(cl.socket, selectors.EVENT_READ, clid)
+
+            # clients whose output was compressed are told a new compressed
+            # stream is starting, after anything left over from the old one,
+            # unless we've been told not to compress any more
+            if cl.mccp == MudServer._MCCP_ON:
+                if self._compression is not None:
+                    self._start_compressing(clid, cl)
+                else:
+                    cl.mccp = MudServer._MCCP_OFF
+
+            # output which couldn't be sent before is sent by the next update,
+            # and held back commands are let through as before
+            if cl.outbuf:
+                self._pending_output.add(clid)
+            if saved["commands"]:
+                cl.commands = collections.deque(saved["commands"])
+                self._throttled.add(clid)
+            if self._idle_timeout is not None:
+                cl.idletimer = self._timers.call_later(0, self._check_idle, clid)
+
+        # the events the game hadn't been given yet are given by the next update
+        for event in state["events"]:
+            self._new_events.append(event)
+            if type(event) is Command:
+                self._new_commands.append(event)
+            elif type(event) is NewPlayer:
+                self._new_joined.append(event.id)
+            else:
+                self._new_left.append(event.id)
 
     def shutdown(self):
         """
         Closes down the server, disconnecting all clients and closing the
         listen socket.
         """
+        # give any final messages a chance to get out
+        self._flush_output()
         # for each client
         for cl in self._clients.values():
-            # close the socket, disconnecting the client
-            cl.socket.shutdown()
+            # close the socket, disconnecting the client. The client may already
+            # have gone away, in which case 'shutdown' complains and we just
+            # close our end
+            try:
+                cl.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
             cl.socket.close()
+        self._clients = {}
         # stop listening for new clients
         self._listen_socket.close()
+        self._selector.close()
+
+    def _pause_accepting(self):
+
+        # stop watching for new clients, and start again in a moment
+        if not self._accept_paused:
+            self._accept_paused = True
+            self._selector.unregister(self._listen_socket)
+            self._timers.call_later(MudServer._ACCEPT_PAUSE, self._resume_accepting)
+
+    def _resume_accepting(self):
+
+        # watch for new clients again. Anyone left waiting is accepted in the
+        # next update
+        self._accept_paused = False
+        self._selector.register(self._listen_socket, selectors.EVENT_READ, None)
 
     def _attempt_send(self, clid, data):
-        # python 2/3 compatability fix - convert non-unicode string to unicode
-        if sys.version < '3' and type(data) != unicode:
-            data = unicode(data, "latin1")
+
+        # look up the client in the client map. If there's no client with the
+        # given id, there's nobody to send to
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
+
+        # if the client's output is compressed, messages wait in their own
+        # buffer until they're sent, so that they're all compressed together
+        waiting = len(cl.outbuf)
+        buffer = cl.plain
+        if buffer is None:
+            buffer = cl.outbuf
+        else:
+            waiting += len(buffer)
+
+        # if the client has fallen too far behind reading what we've sent, either
+        # disconnect them or throw the message away, rather than letting their
+        # buffer grow forever
+        if waiting + len(data) > self._output_limit:
+            if self._overflow == self.OVERFLOW_DISCONNECT:
+                self._handle_disconnect(clid)
+            return
+
+        # if the buffer was empty, note that the client has output to be sent
+        # on the next update. Otherwise it's already noted
+        if not waiting:
+            self._pending_output.add(clid)
+
+        # add the message to the end of the client's buffer. The same bytes may
+        # be going to lots of clients, but only a plain copy is made for each
+        # one, and all of a client's messages still go out in a single send
+        buffer += data
+
+    def _flush_output(self):
+
+        # try to send the buffered output of each client that has some, so that
+        # all the messages queued for a client go out in a single call
+        for clid in self._pending_output:
+            self._send_buffered(clid)
+        self._pending_output.clear()
+
+    def _send_buffered(self, clid):
+
+        # the client may have been disconnected since the output was queued
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
+
+        # compress everything waiting to go to the client in one go. Flushing
+        # the compressor gives us all of it, so the client can show it straight
+        # away, while it carries on remembering earlier messages so that
+        # repeated text still comes out small
+        if cl.plain:
+            self._compress(cl)
+
         try:
-            # look up the client in the client map and use 'sendall' to send
-            # the message string on the socket. 'sendall' ensures that all of
-            # the data is sent in one go
-            self._clients[clid].socket.sendall(bytearray(data, "latin1"))
-        # KeyError will be raised if there is no client with the given id in
-        # the map
-        except KeyError:
-            pass
+            # send as much of the buffer as the socket will take right now
+            sent = cl.socket.send(cl.outbuf)
+
+        # the socket can't take any more data at the moment
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+
         # If there is a connection problem with the client (e.g. they have
         # disconnected) a socket error will be raised
         except socket.error:
             self._handle_disconnect(clid)
+            return
+
+        # remove whatever was sent from the front of the buffer
+        del cl.outbuf[:sent]
+        if self.metrics is not None:
+            self.metrics.bytes_out += sent
+
+        # if some is left over, ask the selector to tell us when the socket can
+        # take more, and send the rest then
+        if cl.outbuf and not cl.writing:
+            self._selector.modify(cl.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, clid)
+            cl.writing = True
+
+        # once everything is sent, we don't need to hear about it any more
+        elif not cl.outbuf and cl.writing:
+            self._selector.modify(cl.socket, selectors.EVENT_READ, clid)
+            cl.writing = False
+
+    def _compress(self, cl, mode=zlib.Z_SYNC_FLUSH):
+
+        # add the client's waiting output to their buffer, compressed
+        before = len(cl.outbuf)
+        cl.outbuf += cl.compressor.compress(cl.plain)
+        cl.outbuf += cl.compressor.flush(mode)
+        if self.metrics is not None:
+            self.metrics.compressed_in += len(cl.plain)
+            self.metrics.compressed_out += len(cl.outbuf) - before
+        del cl.plain[:]
+
+    def _start_compressing(self, clid, cl):
+
+        # tell the client that everything after this is compressed, then give
+        # them a compressor of their own. Anything already waiting to go to
+        # them has been sent first, uncompressed
+        cl.mccp = MudServer._MCCP_ON
+        self._attempt_send(clid, MudServer._MCCP_START)
+        cl.compressor = zlib.compressobj(self._compression,
+                                         zlib.DEFLATED, MudServer._COMPRESS_WINDOW_BITS,
+                                         MudServer._COMPRESS_MEMORY_LEVEL)
+        cl.plain = bytearray()
+
+    def _stop_compressing(self, cl):
+
+        # finish off the compressed stream, which tells the client that
+        # everything after it is plain text again
+        self._compress(cl, zlib.Z_FINISH)
+        cl.compressor = None
+        cl.plain = None
+
+    def _check_for_ready_sockets(self, timeout=0):
+
+        # ask the selector which of our sockets are ready. It waits for up to
+        # 'timeout' seconds for one to become ready, or forever if the timeout is
+        # None. Only the sockets which have something waiting are returned, so
+        # idle clients cost us nothing here
+        ready = self._selector.select(timeout)
+
+        # if we're measuring, the same is done again but timing each part. It's
+        # kept separate so that not measuring costs nothing extra per socket
+        metrics = self.metrics
+        if metrics is not None:
+            self._handle_ready_measured(ready, metrics)
+            return
+
+        for key, mask in ready:
+
+            # the listen socket is registered without any data attached
+            if key.data is None:
+                self._check_for_new_connections()
+
+            # sockets given to 'watch' carry the function to call
+            elif callable(key.data):
+                key.data()
+
+            # any other socket belongs to a client, and the data is its id
+            else:
+                # the client's socket can take more of its buffered output
+                if mask & selectors.EVENT_WRITE:
+                    self._send_buffered(key.data)
+                # the client has sent us some data
+                if mask & selectors.EVENT_READ:
+                    self._check_for_messages(key.data)
+
+    def _handle_ready_measured(self, ready, metrics):
+
+        # the same as the end of '_check_for_ready_sockets', noting how long
+        # we waited and then how long each kind of socket took
+        metrics.lap("wait")
+        for key, mask in ready:
+            if key.data is None:
+                self._check_for_new_connections()
+                metrics.lap("accept")
+            elif callable(key.data):
+                key.data()
+                metrics.lap("watched")
+            else:
+                if mask & selectors.EVENT_WRITE:
+                    self._send_buffered(key.data)
+                    metrics.lap("send")
+                if mask & selectors.EVENT_READ:
+                    self._check_for_messages(key.data)
+                    metrics.lap("read")
 
     def _check_for_new_connections(self):
 
-        # 'select' is used to check whether there is data waiting to be read
-        # from the socket. We pass in 3 lists of sockets, the first being those
-        # to check for readability. It returns 3 lists, the first being
-        # the sockets that are readable. The last parameter is how long to wait -
-        # we pass in 0 so that it returns immediately without waiting
-        rlist, wlist, xlist = select.select([self._listen_socket], [], [], 0)
+        # accept every client that's waiting, not just the first, so that lots
+        # of clients connecting at once, e.g. after a restart, aren't kept
+        # waiting for an update each
+        while True:
+
+            try:
+                # 'accept' returns a new socket and address info which can be used to
+                # communicate with the new client
+                joined_socket, addr = self._listen_socket.accept()
+
+            # once there's nobody left waiting, we're done
+            except (BlockingIOError, InterruptedError):
+                return
+
+            # the client may have given up before we got to it, in which case we
+            # carry on with the next one
+            except ConnectionAbortedError:
+                continue
 
-        # if the socket wasn't in the readable list, there's no data available,
-        # meaning no clients waiting to connect, and so we can exit the method here
-        if self._listen_socket not in rlist:
+            # we may have run out of file descriptors, in which case the client
+            # is left waiting until someone else leaves. The listening socket
+            # stays ready while they wait, so we stop watching it for a moment,
+            # rather than being woken by it over and over in the meantime
+            except OSError:
+                self._pause_accepting()
+                return
+
+            # set non-blocking mode on the new socket. This means that 'send' and
+            # 'recv' will return immediately without waiting
+            joined_socket.setblocking(False)
+
+            # send each message as soon as it's ready rather than waiting to see
+            # if more follows. We already gather up each update's messages into
+            # a single send, so there's nothing to be gained by waiting
+            joined_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            # have the operating system check that the client is still there
+            if self._keepalive is not None:
+                MudServer._set_keepalive(joined_socket, *self._keepalive)
+
+            # construct a new _Client object to hold info about the newly connected
+            # client. Use 'nextid' as the new client's id number
+            cl = MudServer.Client(joined_socket, addr[0], bytearray(), time.monotonic())
+            self._clients[self._nextid] = cl
+
+            # new clients start with their full allowance of commands
+            cl.tokens = self._command_burst
+
+            # offer to compress what we send them. Clients which don't know how
+            # ignore it, or tell us they won't, and get plain text
+            if self._compression is not None:
+                cl.mccp = MudServer._MCCP_OFFERED
+                self._attempt_send(self._nextid, MudServer._MCCP_WILL)
+
+            # if clients mustn't stay idle for too long, check when they should be
+            if self._idle_timeout is not None:
+                cl.idletimer = self._timers.call_later(self._idle_timeout, self._check_idle, self._nextid)
+
+            # register the client's socket with the selector so that we're told when
+            # it has data for us. The client's id is attached so we know who it is
+            self._selector.register(joined_socket, selectors.EVENT_READ, self._nextid)
+
+            # add a new player occurrence to the new events with the player's id
+            # number
+            self._new_events.append(NewPlayer(self._nextid))
+            self._new_joined.append(self._nextid)
+
+            # add 1 to 'nextid' so that the next client to connect will get a unique
+            # id number
+            self._nextid += 1
+
+    @staticmethod
+    def _set_keepalive(sock, idle, interval, count):
+
+        # turn on TCP keepalive for the socket. Once the connection has been
+        # quiet for 'idle' seconds, the operating system sends the other end an
+        # empty packet every 'interval' seconds, which it must acknowledge. After
+        # 'count' of them go unacknowledged, the connection is dropped and the
+        # socket becomes readable with an error, which '_check_for_messages'
+        # treats as a disconnect. This costs us nothing while the client is
+        # there, unlike sending them something ourselves every few seconds.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        # the timings can only be set on some systems (TCP_KEEPIDLE is Linux
+        # and BSD, Mac calls it TCP_KEEPALIVE). Elsewhere the system's own
+        # defaults are used, which are usually two hours before the first check
+        idle_option = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+        if idle_option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, idle_option, int(idle))
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(interval))
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, int(count))
+
+    def _check_idle(self, clid):
+
+        # the client may have already gone
+        cl = self._clients.get(clid)
+        if cl is None:
             return
 
-        # 'accept' returns a new socket and address info which can be used to
-        # communicate with the new client
-        joined_socket, addr = self._listen_socket.accept()
+        # if they've sent something since the timer was set, check again when
+        # they'll next have been idle for long enough
+        idle = time.monotonic() - cl.lastactive
+        if idle < self._idle_timeout:
+            cl.idletimer = self._timers.call_later(self._idle_timeout - idle, self._check_idle, clid)
+            return
 
-        # set non-blocking mode on the new socket. This means that 'send' and
-        # 'recv' will return immediately without waiting
-        joined_socket.setblocking(False)
+        # otherwise tell them why, and disconnect them
+        self._attempt_send(clid, b"You have been disconnected for being idle.\n\r")
+        self._send_buffered(clid)
+        self._handle_disconnect(clid)
 
-        # construct a new _Client object to hold info about the newly connected
-        # client. Use 'nextid' as the new client's id number
-        self._clients[self._nextid] = MudServer.Client(joined_socket, addr[0], "", time.time())
+    def _check_for_messages(self, clid):
 
-        # add a new player occurrence to the new events list with the player's id
-        # number
-        self._new_events.append((self._EVENT_NEW_PLAYER, self._nextid))
+        # the client may have been disconnected earlier in this update, e.g. by
+        # a failed send
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
 
-        # add 1 to 'nextid' so that the next client to connect will get a unique
-        # id number
-        self._nextid += 1
+        try:
+            # read data from the socket, using a max length of 4096
+            data = cl.socket.recv(4096)
 
-    def _check_for_disconnected(self):
+        # the selector said the socket was readable but there was nothing there
+        # after all. Try again next time
+        except (BlockingIOError, InterruptedError):
+            return
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+        # if there is a problem reading from the socket (e.g. the client has
+        # disconnected) a socket error will be raised
+        except socket.error:
+            self._handle_disconnect(clid)
+            return
+
+        # an empty read means the client closed the connection. The socket would
+        # stay readable forever, so we must treat this as a disconnect
+        if not data:
+            self._handle_disconnect(clid)
+            return
+
+        # note when we last heard from the client, for the idle check
+        cl.lastactive = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.bytes_in += len(data)
+
+        # process the data, stripping out any special Telnet commands. We get
+        # back each complete line the client has sent
+        for message in self._process_sent_data(cl, data):
 
-            # if we last checked the client less than 5 seconds ago, skip this
-            # client and move on to the next one
-            if time.time() - cl.lastcheck < 5.0:
+            # skip completely empty lines
+            if not message:
                 continue
 
-            # send the client an invisible character. It doesn't actually matter what we send,
-            # we're really just checking that data can still be written to the socket. If it can't,
-            # an error will be raised and we'll know that the client has disconnected.
-            self._attempt_send(id, "\x00")
+            # remove any spaces, tabs etc from the start and end of the message
+            message = message.strip()
 
-            # update the last check time
-            cl.lastcheck = time.time()
+            # separate the message into the command (the first word) and
+            # its parameters (the rest of the message)
+            command, space, params = message.partition(" ")
 
-    def _check_for_messages(self):
+            # pass the command on, unless the client is sending too many
+            self._queue_command(clid, cl, command.lower(), params)
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+        # if the client has just answered our offer to compress their output,
+        # start or stop compressing it
+        if cl.mccp > MudServer._MCCP_ON:
+            if cl.mccp == MudServer._MCCP_AGREED:
+                self._start_compressing(clid, cl)
+            else:
+                cl.mccp = MudServer._MCCP_OFF
+                if cl.compressor is not None:
+                    self._stop_compressing(cl)
+                    self._pending_output.add(clid)
 
-            # we use 'select' to test whether there is data waiting to be read from
-            # the client socket. The function takes 3 lists of sockets, the first being
-            # those to test for readability. It returns 3 list of sockets, the first being
-            # those that are actually readable.
-            rlist, wlist, xlist = select.select([cl.socket], [], [], 0)
+    def _top_up_tokens(self, cl, now):
 
-            # if the client socket wasn't in the readable list, there is no new data from
-            # the client - we can skip it and move on to the next one
-            if cl.socket not in rlist:
-                continue
+        # clients earn the right to send 'command_rate' commands every second,
+        # but can't save up more than 'command_burst' of them
+        cl.tokens = min(self._command_burst, cl.tokens + (now - cl.lasttoken) * self._command_rate)
+        cl.lasttoken = now
 
-            try:
-                # read data from the socket, using a max length of 4096
-                data = cl.socket.recv(4096).decode("latin1")
+    def _queue_command(self, clid, cl, command, params):
 
-                # process the data, stripping out any special Telnet commands
-                message = self._process_sent_data(cl, data)
+        # with no rate limit, every command goes straight through
+        if self._command_rate is None:
+            self._add_command(clid, command, params)
+            return
 
-                # if there was a message in the data
-                if message:
+        self._top_up_tokens(cl, time.monotonic())
 
-                    # remove any spaces, tabs etc from the start and end of the message
-                    message = message.strip()
+        # if the client is allowed another command, and has none held back which
+        # should go first, pass it on
+        if not cl.commands and cl.tokens >= 1:
+            cl.tokens -= 1
+            self._add_command(clid, command, params)
 
-                    # separate the message into the command (the first word) and
-                    # its parameters (the rest of the message)
-                    command, params = (message.split(" ", 1)+["", ""])[:2]
+        # if too many commands are already held back, throw this one away
+        elif cl.commands is not None and len(cl.commands) >= self._command_queue:
+            self.commands_dropped += 1
 
-                    # add a command occurrence to the new events list with the
-                    # player's id number, the command and its parameters
-                    self._new_events.append((self._EVENT_COMMAND, id, command.lower(), params))
+        # otherwise hold it back until the client is allowed to send it. Most
+        # clients never go over the limit, so they aren't given somewhere to
+        # keep held back commands until they need it
+        else:
+            if cl.commands is None:
+                cl.commands = collections.deque()
+            cl.commands.append((command, params))
+            self._throttled.add(clid)
+            self.commands_throttled += 1
 
-            # if there is a problem reading from the socket (e.g. the client has
-            # disconnected) a socket error will be raised
-            except socket.error:
-                self._handle_disconnect(id)
+    def _add_command(self, clid, command, params):
 
-    def _handle_disconnect(self, clid):
+        # add a command occurrence to the new events with the player's id
+        # number, the command and its parameters
+        event = Command(clid, command, params)
+        self._new_events.append(event)
+        self._new_commands.append(event)
 
-        # remove the client from the clients map
-        del(self._clients[clid])
+    def _release_throttled(self):
 
-        # add a 'player left' occurrence to the new events list, with the player's
-        # id number
-        self._new_events.append((self._EVENT_PLAYER_LEFT, clid))
+        now = time.monotonic()
 
-    def _process_sent_data(self, client, data):
+        # go through the clients with commands held back
+        for clid in list(self._throttled):
 
-        # the Telnet protocol allows special command codes to be inserted into
-        # messages. For our very simple server we don't need to response to any
-        # of these codes, but we must at least detect and skip over them so that
-        # we don't interpret them as text data.
-        # More info on the Telnet protocol can be found here:
-        # http://pcmicro.com/netfoss/telnet.html
-
-        # start with no message and in the normal state
-        message = None
-        state = self._READ_STATE_NORMAL
-
-        # go through the data a character at a time
-        for c in data:
-
-            # handle the character differently depending on the state we're in:
-
-            # normal state
-            if state == self._READ_STATE_NORMAL:
-
-                # if we received the special 'interpret as command' code, switch
-                # to 'command' state so that we handle the next character as a
-                # command code and not as regular text data
-                if ord(c) == self._TN_INTERPRET_AS_COMMAND:
-                    state = self._READ_STATE_COMMAND
-
-                # if we get a newline character, this is the end of the message.
-                # Set 'message' to the contents of the buffer and clear the buffer
-                elif c == "\n":
-                    message = client.buffer
-                    client.buffer = ""
-
-                # some telnet clients send the characters as soon as the user types
-                # them. So if we get a backspace character, this is where the user has
-                # deleted a character and we should delete the last character from
-                # the buffer.
-                elif c == "\x08":
-                    client.buffer = client.buffer[:-1]
-
-                # otherwise it's just a regular character - add it to the buffer
-                # where we're building up the received message
-                else:
-                    client.buffer += c
+            # forget about clients who have disconnected
+            cl = self._clients.get(clid)
+            if cl is None:
+                self._throttled.discard(clid)
+                continue
 
-            # command state
-            elif state == self._READ_STATE_COMMAND:
+            # let through as many commands as the client is now allowed
+            self._top_up_tokens(cl, now)
+            while cl.commands and cl.tokens >= 1:
+                cl.tokens -= 1
+                command, params = cl.commands.popleft()
+                self._add_command(clid, command, params)
 
-                # the special 'start of subnegotiation' command code indicates that
-                # the following characters are a list of options until we're told
-                # otherwise. We switch into 'subnegotiation' state to handle this
-                if ord(c) == self._TN_SUBNEGOTIATION_START:
-                    state = self._READ_STATE_SUBNEG
+            # once they've all gone through, the client is no longer held back
+            if not cl.commands:
+                self._throttled.discard(clid)
+                cl.commands = None
 
-                # if the command code is one of the 'will', 'wont', 'do' or 'dont'
-                # commands, the following character will be an option code so we
-                # must remain in the 'command' state
-                elif ord(c) in (self._TN_WILL, self._TN_WONT, self._TN_DO, self._TN_DONT):
-                    state = self._READ_STATE_COMMAND
+    def _handle_disconnect(self, clid):
 
-                # for all other command codes, there is no accompanying data so
-                # we can return to 'normal' state.
-                else:
-                    state = self._READ_STATE_NORMAL
+        # remove the client from the clients map. If it's not there, we've
+        # already dealt with this disconnect
+        cl = self._clients.pop(clid, None)
+        if cl is None:
+            return
 
-            # subnegotiation state
-            elif state == self._READ_STATE_SUBNEG:
+        # stop watching the client's socket and close it, and stop its timers
+        self._selector.unregister(cl.socket)
+        cl.socket.close()
+        if cl.idletimer is not None:
+            cl.idletimer.cancel()
 
-                # if we reach an 'end of subnegotiation' command, this ends the
-                # list of options and we can return to 'normal' state. Otherwise
-                # we must remain in this state
-                if ord(c) == self._TN_SUBNEGOTIATION_END:
-                    state = self._READ_STATE_NORMAL
+        # add a 'player left' occurrence to the new events, with the player's id
+        # number
+        self._new_events.append(PlayerLeft(clid))
+        self._new_left.append(clid)
+
+    def _process_sent_data(self, client, data):
 
-        # return the contents of 'message' which is either a string or None
-        return message
+        # read the complete lines out of the data, keeping count of any which
+        # were too long. The work is done by the client, which remembers where
+        # it got to in the Telnet protocol between reads
+        truncated = client.truncated
+        lines = client.read_lines(data, self._max_line_length)
+        self.lines_truncated += client.truncated - truncated
+        return lines
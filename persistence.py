@@ -0,0 +1,321 @@
+"""
+Saving game data to disk without holding up the game.
+
+Contains one class, JournalStore, which keeps a dictionary of records in memory
+and writes the ones that change to disk from a background thread.
+"""
+
+
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStore(object):
+    """
+    A dictionary of records, e.g. player accounts, which is saved to a JSON file.
+
+    Rather than writing the whole file every time something changes, only the
+    records which have changed are written, by appending them to a journal file
+    next to the main one. This happens in a background thread, every
+    'flush_interval' seconds or as soon as 'flush_changes' records have changed,
+    whichever comes first. Once the journal grows past 'compact_size' bytes the
+    main file is rewritten with everything in it, and the journal is emptied.
+
+    When the store is opened, the main file is read and then the journal is
+    played back over the top of it, so opening is no slower than reading the
+    main file on its own. The main file is always replaced in one go by
+    writing a temporary file and renaming it, so a crash part way through
+    never leaves it half written.
+    """
+
+    path = ""               # the main JSON file
+    journal_path = ""       # the journal of changes since the main file was written
+    _records = {}           # the records, as used by the game
+    _dirty = {}             # records changed since the last write. Maps key to JSON text
+    _saved = None           # the JSON text of every record, as written to disk
+    _journal = None         # the journal file, open for appending, or None if it needs opening
+    _journal_size = 0       # how many bytes are in the journal
+    _flush_interval = 0     # most seconds between writes
+    _flush_changes = 0      # most changed records to hold before writing
+    _compact_size = 0       # journal size at which the main file is rewritten
+    _changes = 0            # how many times 'put' has been called
+    _flushed = 0            # how many of those changes have been written
+    _lock = None            # protects '_dirty', the counts and '_closing'
+    _wakeup = None          # wakes the writer thread when there's work to do
+    _written = None         # tells 'flush' when the writer thread has written
+    _closing = False        # whether the writer thread should stop
+    _error = None           # why the last write failed, or None if it worked
+    _failures = 0           # how many writes have failed
+    _thread = None          # the background writer thread
+
+    def __init__(self, path, flush_interval=5.0, flush_changes=100, compact_size=4 * 1024 * 1024):
+        """
+        Opens the store kept in the JSON file 'path', creating it if it doesn't
+        exist yet, and starts the background writer thread.
+        """
+        self.path = path
+        self.journal_path = path + ".journal"
+        self._flush_interval = flush_interval
+        self._flush_changes = flush_changes
+        self._compact_size = compact_size
+        self._records = {}
+        self._dirty = {}
+        self._saved = None
+        self._changes = 0
+        self._flushed = 0
+        self._closing = False
+        self._error = None
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._written = threading.Condition(self._lock)
+
+        self._load()
+
+        # carry on adding to the journal from where it left off. It's folded into
+        # the main file in the background once it gets big enough
+        self._journal = open(self.journal_path, "ab")
+        self._journal_size = self._journal.tell()
+
+        self._thread = threading.Thread(target=self._write_loop, name="JournalStore(%s)" % path)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __getitem__(self, key):
+        return self._records[key]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def items(self):
+        """
+        Goes through every record, giving its key and the record.
+        """
+        return self._records.items()
+
+    def get(self, key, default=None):
+        """
+        Returns the record with the given key, or 'default' if there isn't one.
+        """
+        return self._records.get(key, default)
+
+    def put(self, key, record):
+        """
+        Stores 'record' under the given key, and saves it to disk in the
+        background. The record is converted to JSON straight away, so later
+        changes to it aren't saved unless 'put' is called again.
+        """
+        self._records[key] = record
+        data = json.dumps(record, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            self._dirty[key] = data
+            self._changes += 1
+            # while writing isn't working, it's only tried again every
+            # 'flush_interval' seconds, rather than after every change
+            if len(self._dirty) >= self._flush_changes and self._error is None:
+                self._wakeup.notify()
+
+    def flush(self):
+        """
+        Waits until every change made so far has been written to disk. Raises
+        OSError if they couldn't be written.
+        """
+        with self._lock:
+            target = self._changes
+            failures = self._failures
+            while self._flushed < target:
+                if self._failures != failures or not self._thread.is_alive():
+                    raise OSError("couldn't save %s: %s" % (self.path, self._error))
+                self._wakeup.notify()
+                self._written.wait(1.0)
+
+    def close(self):
+        """
+        Writes any remaining changes, folds the journal into the main file and
+        stops the background writer thread. Raises OSError if any changes
+        couldn't be saved.
+        """
+        with self._lock:
+            self._closing = True
+            self._wakeup.notify()
+        self._thread.join()
+        if self._journal is not None:
+            self._journal.close()
+
+        # anything the writer thread couldn't add to the journal goes straight
+        # into the main file instead. If that can't be written either, the
+        # error is raised, so the changes aren't lost without anyone knowing
+        unsaved = self._dirty
+        if self._saved is None:
+            self._saved = self._snapshot()
+        self._saved.update(unsaved)
+        if self._journal_size or unsaved:
+            self._compact()
+        self._dirty = {}
+        self._flushed = self._changes
+
+    @staticmethod
+    def read(path):
+        """
+        Reads the records stored in the JSON file 'path' and its journal,
+        without opening the store or changing either file. Returns a dictionary.
+        """
+        return JournalStore._read(path)[0]
+
+    @staticmethod
+    def _read(path):
+
+        records = {}
+        valid = 0
+
+        # read the main file, if there is one
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                records = json.load(f)
+
+        # play back the journal over the top. Each line holds one changed record.
+        # If we crashed while writing, the last line may be incomplete, in which
+        # case it's ignored. We also work out how much of the journal is valid
+        if os.path.exists(path + ".journal"):
+            with open(path + ".journal", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    records[entry["k"]] = entry["v"]
+                    valid += len(line.encode("utf-8"))
+
+        return records, valid
+
+    def _load(self):
+
+        self._records, valid = self._read(self.path)
+
+        # cut off an incomplete line at the end of the journal, otherwise the
+        # next line to be added would be joined on to it
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > valid:
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(valid)
+
+    def _snapshot(self):
+
+        # the JSON text of every record as it is on disk, which the main file
+        # is rewritten from. It's read from the files again rather than made
+        # from '_records', since the game changes those while we'd be going
+        # through them. Any record changed since the store was opened is in
+        # '_dirty', and so is brought up to date when it's written
+        records = self._read(self.path)[0]
+        return dict((key, json.dumps(record, sort_keys=True, ensure_ascii=False))
+                    for key, record in records.items())
+
+    def _write_loop(self):
+
+        while True:
+
+            # wait until it's time to write, or we're woken up early because
+            # lots of records have changed or somebody's waiting for a flush
+            with self._lock:
+                if not self._closing:
+                    self._wakeup.wait(self._flush_interval)
+                closing = self._closing
+                dirty = self._dirty
+                changes = self._changes
+                self._dirty = {}
+
+            # the copy of the records used to rewrite the main file is made
+            # here rather than when opening the store, so that a big store
+            # doesn't hold up the game while it starts. If writing fails, e.g.
+            # because the disk is full, the changes are kept and written next
+            # time round
+            try:
+                if self._saved is None:
+                    self._saved = self._snapshot()
+                if dirty:
+                    self._append(dirty)
+                    dirty = {}
+                    if self._journal_size >= self._compact_size:
+                        self._journal.close()
+                        self._compact()
+                        self._journal_size = 0
+                error = None
+            except OSError as e:
+                error = e
+                logger.error("Couldn't save %s, trying again later: %s", self.path, e)
+
+            # let anybody waiting in 'flush' know whether the changes are on
+            # disk. Changes which couldn't be written are put back, unless
+            # they've been changed again since
+            with self._lock:
+                if error is None:
+                    self._flushed = changes
+                else:
+                    self._failures += 1
+                    for key, data in dirty.items():
+                        self._dirty.setdefault(key, data)
+                self._error = error
+                self._written.notify_all()
+
+            if closing:
+                return
+
+    def _append(self, dirty):
+
+        # add a line to the journal for each changed record, and make sure it's
+        # really on the disk before carrying on
+        lines = []
+        for key, data in dirty.items():
+            lines.append('{"k": %s, "v": %s}\n' % (json.dumps(key, ensure_ascii=False), data))
+            self._saved[key] = data
+        text = "".join(lines).encode("utf-8")
+
+        # if the last write failed part way through, or the journal was folded
+        # into the main file, it's opened again. Anything a failed write left
+        # behind is cut off, otherwise the next line would be joined on to half
+        # a line, and everything after it lost when the journal is read
+        if self._journal is None or self._journal.closed:
+            self._journal = open(self.journal_path, "ab")
+            if self._journal.tell() > self._journal_size:
+                self._journal.truncate(self._journal_size)
+
+        try:
+            self._journal.write(text)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except OSError:
+            try:
+                self._journal.close()
+            except OSError:
+                pass
+            raise
+        self._journal_size += len(text)
+
+    def _compact(self):
+
+        # write every record to a temporary file, one per line, then swap it
+        # in place of the main file in a single step. The journal should be
+        # closed first
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("{\n")
+            f.write(",\n".join("    %s: %s" % (json.dumps(key, ensure_ascii=False), data)
+                               for key, data in sorted(self._saved.items())))
+            f.write("\n}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        # everything in the journal is in the main file now, so empty it
+        open(self.journal_path, "w").close()
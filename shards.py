@@ -0,0 +1,436 @@
+"""
+Splitting a MUD game across several processes, so that it can use more than one
+CPU core.
+
+The front end process owns the MudServer, and so every player's connection, and
+looks after the things which involve the whole game: players logging in and
+out, and commands which change the world. Everything else is done by worker
+processes, each of which looks after some of the rooms (its zone) and the
+players in them. Commands are passed to the worker looking after the player who
+sent them, and the worker passes back the messages to send. When a player goes
+through an exit into a room looked after by another worker, they're handed over
+to it.
+
+Rooms are shared out by the 'zone' value in each room, so rooms which players
+often move between can be kept in the same worker by giving them the same zone.
+A room without a zone is a zone of its own.
+
+Contains one class, ZoneWorkers, which is used by simplemud.py when it's started
+with '--workers'. Workers are started with 'fork', so this only works on Linux
+and other Unix systems.
+"""
+
+
+import zlib
+import queue
+import signal
+import threading
+import multiprocessing
+
+from mudserver import MudServer
+
+
+# commands which are handled by the front end rather than by a worker, because
+# they affect or need to know about the whole game, or, like 'stats', are about
+# the front end's server. Talking on a channel is handled there too
+FRONT_END_COMMANDS = ("room", "stop", "stats", "where", "path", "track",
+                      "shout", "tell", "who", "join", "leave", "channels")
+
+
+def zone_worker(name, room, count):
+    """
+    Returns the number of the worker, out of 'count', which looks after the room
+    called 'name'.
+    """
+    zone = room.get("zone") or name
+    return zlib.crc32(zone.encode("utf-8")) % count
+
+
+class ZoneWorkers(object):
+    """
+    A set of worker processes which run a game between them.
+
+    The game is given as its module, e.g. simplemud, and must have the same
+    functions and variables simplemud has. Each worker runs the game's own code,
+    with its 'mud' and 'players' replaced by stand-ins which pass everything
+    back to the front end.
+    """
+
+    _game = None           # the game module
+    _processes = []        # the worker processes
+    _conns = []            # the connection to each worker
+    _outboxes = []         # messages waiting to be sent to each worker
+    _senders = []          # queues of batches of messages for each worker's sender thread
+    _threads = []          # the threads sending messages to each worker
+    _owner = {}            # maps room name to the number of the worker which looks after it
+    _location = {}         # maps player id to the number of the worker looking after them
+    _stopping = False      # whether the 'stop' command has been used
+
+    def __init__(self, game, count):
+        """
+        Starts 'count' worker processes for the game module 'game'. This must be
+        done before the game opens its stores or starts its server, so that the
+        workers don't inherit them.
+        """
+        self._game = game
+        self._processes = []
+        self._conns = []
+        self._outboxes = []
+        self._senders = []
+        self._threads = []
+        self._owner = {}
+        self._location = {}
+        self._stopping = False
+
+        context = multiprocessing.get_context("fork")
+        for number in range(count):
+            ours, theirs = context.Pipe()
+            # the worker is given our ends of the connections, its own included,
+            # so that it can close its copies of them
+            process = context.Process(target=_run_worker, args=(game, theirs, self._conns + [ours]),
+                                      name="zone worker %d" % number, daemon=True)
+            process.start()
+            theirs.close()
+            self._processes.append(process)
+            self._conns.append(ours)
+            self._outboxes.append([])
+
+    def run(self, mud):
+        """
+        Runs the game until the 'stop' command is used, with 'mud' as the server
+        players connect to. The game's 'rooms' and 'players' should have been
+        opened already.
+        """
+        game = self._game
+
+        # send each worker the rooms it looks after
+        zones = [{} for conn in self._conns]
+        for name, room in game.rooms.items():
+            number = zone_worker(name, room, len(self._conns))
+            self._owner[name] = number
+            zones[number][name] = room
+        for number, zone in enumerate(zones):
+            self._outboxes[number].append(("rooms", zone))
+
+        # from now on, rooms changed by the 'room' command are passed on to the
+        # worker looking after them, as well as being saved
+        game.rooms = _SharedRooms(self, game.rooms)
+
+        # messages are sent to the workers from threads of their own, so that
+        # the game never gets stuck waiting for a busy worker. Messages from
+        # the workers are picked up by the server's 'update'
+        for number, conn in enumerate(self._conns):
+            self._senders.append(queue.Queue())
+            thread = threading.Thread(target=self._send_loop, args=(number,),
+                                      name="zone sender %d" % number, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            mud.watch(conn, lambda number=number: self._receive(mud, number))
+
+        try:
+            while not self._stopping:
+
+                # see simplemud.main
+                mud.update(timeout=None)
+
+                for id in mud.get_new_players():
+                    game.new_player(id)
+
+                # the worker looking after a player who's left needs to forget
+                # about them too
+                for id in mud.get_disconnected_players():
+                    number = self._location.pop(id, None)
+                    if number is not None:
+                        self._outboxes[number].append(("leave", id))
+                    game.player_left(id)
+
+                for id, command, params in mud.get_commands():
+                    self._command(id, command, params)
+
+                # see simplemud.main
+                game.end_update()
+
+                self._send_all()
+
+        finally:
+            self._stop(mud)
+
+    def _command(self, id, command, params):
+
+        game = self._game
+
+        # logging in is done here, since it involves every player in the game.
+        # The player is then handed over to the worker looking after the room
+        # they start in, which keeps track of who's in each room from then on
+        if game.sessions.get(id) != game.PLAYING:
+            game.player_command(id, command, params)
+            if game.sessions.get(id) != game.PLAYING:
+                return
+            record = game.active_players[id]
+            game.leave_room(id)
+            number = self._worker_for(game.room_name(record.room))
+            self._location[id] = number
+            self._outboxes[number].append(("enter", id, record))
+            return
+
+        # commands which affect the whole game are also handled here
+        found = game.commands.find(command)
+        if found is None and game.channels.is_member(id, command):
+            game.player_command(id, command, params)
+            return
+        if found is not None and found.name in FRONT_END_COMMANDS:
+            game.player_command(id, command, params)
+            if found.name == "stop":
+                self._stopping = True
+            return
+
+        # anything else goes to the worker looking after the player
+        self._outboxes[self._location[id]].append(("command", id, command, params))
+
+    def _worker_for(self, room):
+
+        # rooms which aren't in the world at all are shared out by name, so
+        # that a player who somehow ends up in one still has a worker
+        number = self._owner.get(room)
+        if number is None:
+            number = zone_worker(room, {}, len(self._conns))
+        return number
+
+    def _room_changed(self, name, room):
+
+        # a new room goes to the worker its zone belongs to, and a changed one
+        # stays with the worker which already has it
+        number = self._owner.get(name)
+        if number is None:
+            number = self._owner[name] = zone_worker(name, room, len(self._conns))
+        self._outboxes[number].append(("rooms", {name: room}))
+
+    def _receive(self, mud, number):
+
+        # called by the server's 'update' when a worker has sent us something.
+        # Deal with everything that's arrived from it
+        conn = self._conns[number]
+        while conn.poll():
+            try:
+                batch = conn.recv()
+            except (EOFError, OSError):
+                mud.unwatch(conn)
+                raise RuntimeError("zone worker %d stopped unexpectedly" % number)
+            for message in batch:
+                self._handle(mud, message)
+
+    def _handle(self, mud, message):
+
+        kind = message[0]
+
+        # a message for a player
+        if kind == "send":
+            mud.send_message(message[1], message[2])
+
+        # a message for several players
+        elif kind == "sendmany":
+            mud.send_to_many(message[1], message[2])
+
+        # a player to be saved
+        elif kind == "save":
+            self._game.players.put(message[1], message[2])
+
+        # a player who's gone through an exit into another room looked after
+        # by the same worker. We keep track of where everyone is, for the
+        # commands handled here
+        elif kind == "moved":
+            if message[1] in self._game.active_players:
+                self._game.active_players[message[1]].room = self._game.room_id(message[2])
+
+        # a player who's gone through an exit into a room looked after by
+        # another worker. If they've disconnected on the way, there's nobody
+        # to hand over
+        elif kind == "handoff":
+            id, record, ex = message[1:]
+            if id in self._location:
+                number = self._worker_for(self._game.room_name(record.room))
+                self._location[id] = number
+                self._game.active_players[id].room = record.room
+                self._outboxes[number].append(("arrive", id, record, ex))
+
+        # a message for a player who'd already been handed over to another
+        # worker by the time it arrived. Pass it on to wherever they are now
+        elif kind == "bounce":
+            id = message[1][1]
+            if id in self._location:
+                self._outboxes[self._location[id]].append(message[1])
+
+    def _send_all(self):
+
+        # hand each worker's messages to its sender thread in one batch
+        for number, outbox in enumerate(self._outboxes):
+            if outbox:
+                self._senders[number].put(outbox)
+                self._outboxes[number] = []
+
+    def _send_loop(self, number):
+
+        # runs in a thread for each worker, sending it batches of messages
+        # until it's told to stop
+        while True:
+            batch = self._senders[number].get()
+            if batch is None:
+                return
+            self._conns[number].send(batch)
+
+    def _stop(self, mud):
+
+        # tell the workers to stop, and wait for them to send back anything
+        # they've still got, such as players to be saved
+        for outbox in self._outboxes:
+            outbox.append(("stop",))
+        self._send_all()
+        for sender in self._senders:
+            sender.put(None)
+        for thread in self._threads:
+            thread.join()
+        for conn in self._conns:
+            try:
+                while True:
+                    for message in conn.recv():
+                        self._handle(mud, message)
+            except (EOFError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+
+
+class _SharedRooms(object):
+    """Passes changed rooms on to the worker which looks after them"""
+
+    def __init__(self, workers, store):
+        self._workers = workers
+        self._store = store
+
+    def __contains__(self, name):
+        return name in self._store
+
+    def __getitem__(self, name):
+        return self._store[name]
+
+    def __getattr__(self, name):
+        # anything else, e.g. 'close', is the store's
+        return getattr(self._store, name)
+
+    def put(self, name, room):
+        self._store.put(name, room)
+        self._workers._room_changed(name, room)
+
+
+class _WorkerLink(object):
+    """
+    Stands in for the server and the player store in a worker process, passing
+    messages and players to be saved back to the front end
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._outbox = []
+
+    def send_message(self, to, message):
+        self._outbox.append(("send", to, message))
+
+    def send_to_many(self, ids, message):
+        # encoded here, so the front end doesn't have to do it
+        self._outbox.append(("sendmany", list(ids), MudServer.encode_message(message)))
+
+    encode_message = staticmethod(MudServer.encode_message)
+
+    def put(self, name, record):
+        self._outbox.append(("save", name, record))
+
+    def send(self, message):
+        self._outbox.append(message)
+
+    def flush(self):
+        if self._outbox:
+            self._conn.send(self._outbox)
+            self._outbox = []
+
+
+def _run_worker(game, conn, others):
+
+    # close our copies of the front end's connections, so that each worker
+    # only sees its connection close when the front end closes it
+    for other in others:
+        other.close()
+
+    # the front end deals with Ctrl-C, and tells us when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # run the game's own code, but with everything it sends or saves passed
+    # back to the front end
+    link = _WorkerLink(conn)
+    game.mud = link
+    game.players = link
+    game.rooms = {}
+
+    # a player going into a room looked after by another worker is handed back
+    # to the front end, which passes them on to that worker
+    arrive = game.arrive
+
+    def hand_off(id, room, ex):
+        if room in game.rooms:
+            arrive(id, room, ex)
+            link.send(("moved", id, room))
+            return
+        record = game.active_players.pop(id)
+        record.room = game.room_id(room)
+        link.send(("handoff", id, record, ex))
+
+    game.arrive = hand_off
+
+    while True:
+
+        # if the front end has gone away, there's nothing left to do
+        try:
+            batch = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        for message in batch:
+            kind = message[0]
+
+            if kind == "stop":
+                link.flush()
+                conn.close()
+                return
+
+            # rooms we look after, either to start with or after being changed
+            elif kind == "rooms":
+                game.rooms.update(message[1])
+                game.update_world(message[1])
+
+            # a player who's just logged in
+            elif kind == "enter":
+                game.active_players[message[1]] = message[2]
+                game.enter_room(message[1], game.room_name(message[2].room))
+
+            # a player handed over from another worker
+            elif kind == "arrive":
+                game.active_players[message[1]] = message[2]
+                arrive(message[1], game.room_name(message[2].room), message[3])
+
+            # the player has already been handed over to another worker, so
+            # send the message back to be passed on
+            elif message[1] not in game.active_players:
+                link.send(("bounce", message))
+
+            # the front end only passes on commands from players in the game,
+            # so they're handled straight away
+            elif kind == "command":
+                game.game_command(message[1], message[2], message[3])
+
+            elif kind == "leave":
+                game.leave_room(message[1])
+                del game.active_players[message[1]]
+
+        # once everything that's arrived has been dealt with, send the results
+        # back in one go
+        if not conn.poll():
+            link.flush()
@@ -18,225 +18,1037 @@ Some ideas for things to try adding:
 author: Mark Frimston - mfrimston@gmail.com
 """
 
-import time
-import json
+import os
+import sys
+import pickle
+import signal
+import socket
+import argparse
+import tempfile
+import collections
 
-# import the MUD server class
-from mudserver import MudServer
+# import the MUD server class, and the kinds of event it gives us. The server
+# which runs on asyncio instead is imported by 'main', only if it's asked for,
+# since it needs a newer Python than the rest of the game
+from mudserver import MudServer, NewPlayer, Command
+
+# import the command table, and the ways a command's parameters can be split up
+from commands import CommandTable, ARGS_RAW, ARGS_SPLIT, ARGS_QUOTED
+
+# import the metrics class, which keeps count of what the server and game spend
+# their time on
+from metrics import Metrics
+
+# import the world graph class, which keeps track of where each room's exits
+# lead, so that routes from one room to another can be found
+from worldgraph import WorldGraph
+
+# import the channels class, which keeps track of who's in each channel
+from channels import Channels
+
+# import the stores used to save players, and optionally the world
+from persistence import JournalStore
+from sqlitestore import SqliteStore
+
+# import the class used to split the game across several processes
+from shards import ZoneWorkers
 
 # structure defining the rooms in the game. Try adding more rooms to the game!
-with open('world.json') as json_data:
-    rooms = json.load(json_data)
-# structure where players are saved
-with open('players.json') as json_data:
-    players = json.load(json_data)
+# It's loaded from 'world.json' when the game starts, or if the game is using an
+# SQLite database, each room is loaded from it when it's needed. Rooms changed
+# while the game is running are saved with 'save_rooms'
+rooms = {}
+
+# structure where players are saved. It's opened by 'main', and saves each
+# player to 'players.json' in the background whenever 'save_player' is called
+players = None
 
+# the players currently in the game, i.e. who've given their name. Maps player
+# id to their Player
 active_players = {}
 
-# start the server
-mud = MudServer()
+# the id of each player in the game. Maps their name in lower case to their id,
+# so that a player can be found by name without going through everyone
+player_ids = {}
+
+# the channels players can talk on, wherever they are. Everyone is put in the
+# channel for shouts when they enter the game, and can join any others they
+# like with 'join'
+channels = Channels()
+SHOUT_CHANNEL = "shout"
+
+# at most this many names are listed by 'who'. Any more are just counted
+WHO_NAMES = 100
+
+# where each connection is in its session. Maps player id to one of the states
+# below. A connection starts off connecting, is asked for its name, plays the
+# game once it's given one, and is leaving once it's disconnected
+sessions = {}
+CONNECTING = "connecting"  # just connected, and not yet asked for their name
+NAMING = "naming"          # asked for their name, and waiting for it
+PLAYING = "playing"        # in the game, with a Player in 'active_players'
+LEAVING = "leaving"        # disconnected, and forgotten once everyone's been told
+
+# the connections waiting to be asked for their name, the names of the players
+# who've entered the game, the names of those who've left it, and the
+# connections which have gone, since the end of the last update. At the end of
+# each update they're all dealt with at once by 'end_update', so that lots of
+# players logging in at once, e.g. after a restart, costs everyone else one
+# message per update rather than one for each of them
+connecting = []
+entered = []
+departed = []
+leaving = []
+
+# at most this many names are given when telling everyone who's entered or
+# left the game in an update. Any more are just counted
+ANNOUNCE_NAMES = 5
+
+# where the exits from each room lead. Each room the game comes across is given
+# a number by it, which is what players and 'room_occupants' use to say which
+# room they mean. A number takes up less space than the room's name, and two of
+# them can be compared in one go, where two names have to be compared a
+# character at a time. It's told about all the rooms by 'main', and about
+# changed rooms by 'update_world'
+world = WorldGraph()
+
+# the players in each room. Maps room number to the set of ids of the players
+# in it, so that we can find everyone in a room without going through every
+# player in the game. Rooms with nobody in them aren't included
+room_occupants = {}
+
+# the server, which is started by 'main'
+mud = None
+
+# messages which are sent over and over, such as room descriptions, kept ready
+# to send so that they're only put together and turned into bytes once. Maps
+# a key, e.g. ("description", room name), to the bytes, with the most recently
+# used last. Once there are more than MESSAGE_CACHE_SIZE, the least recently
+# used are thrown away. Rooms changed by the 'room' command are forgotten, so
+# that they're put together again
+message_cache = collections.OrderedDict()
+MESSAGE_CACHE_SIZE = 1024
+
+# the commands players can use. Each one is added to the table further down,
+# along with the function that handles it. A player whose command can't be
+# split up, e.g. because they didn't close a quote, is sent its usage
+commands = CommandTable(reply=lambda id, message: mud.send_message(id, message))
+
+# what the server and game spend their time on, or None if it isn't being
+# measured. It's created by 'main' when '--admin' or '--metrics' is given
+metrics = None
+
+# the names of the players who can use admin commands, e.g. 'stats'
+admins = set()
+
+# whether the game can be restarted without disconnecting anyone, which it can
+# when it's running on MudServer in a single process. Set by 'main'
+restartable = False
+
+# set by the 'stop' command to end the main game loop
+stopping = False
+
+
+class Player(object):
+    """Holds information about a player in the game"""
+
+    # only these attributes can be set on a player, so that each one holds its
+    # values in a fixed set of slots rather than in a dictionary of its own.
+    # Try adding more player stats - level, gold, etc
+    __slots__ = (
+        "name",       # the player's name
+        "room",       # the number of the room they're in (see 'room_id'), or None
+        "inventory",  # the list of things they're carrying
+    )
+
+    def __init__(self, name, room, inventory):
+        self.name = name
+        self.room = room
+        self.inventory = inventory
+
+    # when the game is split across processes (see shards.py), players are
+    # sent from one to another. Each process numbers rooms in its own order,
+    # so the room is sent by name and numbered again on the other side
+    def __getstate__(self):
+        return self.name, room_name(self.room), self.inventory
+
+    def __setstate__(self, state):
+        self.name, room, self.inventory = state
+        self.room = room_id(room)
+
+
+def room_id(name):
+
+    # give the room a number the first time we come across it, and after that
+    # use the same number. None stands for no room at all
+    return world.room_id(name)
+
+
+def room_name(number):
+
+    # the name of the room with the given number
+    return world.room_name(number)
+
+
+def save_player(id):
+
+    # store a copy of the player's details. It's written to disk in the
+    # background, so this doesn't hold up the game
+    pl = active_players[id]
+    players.put(pl.name, {"room": room_name(pl.room), "inventory": list(pl.inventory)})
+
+
+def save_rooms(changed):
+
+    # store the changed rooms, given as a dictionary of room name to room. Only
+    # these rooms are written, however big the world is
+    for name, room in changed.items():
+        rooms.put(name, room)
+    update_world(changed)
+
+
+def update_world(changed):
+
+    # note where the exits from the changed rooms, given as a dictionary of
+    # room name to room, now lead, and put together anything we send about
+    # them again
+    world.update(dict((name, room["exits"]) for name, room in changed.items()))
+    forget_rooms(changed)
+
+
+def cached_message(key, make):
+
+    # return the ready-to-send message with the given key, calling 'make' to
+    # put it together if it isn't in the cache
+    data = message_cache.get(key)
+    if data is not None:
+        message_cache.move_to_end(key)
+        return data
+    data = message_cache[key] = mud.encode_message(make())
+    if len(message_cache) > MESSAGE_CACHE_SIZE:
+        message_cache.popitem(last=False)
+    return data
+
+
+def room_description(name):
+
+    # the description of the room with the given name, ready to send
+    return cached_message(("description", name), lambda: rooms[name]["description"])
+
+
+def forget_rooms(names):
+
+    # throw away the cached messages for rooms which have changed
+    for name in names:
+        message_cache.pop(("description", name), None)
+        message_cache.pop(("exits", name), None)
+
+
+def enter_room(id, room):
+
+    # put the player in the room with the given name, and add them to the
+    # room's occupants
+    number = room_id(room)
+    active_players[id].room = number
+    room_occupants.setdefault(number, set()).add(id)
+
+
+def leave_room(id):
+
+    # take the player out of their room's occupants, forgetting about the room
+    # altogether if it's now empty
+    room = active_players[id].room
+    occupants = room_occupants.get(room)
+    if occupants is not None:
+        occupants.discard(id)
+        if not occupants:
+            del room_occupants[room]
+
+
+def send_to_channel(name, message):
+
+    # send the message to everyone in the channel with the given name, however
+    # many of them there are. It's turned into bytes once for all of them, and
+    # only the players in the channel are gone through
+    mud.send_to_many(channels.members(name), message)
+
+
+def send_to_room(room, message, exclude=None):
+
+    # send the message to the players in the room with the given number, except
+    # the one to be left out. It's turned into bytes once for all of them
+    mud.send_to_many((pid for pid in room_occupants.get(room, ()) if pid != exclude), message)
+
+
+def new_player(id):
+
+    # note the new connection. They're asked for their name at the end of the
+    # update, along with anyone else who's connected during it
+    sessions[id] = CONNECTING
+    connecting.append(id)
+
+
+def player_left(id):
+
+    # if for any reason the player isn't in a session, skip them
+    state = sessions.get(id)
+    if state is None or state == LEAVING:
+        return
+    sessions[id] = LEAVING
+    leaving.append(id)
+
+    # if they were in the game, take them out of the room they were in, and
+    # note that everyone needs to be told they've gone
+    if state == PLAYING:
+        leave_room(id)
+        leave_game(id)
+        departed.append(active_players.pop(id).name)
+
+
+def player_command(id, command, params):
+
+    # pass the command to the function which deals with commands from
+    # players in the state the player's in, skipping them if for any reason
+    # they aren't in a session
+    state = sessions.get(id)
+    if state is not None:
+        SESSION_HANDLERS[state](id, command, params)
+
+
+def name_given(id, command, params):
+
+    # the player hasn't given their name yet, so this first command is their
+    # name. Nobody else in the game may have the same name
+    name = command
+    if name.lower() in player_ids:
+        sessions[id] = NAMING
+        mud.send_message(id, "Someone called %s is already in the game. What is your name?" % name)
+        return
+
+    # their details are loaded once, here, and kept in their Player until
+    # they leave
+    record = players.get(name)
+
+    # start them off in the 'Tavern' room, unless they've played before
+    if record is None:
+        room = "Tavern"
+        active_players[id] = Player(name, None, [])
+    else:
+        room = record["room"]
+        active_players[id] = Player(name, None, list(record["inventory"]))
+    sessions[id] = PLAYING
+    join_game(id)
+
+    # put the player in their starting room, and save them if they're new
+    enter_room(id, room)
+    if record is None:
+        save_player(id)
+
+    # everyone is told about the new player at the end of the update
+    entered.append(name)
+
+    # send the new player a welcome message
+    mud.send_message(id, "Welcome to the game, %s. Type 'help' for a list of commands."
+                         " Have fun!" % name)
+
+    # send the new player the description of their current room
+    mud.send_message(id, room_description(room))
+
+
+def join_game(id):
+
+    # note who the player who's just entered the game is, and put them in the
+    # channel for shouts
+    player_ids[active_players[id].name.lower()] = id
+    channels.join(id, SHOUT_CHANNEL)
+    message_cache.pop("who", None)
+
+
+def leave_game(id):
+
+    # forget about the player, who's leaving the game, and take them out of
+    # all their channels
+    name = active_players[id].name.lower()
+    if player_ids.get(name) == id:
+        del player_ids[name]
+    channels.leave_all(id)
+    message_cache.pop("who", None)
+
+
+def game_command(id, command, params):
+
+    # find the function that handles the command and call it
+    if commands.dispatch(id, command, params):
+        return
+
+    # if it's the name of a channel the player's in, they're talking on it
+    if channels.is_member(id, command):
+        send_to_channel(command, "[%s] %s: %s" % (command, active_players[id].name, params))
+
+    # otherwise send back an 'unknown command' message
+    else:
+        mud.send_message(id, "Unknown command '%s'" % command)
+
+
+def ignore_command(id, command, params):
+
+    # the player's already left, so there's nobody to reply to
+    pass
+
+
+# the function which deals with commands from players in each state. Someone
+# who types before they've been asked for their name is taken to be giving it
+SESSION_HANDLERS = {
+    CONNECTING: name_given,
+    NAMING: name_given,
+    PLAYING: game_command,
+    LEAVING: ignore_command,
+}
+
+
+def end_update():
+
+    # ask everyone who's connected during the update for their name, unless
+    # they've already given it. The prompt is turned into bytes once for all
+    # of them
+    if connecting:
+        waiting = [id for id in connecting if sessions.get(id) == CONNECTING]
+        for id in waiting:
+            sessions[id] = NAMING
+        mud.send_to_many(waiting, "What is your name?")
+        del connecting[:]
+
+    # tell everyone in the game who's entered and left it, in one message each
+    if entered:
+        announce(entered, "entered the game")
+    if departed:
+        announce(departed, "quit the game")
+
+    # forget about the connections which have gone, now that everyone's been
+    # told
+    for id in leaving:
+        del sessions[id]
+    del leaving[:]
+
+
+def announce(names, happened):
 
-# main game loop. We loop forever (i.e. until the program is terminated)
-while True:
+    # tell everyone in the game that the players with the given names have
+    # done something, e.g. entered the game. If only a few have, each gets a
+    # line of their own. Otherwise a few of them are named and the rest counted
+    if len(names) <= ANNOUNCE_NAMES:
+        message = "\n\r".join("%s %s" % (name, happened) for name in names)
+    else:
+        message = "%s and %d others %s" % (", ".join(names[:ANNOUNCE_NAMES]),
+                                           len(names) - ANNOUNCE_NAMES, happened)
+    mud.send_to_many(active_players, message)
+    del names[:]
 
-    # pause for 1/5 of a second on each loop, so that we don't constantly
-    # use 100% CPU time
-    time.sleep(0.2)
 
-    # 'update' must be called in the loop to keep the game running and give
-    # us up-to-date information
-    mud.update()
+# each of the possible commands is handled below. Try adding new commands to
+# the game! Each handler is given the id of the player who used the command and
+# its parameters, split up as the command asks for
 
-    # go through any newly connected players
-    for id in mud.get_new_players():
 
-        # add the new player to the dictionary, noting that they've not been
-        # named yet.
-        # The dictionary key is the player's id number. Start them off in the
-        # 'Tavern' room.
-        # Try adding more player stats - level, gold, inventory, etc
-        active_players[id] = {
-            "name": "temp",
-            "room": "temp",
-            "inventory": []
-        }
+# 'help' command
+@commands.command("help", aliases=["?"])
+def help_command(id, params):
 
-        # send the new player a prompt for their name
-        mud.send_message(id, "What is your name?")
+    # send the player back the list of possible commands. It's the same every
+    # time, so it's put together once and kept
+    mud.send_message(id, cached_message("help", lambda: "\n\r".join([
+        "Commands:",
+        "  say <message>  - Says something out loud, e.g. 'say Hello'",
+        "  look           - Examines the surroundings, e.g. 'look'",
+        "  go <exit>      - Moves through the exit specified, e.g. 'go outside'",
+        "  where [player] - Says where you are, or where a player is, e.g. 'where bob'",
+        "  path <room>    - Says the way to a room, e.g. 'path kitchen'",
+        "  track <player> - Says which way to go to get to a player, e.g. 'track bob'",
+        "  shout <message> - Says something to everyone in the game, e.g. 'shout Hello'",
+        "  tell <player> <message> - Says something to one player, e.g. 'tell bob Hi'",
+        "  who            - Lists the players in the game, e.g. 'who'",
+        "  join <channel> - Joins a channel, e.g. 'join trade'. Then '<channel> <message>' "
+        "talks on it, e.g. 'trade Selling a sword'",
+        "  leave <channel> - Leaves a channel, e.g. 'leave trade'",
+        "  channels       - Lists the channels you're in, e.g. 'channels'",
+        "  room <name> <'Description.'> <exit>  - Creates a room with the given "
+        "description and an exit to and from the given location.",
+    ])))
 
-    # go through any recently disconnected players
-    for id in mud.get_disconnected_players():
 
-        # if for any reason the player isn't in the player map, skip them and
-        # move on to the next one
-        if id not in active_players:
-            continue
+# 'say' command. The message is passed on exactly as it was typed
+@commands.command("say", args=ARGS_RAW)
+def say_command(id, params):
 
-        # go through all the players in the game
-        for pid in active_players:
-            # send each player a message to tell them about the disconnected player
-            mud.send_message(pid, "%s quit the game" % active_players[id]["name"])
+    # send everyone in the same room as the player a message telling them what
+    # the player said
+    send_to_room(active_players[id].room,
+                 "%s says: %s" % (active_players[id].name, params))
 
-        # remove the player's entry in the player dictionary
-        del(active_players[id])
 
-    # go through any new commands sent from players
-    for id, command, params in mud.get_commands():
+# 'look' command
+@commands.command("look", aliases=["l"])
+def look_command(id, params):
 
-        # if for any reason the player isn't in the player map, skip them and
-        # move on to the next one
-        if id not in active_players:
-            continue
+    # store the name of the player's current room
+    name = room_name(active_players[id].room)
 
-        # if the player hasn't given their name yet, use this first command as their name
-        if active_players[id]["name"] == "temp":
+    # send the player back the description of their current room
+    mud.send_message(id, room_description(name))
 
-            active_players[id]["name"] = command
-            active_players[id]["room"] = "Tavern"
+    playershere = []
+    # go through every player in the same room as the player
+    for pid in room_occupants.get(active_players[id].room, ()):
+        # add their name to the list
+        if active_players[pid].name is not None:
+            playershere.append(active_players[pid].name)
+
+    # send player a message containing the list of players in the room
+    if playershere is not None:
+        mud.send_message(id, "Players here: %s" % ", ".join(playershere))
+
+    # send player a message containing the list of exits from this room
+    mud.send_message(id, cached_message(("exits", name),
+                                        lambda: "Exits are: %s" % ", ".join(rooms[name]["exits"])))
+
+
+# 'go' command. Exit names can have spaces in them, so the words are joined
+# back together with single spaces
+@commands.command("go", args=ARGS_SPLIT)
+def go_command(id, params):
+
+    # store the exit name
+    ex = ' '.join(params)
+
+    # store the player's current room
+    here = active_players[id].room
+
+    # find the exits the player could mean. They can type the start of an
+    # exit's name, e.g. 'go drink' for 'go drink cabinet', as long as it
+    # doesn't also start the name of another exit
+    found = world.find_exits(here, ex)
+
+    # if exactly one exit matches
+    if len(found) == 1:
+        ex = found[0]
+
+        # take the player out of their current room, and tell everyone still
+        # there that the player left the room
+        leave_room(id)
+        send_to_room(here, "%s left via exit '%s'" % (active_players[id].name, ex))
+
+        # then move them into the room the exit leads to
+        arrive(id, room_name(world.target(here, ex)), ex)
+
+    # more than one exit starts with what they typed
+    elif found:
+        mud.send_message(id, "Which exit do you mean: %s?" % ", ".join(found))
+
+    # the specified exit wasn't found in the current room
+    else:
+        # send back an 'unknown exit' message
+        mud.send_message(id, "Unknown exit '%s'" % ex)
+
+
+def arrive(id, room, ex):
+
+    # tell everyone in the room that the player entered the room, then put the
+    # player in it. This is kept apart from 'go' so that when the game is split
+    # across processes, shards.py can hand the player over to the process
+    # looking after the room instead
+    send_to_room(room_id(room), "%s arrived via exit '%s'" % (active_players[id].name, ex))
+    enter_room(id, room)
+    save_player(id)
+
+    # send the player a message telling them where they are now
+    mud.send_message(id, "You arrive at '%s'" % room)
+
+
+def find_player(name):
+
+    # the id of the player in the game called 'name', ignoring case, or None if
+    # there's nobody called that
+    return player_ids.get(name.lower())
+
+
+def steps(route):
+
+    # how far away the end of a route is, in words
+    return "1 step" if len(route) == 1 else "%d steps" % len(route)
+
+
+# 'where' command. Says which room the player, or another player, is in
+@commands.command("where", args=ARGS_RAW)
+def where_command(id, params):
+
+    here = active_players[id].room
+    pid = find_player(params.strip()) if params.strip() else id
+    if pid == id:
+        mud.send_message(id, "You're in '%s'" % room_name(here))
+        return
+
+    # find the other player, and how far away they are
+    if pid is None:
+        mud.send_message(id, "There's nobody called '%s' in the game" % params.strip())
+        return
+    there = active_players[pid].room
+    route = world.route(here, there)
+    if route is None:
+        mud.send_message(id, "%s is in '%s', which you can't get to from here"
+                             % (active_players[pid].name, room_name(there)))
+    elif not route:
+        mud.send_message(id, "%s is here with you, in '%s'" % (active_players[pid].name, room_name(there)))
+    else:
+        mud.send_message(id, "%s is in '%s', %s away"
+                             % (active_players[pid].name, room_name(there), steps(route)))
+
+
+# 'path' command. Says the exits to go through to get to a room, which can be
+# given by the start of its name
+@commands.command("path", args=ARGS_RAW)
+def path_command(id, params):
+
+    found = world.find_rooms(params.strip())
+    if not found:
+        mud.send_message(id, "There's no room called '%s'" % params.strip())
+        return
+    if len(found) > 1:
+        mud.send_message(id, "Which room do you mean: %s?" % ", ".join(found))
+        return
+
+    route = world.route(active_players[id].room, room_id(found[0]))
+    if route is None:
+        mud.send_message(id, "You can't get to '%s' from here" % found[0])
+    elif not route:
+        mud.send_message(id, "You're already in '%s'" % found[0])
+    else:
+        mud.send_message(id, "To get to '%s' (%s): go %s"
+                             % (found[0], steps(route), ", go ".join(route)))
+
+
+# 'track' command. Says which exit to go through to get closer to a player
+@commands.command("track", args=ARGS_RAW)
+def track_command(id, params):
+
+    pid = find_player(params.strip())
+    if pid is None:
+        mud.send_message(id, "There's nobody called '%s' in the game" % params.strip())
+        return
+
+    route = world.route(active_players[id].room, active_players[pid].room)
+    if route is None:
+        mud.send_message(id, "You can't find a way to %s from here" % active_players[pid].name)
+    elif not route:
+        mud.send_message(id, "%s is right here" % active_players[pid].name)
+    else:
+        mud.send_message(id, "%s is %s away. Head through '%s'"
+                             % (active_players[pid].name, steps(route), route[0]))
+
+
+# 'shout' command. Everyone in the shout channel hears it, wherever they are
+@commands.command("shout", args=ARGS_RAW)
+def shout_command(id, params):
+
+    send_to_channel(SHOUT_CHANNEL, "%s shouts: %s" % (active_players[id].name, params))
+
+
+# 'tell' command. Says something to one other player, wherever they are
+@commands.command("tell", args=ARGS_RAW)
+def tell_command(id, params):
+
+    # the first word is who it's for, and the rest is the message
+    name, space, message = params.strip().partition(" ")
+    if not message:
+        mud.send_message(id, "Usage: tell <player> <message>")
+        return
+
+    pid = find_player(name)
+    if pid is None:
+        mud.send_message(id, "There's nobody called '%s' in the game" % name)
+        return
+    mud.send_message(pid, "%s tells you: %s" % (active_players[id].name, message))
+    mud.send_message(id, "You tell %s: %s" % (active_players[pid].name, message))
+
+
+# 'who' command. Lists everyone in the game. The list is the same for
+# everyone, so it's put together once and kept until someone enters or leaves
+@commands.command("who")
+def who_command(id, params):
+
+    mud.send_message(id, cached_message("who", who_list))
+
+
+def who_list():
+
+    # the names of the players in the game, in order. If there are lots of
+    # them, only the first few are given
+    names = sorted(pl.name for pl in active_players.values())
+    if len(names) > WHO_NAMES:
+        names[WHO_NAMES:] = ["and %d others" % (len(names) - WHO_NAMES)]
+    return "Players in the game (%d): %s" % (len(active_players), ", ".join(names))
+
+
+# 'join' command. Joins a channel, starting it if nobody's in it yet
+@commands.command("join", args=ARGS_SPLIT)
+def join_command(id, params):
+
+    if len(params) != 1:
+        mud.send_message(id, "Usage: join <channel>")
+        return
+    name = params[0].lower()
+
+    # the channel's name is typed to talk on it, so it mustn't be one of the
+    # commands, apart from 'shout', which talks on the channel for shouts
+    if name != SHOUT_CHANNEL and commands.find(name) is not None:
+        mud.send_message(id, "'%s' is a command, so it can't be a channel's name" % name)
+    elif channels.join(id, name):
+        mud.send_message(id, "You join the '%s' channel. Type '%s <message>' to talk on it"
+                             % (name, name))
+    else:
+        mud.send_message(id, "You're already in the '%s' channel" % name)
+
+
+# 'leave' command. Leaves a channel
+@commands.command("leave", args=ARGS_SPLIT)
+def leave_command(id, params):
+
+    if len(params) != 1:
+        mud.send_message(id, "Usage: leave <channel>")
+    elif channels.leave(id, params[0]):
+        mud.send_message(id, "You leave the '%s' channel" % params[0].lower())
+    else:
+        mud.send_message(id, "You're not in the '%s' channel" % params[0].lower())
+
+
+# 'channels' command. Lists the channels the player's in, and how many people
+# are in each
+@commands.command("channels")
+def channels_command(id, params):
+
+    joined = sorted(channels.joined(id))
+    if not joined:
+        mud.send_message(id, "You're not in any channels. Type 'join <channel>' to join one")
+        return
+    mud.send_message(id, "Your channels: %s" % ", ".join(
+        "%s (%d)" % (name, len(channels.members(name))) for name in joined))
+
+
+# 'room' command. The description has spaces in it, so it's given in quotes
+@commands.command("room", args=ARGS_QUOTED,
+                  usage="room <name> <\"Description.\"> <existing room>")
+def room_command(id, params):
+
+    # make sure we've been given a name, a description and an existing room to
+    # connect the new room to
+    if len(params) < 3 or params[2] not in rooms:
+        mud.send_message(id, "Usage: room <name> <\"Description.\"> <existing room>")
+        return
+
+    # a room keeps its number when it's replaced, so anyone already in a room
+    # which is replaced here stays in the room of the same name
+    # create the new room with an exit to the existing one, and add an exit
+    # back to the existing room
+    linked = rooms[params[2]]
+    linked["exits"][params[0]] = params[0]
+    save_rooms({
+        params[0]: {"description": params[1], "exits": {''.join(params[2]).lower(): params[2]}},
+        params[2]: linked,
+    })
+
+
+# 'stop' command
+@commands.command("stop")
+def stop_command(id, params):
+
+    global stopping
+
+    # send everyone connected a message to tell them the server's stopping
+    mud.send_to_many(sessions, "The server is shutting down! Bye!")
+
+    # make sure all the players are saved before we go
+    players.flush()
+    mud.shutdown()
+
+    # and end the main game loop
+    stopping = True
+
+
+# 'restart' command. Only admins can use it. The game is started again,
+# picking up any changes to its code and world, without anyone being
+# disconnected
+@commands.command("restart")
+def restart_command(id, params):
+
+    if active_players[id].name not in admins:
+        mud.send_message(id, "Unknown command 'restart'")
+        return
+    if not restartable:
+        mud.send_message(id, "The server can't restart itself with --asyncio or --workers")
+        return
+    problem = restart()
+    mud.send_message(id, "The restart failed: %s" % problem)
+
+
+def restart():
+
+    # tell everyone what's happening, and make sure everything's saved. The
+    # stores are flushed rather than closed, so that if the new copy of the
+    # program can't be started, the game can carry on as it was. In that case
+    # the reason is returned
+    mud.send_to_many(sessions, "The server is restarting, back in a moment...")
+    path = None
+    try:
+        players.flush()
+        rooms.flush()
+
+        # write out the server's connections, the players in the game and
+        # where everyone is in their session for the new copy of the program
+        # to pick up. The connections themselves stay open
+        fd, path = tempfile.mkstemp(prefix="simplemud-", suffix=".restart")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"server": mud.hand_over(), "players": active_players, "sessions": sessions,
+                         "pending": (connecting, entered, departed, leaving),
+                         "channels": channels}, f)
+
+        # then replace this program with a new copy of it, started with the
+        # same options, apart from any '--resume' we were started with
+        # ourselves
+        argv = []
+        skip = False
+        for arg in sys.argv:
+            if skip:
+                skip = False
+            elif arg == "--resume":
+                skip = True
+            elif not arg.startswith("--resume="):
+                argv.append(arg)
+        os.execv(sys.executable, [sys.executable] + argv + ["--resume", path])
+
+    # if we get here, something went wrong, e.g. the disk is full or the
+    # program couldn't be started. Nothing's been closed, so we carry on
+    except OSError as e:
+        if path is not None:
             try:
-                if players[command] is not None:
-                    t_room = players[command]["room"]
-                    t_inv = players[command]["inventory"]
-                    active_players[id] = {"name": command, "room": t_room, "inventory": t_inv}
-            except KeyError:
+                os.remove(path)
+            except OSError:
                 pass
+        mud.send_to_many(sessions, "The server couldn't restart after all. Carry on!")
+        return str(e)
 
-            # go through all the players in the game
-            for pid, pl in active_players.items():
-                if active_players[id]["name"] != "temp":
-                    # send each player a message to tell them about the new player
-                    mud.send_message(pid, "%s entered the game" % active_players[id]["name"])
-
-            # send the new player a welcome message
-            mud.send_message(id, "Welcome to the game, %s. Type 'help' for a list of commands."
-                                 " Have fun!" % active_players[id]["name"])
-
-            # send the new player the description of their current room
-            mud.send_message(id, rooms[active_players[id]["room"]]["description"])
-
-        # each of the possible commands is handled below. Try adding new commands
-        # to the game!
-        else:
-            command.lower()
-            # 'help' command
-            if command == "help":
-
-                # send the player back the list of possible commands
-                mud.send_message(id, "Commands:")
-                mud.send_message(id, "  say <message>  - Says something out loud, e.g. 'say Hello'")
-                mud.send_message(id, "  look           - Examines the surroundings, e.g. 'look'")
-                mud.send_message(id, "  go <exit>      - Moves through the exit specified, e.g. 'go outside'")
-                mud.send_message(id, "  room <name> <'Description.'> <exit>  - Creates a room with the given "
-                                     "description and an exit to and from the given location.")
-
-            # 'say' command
-            elif command == "say":
-
-                # go through every player in the game
-                for pid, pl in active_players.items():
-                    # if they're in the same room as the player
-                    if active_players[pid]["room"] == active_players[id]["room"]:
-                        # send them a message telling them what the player said
-                        mud.send_message(pid, "%s says: %s" % (active_players[id]["name"], ' '.join(params)))
-
-            # 'look' command
-            elif command == "look":
-
-                # store the player's current room
-                rm = rooms[active_players[id]["room"]]
-
-                # send the player back the description of their current room
-                mud.send_message(id, rm["description"])
-
-                playershere = []
-                # go through every player in the game
-                for pid, pl in active_players.items():
-                    # if they're in the same room as the player
-                    if active_players[pid]["room"] == active_players[id]["room"]:
-                        # add their name to the list
-                        if active_players[pid]["name"] is not None:
-                            playershere.append(active_players[pid]["name"])
-
-                print(len(playershere))
-                # send player a message containing the list of players in the room
-                if playershere is not None:
-                    mud.send_message(id, "Players here: %s" % ", ".join(playershere))
-
-                # send player a message containing the list of exits from this room
-                mud.send_message(id, "Exits are: %s" % ", ".join(rm["exits"]))
-
-            # 'go' command
-            elif command == "go":
-
-                # store the exit name
-                ex = ' '.join(params)
-
-                # store the player's current room
-                rm = rooms[active_players[id]["room"]]
-
-                # if the specified exit is found in the room's exits list
-                if ex in rm["exits"]:
-
-                    # go through all the players in the game
-                    for pid, pl in active_players.items():
-                        # if player is in the same room and isn't the player sending the command
-                        if active_players[pid]["room"] == active_players[id]["room"] and pid != id:
-                            # send them a message telling them that the player left the room
-                            mud.send_message(pid, "%s left via exit '%s'" % (active_players[id]["name"], ex))
-
-                    # update the player's current room to the one the exit leads to
-                    active_players[id]["room"] = rm["exits"][ex]
-                    rm = rooms[active_players[id]["room"]]
-
-                    # go through all the players in the game
-                    for pid, pl in active_players.items():
-                        # if player is in the same (new) room and isn't the player sending the command
-                        if active_players[pid]["room"] == active_players[id]["room"] and pid != id:
-                            # send them a message telling them that the player entered the room
-                            mud.send_message(pid, "%s arrived via exit '%s'" % (active_players[id]["name"], ex))
-
-                    # send the player a message telling them where they are now
-                    mud.send_message(id, "You arrive at '%s'" % active_players[id]["room"])
-
-                # the specified exit wasn't found in the current room
-                else:
-                    # send back an 'unknown exit' message
-                    mud.send_message(id, "Unknown exit '%s'" % ex)
 
-            elif command == "room":
+def hangup_signalled(wakeup):
+
+    # called when the socket signals are written to has something to read. A
+    # hangup signal, e.g. from 'kill -HUP', restarts the game
+    if signal.SIGHUP in wakeup.recv(64):
+        print("The restart failed: %s" % restart(), file=sys.stderr)
 
-                rooms[params[0]] = {"description": params[1], "exits": {''.join(params[2]).lower(): params[2]}}
-                rooms[params[2]]["exits"][params[0]] = params[0]
 
-                with open('world.json', 'w') as outfile:
-                    json.dump(rooms, outfile, sort_keys=True, indent=4, ensure_ascii=False)
+# 'give' command
+@commands.command("give", args=ARGS_RAW)
+def give_command(id, params):
 
-            elif command == "stop":
-                # go through all the players in the game
-                for pid, pl in active_players.items():
-                    # send each player a message to tell them about the disconnected player
-                    mud.send_message(pid, "The server is shutting down! Bye!")
+    active_players[id].inventory.append(params)
+    save_player(id)
 
-                save_players()
-                with open('players.json', 'w') as outfile:
-                    json.dump(players, outfile, sort_keys=True, indent=4, ensure_ascii=False)
-                mud.shutdown()
 
-            elif command == "give":
-                it = ' '.join(params)
-                active_players[id]["inventory"].append(it)
+# 'stats' command. Only admins can use it, and only if the server's being
+# measured. Anyone else is told there's no such command
+@commands.command("stats")
+def stats_command(id, params):
+
+    if metrics is None or active_players[id].name not in admins:
+        mud.send_message(id, "Unknown command 'stats'")
+        return
+
+    # send the player how long each part of an update has been taking, how
+    # long each command takes to handle, and how much is waiting to be done
+    mud.send_message(id, "\n\r".join(metrics.report(mud.queue_depths())))
+
+
+def write_metrics(path):
+
+    # write everything measured so far to the metrics file, for other programs
+    # to read
+    metrics.write(path, mud.queue_depths())
+
+
+def main():
+
+    global rooms, players, mud, metrics, admins, restartable, channels
+
+    parser = argparse.ArgumentParser(description="A simple Multi-User Dungeon (MUD) game.")
+    parser.add_argument("port", nargs="?", type=int, default=23,
+                        help="the port to listen on (default 23, the standard telnet port, "
+                             "which needs root)")
+    parser.add_argument("--host", default="0.0.0.0",
+                        help="the address of the network interface to listen on "
+                             "(default 0.0.0.0, meaning all of them)")
+    parser.add_argument("--backlog", type=int, default=4096,
+                        help="how many players can be waiting to connect at once")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="let other servers listen on the same port at the same time")
+    parser.add_argument("--idle-timeout", type=float, metavar="SECONDS",
+                        help="disconnect players who don't type anything for this long")
+    parser.add_argument("--keepalive", type=float, default=60, metavar="SECONDS",
+                        help="check a quiet connection is still there after this long (0 to never check)")
+    parser.add_argument("--compression", type=int, default=6, metavar="LEVEL",
+                        help="how hard to compress the output of players whose client supports "
+                             "MCCP, from 1 (fastest) to 9 (smallest), or 0 not to offer it "
+                             "(default 6, not used with --asyncio)")
+    parser.add_argument("--admin", action="append", default=[], metavar="NAME",
+                        help="let the player with this name use admin commands, e.g. 'stats' "
+                             "(can be given more than once)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="measure what the server spends its time on, and write it to "
+                             "this file as JSON every --metrics-interval seconds")
+    parser.add_argument("--metrics-interval", type=float, default=10, metavar="SECONDS",
+                        help="how often to write the metrics file (default 10)")
+    parser.add_argument("--sqlite", metavar="DATABASE",
+                        help="keep the world and players in this SQLite database, created "
+                             "from the JSON files with sqlitestore.py, instead of in the JSON files")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run the server on asyncio in a background thread, which copes "
+                             "better with very large numbers of players")
+    parser.add_argument("--workers", type=int, default=0, metavar="N",
+                        help="share the rooms out between N worker processes, so that the "
+                             "game can use more than one CPU core (Linux and Unix only)")
+    parser.add_argument("--resume", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.workers and args.asyncio:
+        parser.error("--workers can't be used with --asyncio")
+
+    # the worker processes start off as copies of this one, so they're started
+    # before anything else, e.g. the stores' background threads, which they
+    # shouldn't have copies of
+    if args.workers:
+        workers = ZoneWorkers(sys.modules[__name__], args.workers)
+
+    # if we're using a database, rooms and players are loaded from it as
+    # they're needed, so there's nothing to load up front
+    if args.sqlite:
+        rooms = SqliteStore(args.sqlite, "rooms")
+        players = SqliteStore(args.sqlite, "players")
+
+    else:
+        # load the rooms in the game from the world file. Changes made by the
+        # 'room' command are added to a log next to it, which is played back
+        # here, and every so often the whole world is written out again in the
+        # background
+        rooms = JournalStore('world.json')
+        # open the saved players. If there's no file yet, we start with no players
+        players = JournalStore('players.json')
+
+    # note where the exits from every room lead, so that players can find
+    # their way around. With a database, this is the one time every room is
+    # read, all in one go rather than one at a time, and without filling up
+    # its cache
+    world.update(dict((name, room["exits"]) for name, room in rooms.items()))
+
+    # players' names are always in lower case, since the server lowers the
+    # first word of everything typed, so the admins' names are too
+    admins = set(name.lower() for name in args.admin)
+
+    # the server and game only measure themselves if someone's going to look.
+    # Otherwise it costs nothing
+    if args.admin or args.metrics:
+        metrics = Metrics()
+        commands.metrics = metrics
+
+    # start the server. Both kinds of server are used in exactly the same way
+    options = {"host": args.host, "backlog": args.backlog, "reuse_port": args.reuse_port,
+               "idle_timeout": args.idle_timeout, "keepalive_idle": args.keepalive or None,
+               "metrics": metrics}
+
+    # if we've been started by 'restart', carry on with the connections and
+    # players it left us
+    resumed = None
+    if args.resume:
+        with open(args.resume, "rb") as f:
+            resumed = pickle.load(f)
+        os.remove(args.resume)
+        options["resume"] = resumed["server"]
+
+    if args.asyncio:
+        from asyncmudserver import SyncMudServer
+        mud = SyncMudServer(args.port, **options)
+    else:
+        mud = MudServer(args.port, compression=args.compression or None, **options)
+
+    if resumed is not None:
+        for id, pl in resumed["players"].items():
+            # copies of the game from before sessions were kept pass on the
+            # players who hadn't given their name yet too, without a room
+            if pl.room is None:
+                sessions[id] = NAMING
+                continue
+            active_players[id] = pl
+            sessions[id] = PLAYING
+            join_game(id)
+            enter_room(id, room_name(pl.room))
+        sessions.update(resumed.get("sessions", {}))
+        # everyone's channels are carried over as they were, if the copy we're
+        # taking over from had them
+        if "channels" in resumed:
+            channels = resumed["channels"]
+        for waiting, saved in zip((connecting, entered, departed, leaving), resumed.get("pending", ())):
+            waiting.extend(saved)
+
+    # the game can restart itself when it's all in this process. A hangup
+    # signal restarts it too. Signals are written to a socket the server
+    # watches, so that the restart happens as part of an update
+    restartable = not args.asyncio and not args.workers
+    if restartable and hasattr(signal, "SIGHUP"):
+        wakeup, wakeup_writer = socket.socketpair()
+        wakeup_writer.setblocking(False)
+        signal.signal(signal.SIGHUP, lambda signum, frame: None)
+        signal.set_wakeup_fd(wakeup_writer.fileno())
+        mud.watch(wakeup, lambda: hangup_signalled(wakeup))
+
+    # write the metrics out every so often, if we've been asked to
+    if args.metrics:
+        mud.call_every(args.metrics_interval, write_metrics, args.metrics)
+
+    try:
+        # if the game is split across processes, the workers run it from here
+        if args.workers:
+            workers.run(mud)
+            return
+
+        # main game loop. We loop until the 'stop' command is used, or the
+        # program is terminated
+        while not stopping:
+
+            # 'update' must be called in the loop to keep the game running and
+            # give us up-to-date information. Passing a timeout of None means it
+            # sleeps until something actually happens, so players get a reply as
+            # soon as they type something and we don't use any CPU time while
+            # nobody does
+            mud.update(timeout=None)
+
+            # go through everything that's happened since the last update, in
+            # the order it happened: newly connected players, recently
+            # disconnected players and new commands sent from players
+            for event in mud.drain_events():
+                if stopping:
+                    break
+                if type(event) is Command:
+                    player_command(event.id, event.command, event.params)
+                elif type(event) is NewPlayer:
+                    new_player(event.id)
+                else:
+                    player_left(event.id)
 
-            # some other, unrecognised command
-            else:
-                # send back an 'unknown command' message
-                mud.send_message(id, "Unknown command '%s'" % command)
+            # then ask new players for their name, and tell everyone who's
+            # entered and left the game
+            if not stopping:
+                end_update()
 
-        save_players()
+    # whatever happens, make sure any unsaved changes to players are written
+    finally:
+        players.close()
+        rooms.close()
 
-    def save_players():
 
-        for pid in active_players:
-            t_name = active_players[pid]["name"]
-            t_room = active_players[pid]["room"]
-            t_inv = active_players[pid]["inventory"]
-            players[t_name] = {"room": t_room, "inventory": t_inv}
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Keeping game data in an SQLite database.
+
+Contains one class, SqliteStore, which holds records such as rooms or player
+accounts in a database table and only loads them when they're asked for. It
+can be used in place of loading everything from JSON files when the game
+starts, so that starting up doesn't take longer as the world gets bigger.
+
+Run this module to copy the JSON files into a database:
+
+    python sqlitestore.py mud.db [world.json] [players.json]
+"""
+
+
+import sys
+import json
+import sqlite3
+import collections
+
+from persistence import JournalStore
+
+
+class SqliteStore(object):
+    """
+    A table of records in an SQLite database, looked up by name.
+
+    Records are read from the database the first time they're asked for, and
+    the most recently used 'cache_size' of them are kept in memory. Changes
+    are written to the database straight away by 'put'. The database is used
+    in write-ahead log mode, so writes are cheap and don't block reads.
+    """
+
+    table = ""      # the name of the database table the records are in
+    _db = None      # the connection to the database
+    _cache = None   # the most recently used records, least recent first
+    _cache_size = 0 # how many records to keep in the cache
+
+    def __init__(self, path, table, cache_size=10000):
+        """
+        Opens the table called 'table' in the database file 'path', creating
+        either of them if they don't exist yet.
+        """
+        self.table = table
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, data TEXT NOT NULL)" % table)
+        self._db.commit()
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        record = self.get(name)
+        if record is None:
+            raise KeyError(name)
+        return record
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+    def __iter__(self):
+        # the names are fetched all at once, so that records can be looked up
+        # while going through them
+        return iter([row[0] for row in self._db.execute("SELECT name FROM %s" % self.table)])
+
+    def items(self):
+        """
+        Goes through every record, giving its name and the record, in a single
+        pass over the table. The records aren't added to the cache, so this can
+        be used to look at the whole of a big table once, e.g. when the game
+        starts, without throwing out the records that are in use.
+        """
+        for name, data in self._db.execute("SELECT name, data FROM %s" % self.table):
+            yield name, json.loads(data)
+
+    def get(self, name, default=None):
+        """
+        Returns the record with the given name, or 'default' if there isn't one.
+        """
+        # if it's in the cache, mark it as the most recently used
+        record = self._cache.get(name)
+        if record is not None:
+            self._cache.move_to_end(name)
+            return record
+
+        # otherwise load it from the database
+        row = self._db.execute("SELECT data FROM %s WHERE name = ?" % self.table, (name,)).fetchone()
+        if row is None:
+            return default
+        record = json.loads(row[0])
+        self._remember(name, record)
+        return record
+
+    def put(self, name, record):
+        """
+        Stores 'record' under the given name, writing it to the database.
+        """
+        self._db.execute("INSERT OR REPLACE INTO %s (name, data) VALUES (?, ?)" % self.table,
+                         (name, json.dumps(record, sort_keys=True, ensure_ascii=False)))
+        self._db.commit()
+        self._remember(name, record)
+
+    def put_many(self, records):
+        """
+        Stores every record in the dictionary 'records' in a single transaction.
+        """
+        self._db.executemany("INSERT OR REPLACE INTO %s (name, data) VALUES (?, ?)" % self.table,
+                             ((name, json.dumps(record, sort_keys=True, ensure_ascii=False))
+                              for name, record in records.items()))
+        self._db.commit()
+
+    def flush(self):
+        """
+        Does nothing, since 'put' writes straight away. It's here so that the
+        store can be used in place of a JournalStore.
+        """
+        pass
+
+    def close(self):
+        """
+        Closes the connection to the database.
+        """
+        self._db.close()
+
+    def _remember(self, name, record):
+
+        # add the record to the cache as the most recently used, and throw out
+        # the least recently used one if the cache is full
+        self._cache[name] = record
+        self._cache.move_to_end(name)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+
+def import_json(db_path, world_path="world.json", players_path="players.json"):
+    """
+    Copies the rooms in the JSON file 'world_path' and the players in the JSON
+    file 'players_path' (along with its journal, if there is one) into the
+    SQLite database 'db_path'.
+    """
+    with open(world_path, encoding="utf-8") as f:
+        rooms = json.load(f)
+    players = JournalStore.read(players_path)
+
+    store = SqliteStore(db_path, "rooms")
+    store.put_many(rooms)
+    store.close()
+    store = SqliteStore(db_path, "players")
+    store.put_many(players)
+    store.close()
+
+    return len(rooms), len(players)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__.strip().split("\n\n")[-1].strip())
+        sys.exit(1)
+    print("Imported %d rooms and %d players" % import_json(*sys.argv[1:4]))
@@ -1 +1 @@
-sudo python3 ./simplemud.py
+python3 ./simplemud.py 4000
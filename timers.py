@@ -0,0 +1,205 @@
+"""
+Scheduling things to happen later in a MUD game.
+
+Contains one class, TimerWheel, which keeps track of any number of timers, such
+as an idle timeout for every player or a game event like a change in the weather,
+and calls each one's function when it's due.
+"""
+
+
+import time
+
+
+class Timer(object):
+    """
+    A function waiting to be called, as returned by TimerWheel.call_later and
+    TimerWheel.call_every.
+    """
+
+    # there can be a timer for every player, so they're kept small by only
+    # allowing these attributes (see MudServer.Client)
+    __slots__ = (
+        "due",        # the tick of the wheel at which the timer is due
+        "interval",   # for a repeating timer, how many ticks between calls
+        "callback",   # the function to call
+        "args",       # the parameters to call it with
+        "cancelled",  # whether the timer has been cancelled
+    )
+
+    def __init__(self, due, interval, callback, args):
+        self.due = due
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stops the timer, so its function isn't called again.
+        """
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """
+    Calls functions at the times they're scheduled for, however many of them
+    there are.
+
+    Time is split into ticks of 'resolution' seconds, and each timer is put in
+    a slot for the tick it's due on, so scheduling one takes the same time
+    however many others there are, and 'run_due' only looks at the timers which
+    are actually due. A single wheel of slots would have to be enormous to hold
+    timers for days ahead, so there are several: the first has a slot for each
+    of the next 256 ticks, the next a slot for each run of 256 ticks after that,
+    and so on, like the hands of a clock. Timers are moved down to a finer
+    wheel as their time gets closer.
+    """
+
+    # how many slots, as a power of two, each wheel has, from the finest up.
+    # With the default resolution these cover about 25 seconds, 27 minutes, 29
+    # hours and 78 days. Anything further ahead waits in the last wheel and is
+    # looked at again every 78 days until it's due
+    _WHEEL_BITS = (8, 6, 6, 6)
+
+    _resolution = 0     # how many seconds each tick lasts
+    _start = 0          # when tick 0 was
+    _tick = 0           # the last tick whose timers have been run
+    _wheels = []        # for each wheel, a list of its slots, each a list of timers
+    _shifts = []        # for each wheel, how many bits of a tick number come before its slot number
+    _count = 0          # how many timers are waiting, including cancelled ones not yet thrown away
+
+    def __init__(self, resolution=0.1):
+        """
+        Constructs an empty TimerWheel, where timers go off to the nearest
+        'resolution' seconds.
+        """
+        self._resolution = resolution
+        self._start = time.monotonic()
+        self._tick = 0
+        self._count = 0
+        self._wheels = []
+        self._shifts = []
+        shift = 0
+        for bits in self._WHEEL_BITS:
+            self._wheels.append([[] for slot in range(1 << bits)])
+            self._shifts.append(shift)
+            shift += bits
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, delay, callback, *args):
+        """
+        Calls 'callback' with the given parameters once 'delay' seconds have
+        passed. Returns a Timer, which can be used to cancel the call.
+        """
+        timer = Timer(self._due(delay), 0, callback, args)
+        self._add(timer)
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """
+        Calls 'callback' with the given parameters every 'interval' seconds,
+        starting 'interval' seconds from now. Returns a Timer, which can be used
+        to stop the calls.
+        """
+        timer = Timer(self._due(interval), max(1, round(interval / self._resolution)), callback, args)
+        self._add(timer)
+        return timer
+
+    def run_due(self):
+        """
+        Calls the functions of all the timers which are now due.
+        """
+        now = int((time.monotonic() - self._start) / self._resolution)
+
+        # with no timers at all there's nothing to go through, so skip straight
+        # to the current tick
+        if not self._count:
+            self._tick = max(self._tick, now)
+            return
+
+        while self._tick < now:
+            self._tick += 1
+            tick = self._tick
+
+            # when a wheel comes round to the start, the next slot of the wheel
+            # above is due to be looked at. Its timers are now close enough to
+            # be put in the finer wheels, or run if they're due right now
+            for level in range(1, len(self._wheels)):
+                if tick & ((1 << self._shifts[level]) - 1):
+                    break
+                slots = self._wheels[level]
+                number = (tick >> self._shifts[level]) & (len(slots) - 1)
+                timers = slots[number]
+                slots[number] = []
+                for timer in timers:
+                    self._count -= 1
+                    if not timer.cancelled:
+                        self._add(timer)
+
+            # run the timers due on this tick
+            slots = self._wheels[0]
+            number = tick & (len(slots) - 1)
+            timers = slots[number]
+            if not timers:
+                continue
+            slots[number] = []
+            for timer in timers:
+                self._count -= 1
+                if timer.cancelled:
+                    continue
+                timer.callback(*timer.args)
+                # repeating timers go back in for their next time, unless
+                # the function cancelled them. If we've fallen behind, e.g.
+                # because the game was busy, the missed calls are skipped
+                # rather than all made at once
+                if timer.interval and not timer.cancelled:
+                    timer.due = now + timer.interval
+                    self._add(timer)
+
+    def next_due(self):
+        """
+        Returns how many seconds it will be until 'run_due' may have timers to
+        run, or None if there are no timers at all.
+        """
+        if not self._count:
+            return None
+
+        # look through the slots of the finest wheel up to where it next comes
+        # round to the start. If they're all empty, there's nothing to do
+        # before then, when some timers may be moved down from the next wheel
+        slots = self._wheels[0]
+        mask = len(slots) - 1
+        tick = self._tick + 1
+        while tick & mask:
+            if slots[tick & mask]:
+                break
+            tick += 1
+        return max(0.0, self._start + tick * self._resolution - time.monotonic())
+
+    def _due(self, delay):
+
+        # the tick on which a timer due 'delay' seconds from now should go off,
+        # rounded up so it's never early. It's after the last tick that was run,
+        # which may be a while ago if 'run_due' hasn't been called lately
+        due = -int(-(time.monotonic() - self._start + delay) // self._resolution)
+        return max(self._tick + 1, due)
+
+    def _add(self, timer):
+
+        self._count += 1
+        ahead = timer.due - self._tick
+
+        # put the timer in the finest wheel that reaches far enough ahead
+        for level, slots in enumerate(self._wheels):
+            shift = self._shifts[level]
+            if ahead < (len(slots) << shift):
+                slots[(timer.due >> shift) & (len(slots) - 1)].append(timer)
+                return
+
+        # it's further ahead than all of the wheels reach, so put it in the slot
+        # of the last wheel which will be looked at last
+        slots = self._wheels[-1]
+        shift = self._shifts[-1]
+        slots[((self._tick >> shift) - 1) & (len(slots) - 1)].append(timer)
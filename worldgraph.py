@@ -0,0 +1,242 @@
+"""
+The layout of a MUD game's world: which rooms there are, and where their exits
+lead.
+
+Contains one class, WorldGraph, which gives each room a number and keeps the
+exits from each room as a compact array of the numbers of the rooms they lead
+to. Routes between rooms are found by searching outwards from the starting
+room, and rooms can be found by the start of their name, so that none of this
+means going through every room in the game's room dictionaries.
+"""
+
+
+import sys
+import array
+import bisect
+import collections
+
+
+class WorldGraph(object):
+    """
+    The rooms in a game and the exits between them.
+
+    Every room the graph comes across, whether it's been told about the room or
+    just seen an exit lead to it, is given a number, starting from 0. The graph
+    is told about rooms with 'update', given each room's exits, and can be
+    updated again whenever rooms change, e.g. when a room is added by the game.
+    """
+
+    # how many of the routes found by 'route' are kept, in case they're asked
+    # for again. They're all forgotten when the world changes
+    ROUTE_CACHE_SIZE = 1024
+
+    ids = {}          # maps room name to number
+    names = []        # the name of each numbered room
+    _exits = []       # the names of each room's exits, or None if we've not been told about the room
+    _targets = []     # array of the numbers of the rooms each room's exits lead to, in the same order
+    _index = []       # (name in lower case, name) for each room we've been told about, in order
+    _routes = None    # the routes found recently. Maps (from, to) to a tuple of exit names, or None
+
+    def __init__(self):
+        """
+        Constructs a WorldGraph with no rooms in it.
+        """
+        self.ids = {}
+        self.names = []
+        self._exits = []
+        self._targets = []
+        self._index = []
+        self._routes = collections.OrderedDict()
+
+    def __len__(self):
+        """
+        Returns the number of rooms the graph has been told about.
+        """
+        return len(self._index)
+
+    def room_id(self, name):
+        """
+        Returns the number of the room called 'name', giving it a new number if
+        it hasn't got one yet. None stands for no room at all.
+        """
+        if name is None:
+            return None
+        number = self.ids.get(name)
+        if number is None:
+            number = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self._exits.append(None)
+            self._targets.append(None)
+        return number
+
+    def room_name(self, number):
+        """
+        Returns the name of the room with the number 'number'.
+        """
+        if number is None:
+            return None
+        return self.names[number]
+
+    def update(self, changed):
+        """
+        Notes the exits of the rooms in 'changed', a dictionary which maps room
+        name to the room's exits, as a dictionary of exit name to the name of
+        the room it leads to. The rooms' old exits, if any, are replaced.
+        """
+        added = []
+        for name, exits in changed.items():
+            number = self.room_id(name)
+            if self._exits[number] is None:
+                added.append((name.lower(), name))
+            # exit names such as 'north' are used over and over, so only one
+            # copy of each is kept
+            names = tuple(sys.intern(ex) for ex in exits)
+            self._exits[number] = names
+            self._targets[number] = array.array("i", [self.room_id(exits[ex]) for ex in names])
+
+        # a single new room is put straight into place in the index, and lots
+        # of them, e.g. the whole world, are put in order all at once
+        if len(added) == 1:
+            bisect.insort(self._index, added[0])
+        elif added:
+            self._index.extend(added)
+            self._index.sort()
+
+        # any route might have changed
+        self._routes.clear()
+
+    def exits(self, number):
+        """
+        Returns the names of the exits from the room with the number 'number',
+        or an empty tuple if we've not been told about the room.
+        """
+        return self._exits[number] or () if number is not None else ()
+
+    def target(self, number, ex):
+        """
+        Returns the number of the room which the exit called 'ex' from the room
+        with the number 'number' leads to.
+        """
+        return self._targets[number][self._exits[number].index(ex)]
+
+    def find_exits(self, number, text):
+        """
+        Returns a list of the exits from the room with the number 'number' which
+        the player might mean by 'text'. That's the exit called 'text' if there
+        is one, and otherwise any whose name starts with 'text', ignoring case,
+        e.g. 'drink' for 'drink cabinet'. Nothing at all doesn't mean any exit.
+        """
+        if not text.strip():
+            return []
+        # a room only has a handful of exits, so they're simply gone through
+        exits = self.exits(number)
+        if text in exits:
+            return [text]
+        text = text.lower()
+        same = [ex for ex in exits if ex.lower() == text]
+        if same:
+            return same
+        return [ex for ex in exits if ex.lower().startswith(text)]
+
+    def find_rooms(self, text, limit=10):
+        """
+        Returns a list of the names of the rooms the player might mean by
+        'text', at most 'limit' of them. That's the room called 'text' if there
+        is one, and otherwise any whose name starts with 'text', ignoring case.
+        Nothing at all doesn't mean any room.
+        """
+        if not text.strip():
+            return []
+        number = self.ids.get(text)
+        if number is not None and self._exits[number] is not None:
+            return [text]
+
+        # the index is in order, so the rooms starting with the text are all
+        # together, starting where the text itself would go
+        text = text.lower()
+        index = self._index
+        found = []
+        position = bisect.bisect_left(index, (text,))
+        while position < len(index) and index[position][0].startswith(text):
+            if index[position][0] == text:
+                return [index[position][1]]
+            if len(found) < limit:
+                found.append(index[position][1])
+            position += 1
+        return found
+
+    def route(self, start, goal):
+        """
+        Returns a tuple of the names of the exits to go through, one after the
+        other, to get from the room with the number 'start' to the room with the
+        number 'goal' in as few steps as possible, or None if it can't be done.
+        """
+        if start == goal:
+            return ()
+        key = (start, goal)
+        routes = self._routes
+        if key in routes:
+            routes.move_to_end(key)
+            return routes[key]
+
+        route = self._search(start, goal)
+        routes[key] = route
+        if len(routes) > self.ROUTE_CACHE_SIZE:
+            routes.popitem(last=False)
+        return route
+
+    def nearby(self, start, steps):
+        """
+        Returns a dictionary which maps the number of each room which can be
+        reached from the room with the number 'start' in at most 'steps' steps
+        to how many steps it takes.
+        """
+        distances = {start: 0}
+        frontier = [start]
+        targets = self._targets
+        for step in range(1, steps + 1):
+            reached = []
+            for room in frontier:
+                for to in targets[room] or ():
+                    if to not in distances:
+                        distances[to] = step
+                        reached.append(to)
+            frontier = reached
+        return distances
+
+    def _search(self, start, goal):
+
+        # search outwards from the start a step at a time, noting how we got to
+        # each room, until we reach the goal. Only the rooms closer to the start
+        # than the goal are looked at, however big the world is
+        came_from = {start: None}
+        frontier = [start]
+        targets = self._targets
+        while frontier:
+            reached = []
+            for room in frontier:
+                leads = targets[room]
+                if leads is None:
+                    continue
+                for position, to in enumerate(leads):
+                    if to in came_from:
+                        continue
+                    came_from[to] = (room, position)
+                    if to == goal:
+                        return self._walk_back(came_from, goal)
+                    reached.append(to)
+            frontier = reached
+        return None
+
+    def _walk_back(self, came_from, goal):
+
+        # follow the way we came from the goal back to the start, then turn it
+        # round
+        route = []
+        step = came_from[goal]
+        while step is not None:
+            room, position = step
+            route.append(self._exits[room][position])
+            step = came_from[room]
+        route.reverse()
+        return tuple(route)